@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Tree Analytics
+Aggregate statistics over a whole tree, computed on NumPy columns rather than
+by looping over person dicts
+
+The tree is read once into arrays (years, gender codes, edge endpoints as row
+numbers); generation depths and branches then come from one level-by-level
+topological pass, and every aggregate after that is a vectorized operation.
+Requires NumPy (`pip install numpy`).
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Optional: the stats report and /api/stats need it
+
+HAVE_NUMPY = np is not None
+
+TOP_BRANCHES = 10
+
+
+def _years(values):
+    """Years as floats, NaN where missing or not an integer"""
+    return np.array([v if type(v) is int else np.nan for v in values], dtype=np.float64)
+
+
+class TreeColumns:
+    """A tree's people and relationships as arrays, one row per person in document order
+
+    Relationships are kept only when both ends are people in the tree, as
+    row numbers into the person columns.
+    """
+
+    def __init__(self, tree):
+        people, rels = tree["people"], tree["relationships"]
+        self.ids = [p.get("id") for p in people]
+        self.names = [p.get("name") for p in people]
+        index = {person_id: row for row, person_id in reversed(list(enumerate(self.ids)))}
+        count = len(people)
+
+        self.birth = _years(p.get("birthYear") for p in people)
+        self.death = _years(p.get("deathYear") for p in people)
+        codes = {}
+        self.gender = np.fromiter((codes.setdefault(p.get("gender") or "unknown", len(codes)) for p in people),
+                                  dtype=np.int32, count=count)
+        self.genders = list(codes)
+        self.has_aliases = np.fromiter((bool(p.get("aliases")) for p in people), dtype=bool, count=count)
+        self.has_notes = np.fromiter((bool(p.get("notes")) for p in people), dtype=bool, count=count)
+
+        parent_child = [(index.get(r.get("parentId"), -1), index.get(r.get("childId"), -1))
+                        for r in rels if r.get("type") == "parentChild"]
+        edges = np.array(parent_child, dtype=np.int64).reshape(-1, 2)
+        edges = edges[(edges >= 0).all(axis=1)]
+        self.parent, self.child = edges[:, 0], edges[:, 1]
+
+        spouses = [(index.get(r["people"][0], -1), index.get(r["people"][1], -1), r.get("startYear"))
+                   for r in rels if r.get("type") == "spouse" and len(r.get("people") or ()) == 2]
+        pairs = np.array([(a, b) for a, b, _ in spouses], dtype=np.int64).reshape(-1, 2)
+        started = _years(start for _, _, start in spouses)
+        known = (pairs >= 0).all(axis=1)
+        self.spouse_a, self.spouse_b, self.married = pairs[known, 0], pairs[known, 1], started[known]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def generations(columns):
+    """(generation per person, branch per person) from one topological pass over parent -> child edges
+
+    A generation is the number of generations below the person's furthest
+    known ancestor, as in KinshipIndex; people caught in a cycle get -1. A
+    branch is the row of the founder reached by following each person's
+    first-listed parent up, so every person belongs to exactly one branch.
+    """
+    count = len(columns)
+    parent, child = columns.parent, columns.child
+    order = np.argsort(parent, kind="stable")
+    targets = child[order]
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(parent, minlength=count), out=offsets[1:])
+    indegree = np.bincount(child, minlength=count)
+
+    first_parent = np.full(count, -1, dtype=np.int64)
+    children_with_parents, first_edge = np.unique(child, return_index=True)
+    first_parent[children_with_parents] = parent[first_edge]
+
+    generation = np.full(count, -1, dtype=np.int64)
+    branch = np.arange(count, dtype=np.int64)
+    frontier = np.flatnonzero(indegree == 0)
+    level = 0
+    while frontier.size:
+        generation[frontier] = level
+        if level:
+            branch[frontier] = branch[first_parent[frontier]]
+        starts = offsets[frontier]
+        sizes = offsets[frontier + 1] - starts
+        total = int(sizes.sum())
+        if not total:
+            break
+        # Every child edge of the frontier, gathered without a Python loop
+        edge = np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(total)
+        reached, times = np.unique(targets[edge], return_counts=True)
+        indegree[reached] -= times
+        frontier = reached[indegree[reached] == 0]
+        level += 1
+    return generation, branch
+
+
+def _summary(values):
+    """Count, mean, median, min and max of the known (non-NaN) values"""
+    values = values[~np.isnan(values)]
+    if not values.size:
+        return {"known": 0, "mean": None, "median": None, "min": None, "max": None}
+    return {"known": int(values.size), "mean": round(float(values.mean()), 1),
+            "median": round(float(np.median(values)), 1), "min": int(values.min()), "max": int(values.max())}
+
+
+def _by_decade(values):
+    """{decade: count} of the known values"""
+    values = values[~np.isnan(values)]
+    decades, counts = np.unique((values // 10 * 10).astype(np.int64), return_counts=True)
+    return {int(decade): int(n) for decade, n in zip(decades, counts)}
+
+
+def _by_gender(values, gender, labels):
+    return {label: _summary(values[gender == code]) for code, label in enumerate(labels)}
+
+
+def tree_stats(tree):
+    """Generation, lifespan, marriage-age, branch and coverage statistics for a tree document
+
+    Raises RuntimeError when NumPy is not installed.
+    """
+    if np is None:
+        raise RuntimeError("Tree analytics need NumPy (pip install numpy)")
+    columns = TreeColumns(tree)
+    count = len(columns)
+    generation, branch = generations(columns)
+    placed = generation >= 0
+
+    lifespan = columns.death - columns.birth
+    ages = np.concatenate((columns.married - columns.birth[columns.spouse_a],
+                           columns.married - columns.birth[columns.spouse_b]))
+    age_gender = np.concatenate((columns.gender[columns.spouse_a], columns.gender[columns.spouse_b]))
+
+    sizes = np.bincount(branch[placed], minlength=count)
+    depth = np.zeros(count, dtype=np.int64)
+    np.maximum.at(depth, branch[placed], generation[placed])
+    founders = np.flatnonzero(sizes)
+    largest = founders[np.argsort(-sizes[founders], kind="stable")[:TOP_BRANCHES]]
+
+    has_parents = np.zeros(count, dtype=bool)
+    has_parents[columns.child] = True
+    has_spouse = np.zeros(count, dtype=bool)
+    has_spouse[columns.spouse_a] = True
+    has_spouse[columns.spouse_b] = True
+
+    def share(mask):
+        return round(float(mask.mean()), 4) if count else None
+
+    unknown = columns.genders.index("unknown") if "unknown" in columns.genders else -1
+
+    return {
+        "people": count,
+        "generations": {
+            "count": int(generation.max()) + 1 if placed.any() else 0,
+            "people": np.bincount(generation[placed]).tolist(),
+            "inCycles": int(count - placed.sum())
+        },
+        "births": dict(_summary(columns.birth), byDecade=_by_decade(columns.birth)),
+        "lifespans": dict(_summary(lifespan), byDecade=_by_decade(lifespan),
+                          byGender=_by_gender(lifespan, columns.gender, columns.genders)),
+        "marriageAge": dict(_summary(ages), byGender=_by_gender(ages, age_gender, columns.genders)),
+        "branches": {
+            "count": int(founders.size),
+            "singletons": int((sizes[founders] == 1).sum()),
+            "largest": [{"id": columns.ids[row], "name": columns.names[row], "people": int(sizes[row]),
+                         "deepestGeneration": int(depth[row])} for row in largest]
+        },
+        "coverage": {
+            "gender": share(columns.gender != unknown),
+            "birthYear": share(~np.isnan(columns.birth)),
+            "deathYear": share(~np.isnan(columns.death)),
+            "aliases": share(columns.has_aliases),
+            "notes": share(columns.has_notes),
+            "parents": share(has_parents),
+            "spouse": share(has_spouse)
+        }
+    }
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Benchmarks
+Times the hot paths of the builder, the indexes and the server on a synthetic
+tree, and writes the results as JSON that can be compared across commits
+
+Run `python3 benchmark.py --generations 8 --out before.json`, change the code,
+run it again with `--out after.json`, then
+`python3 benchmark.py --compare before.json after.json` to see what got faster
+or slower (exits with status 1 if anything slowed down past --threshold).
+"""
+
+import argparse
+import gc
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from analytics import HAVE_NUMPY, tree_stats
+from compact_tree import measure
+from family_graph import FamilyGraph
+from kinship import KinshipIndex
+from layout import build_structure, compute_positions
+from search_index import SearchIndex
+from synthetic import add_arguments, generator_options, synthetic_tree, write_tree
+from validation import validate_tree
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCHEMA = 1
+GROUPS = ("generate", "io", "memory", "ids", "build", "queries", "server")
+
+
+def load_builder():
+    """The FamilyTreeBuilder class from family-tree.py, which can't be imported by name"""
+    spec = importlib.util.spec_from_file_location("family_tree", os.path.join(HERE, "family-tree.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.FamilyTreeBuilder
+
+
+def percentiles(seconds):
+    """p50/p95/p99 and max latency in milliseconds"""
+    if not seconds:
+        return {}
+    ordered = sorted(seconds)
+
+    def at(share):
+        return round(ordered[min(len(ordered) - 1, int(share * len(ordered)))] * 1000, 3)
+
+    return {"p50Ms": at(0.50), "p95Ms": at(0.95), "p99Ms": at(0.99), "maxMs": round(ordered[-1] * 1000, 3)}
+
+
+class Runner:
+    """Runs benchmarks and collects their results"""
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def time(self, name, call, ops=1, repeat=None, setup=None):
+        """Best of `repeat` runs of call(); returns what the last run returned
+
+        setup(), if given, runs untimed before each run and its result is passed to call.
+        """
+        runs = []
+        result = None
+        for _ in range(repeat or self.repeat):
+            state = setup() if setup else None
+            gc.collect()
+            started = time.perf_counter()
+            result = call(state) if setup else call()
+            runs.append(time.perf_counter() - started)
+        self.add(name, min(runs), ops, runs=[round(run, 6) for run in runs])
+        return result
+
+    def add(self, name, seconds, ops=1, **extra):
+        self.results[name] = dict({"seconds": round(seconds, 6), "ops": ops,
+                                   "opsPerSecond": round(ops / seconds, 1) if seconds else None}, **extra)
+        print(f"⏱️  {name:<28} {seconds * 1000:>11,.1f} ms" + (f"  {ops / seconds:>13,.0f} ops/s" if ops > 1 else "")
+              + (f"  p50 {extra['p50Ms']:,.2f} ms  p99 {extra['p99Ms']:,.2f} ms" if "p50Ms" in extra else ""))
+
+
+def bench_io(runner, builder_class, path, workdir):
+    """import_from_json / export_to_json: the builder's load_file and save_file, for JSON and SQLite"""
+    builder = runner.time("import.json", lambda: _loaded(builder_class, path))
+    out = os.path.join(workdir, "export.json")
+    runner.time("export.json", lambda: builder.save_file(out))
+
+    database = os.path.join(workdir, "export.db")
+
+    def fresh():
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+        return builder_class()
+
+    def export_db(target):
+        target.tree, target.graph = builder.tree, builder.graph
+        target.save_file(database)
+        target.storage.close()
+
+    runner.time("export.sqlite", export_db, setup=fresh)
+    runner.time("import.sqlite", lambda: _loaded(builder_class, database).storage.close())
+    runner.time("import.compact", lambda: _loaded(builder_class, path, compact=True))
+
+
+def _loaded(builder_class, path, compact=False):
+    builder = builder_class()
+    builder.load_file(path, compact=compact)
+    return builder
+
+
+def bench_memory(runner, path):
+    """Bytes held by the tree as dicts and as a CompactTree, with the round trip checked"""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    started = time.perf_counter()
+    result = measure(text)
+    runner.add("memory.compact_tree", time.perf_counter() - started, result["people"], **result)
+    print(f"   {result['dictBytes'] / 1e6:,.1f} MB as dicts, {result['compactBytes'] / 1e6:,.1f} MB compact "
+          f"({result['ratio']}x), round trip {'lossless' if result['lossless'] else 'LOSSY'}")
+
+
+def bench_ids(runner, builder_class, count, names):
+    """generate_id for `count` new people sharing `names` distinct names, so nearly every id collides"""
+    rng = random.Random(1)
+    pool = [f"Person {i} Collision" for i in range(names)]
+    sequence = [rng.choice(pool) for _ in range(count)]
+
+    def run(builder):
+        people = builder.people_dict
+        for name in sequence:
+            person_id = builder.generate_id(name)
+            people[person_id] = {"id": person_id, "name": name}
+
+    runner.time("generate_id", run, ops=count, setup=builder_class)
+
+
+def bench_build(runner, tree):
+    """Building the graph and every index over it"""
+    graph = runner.time("build.graph", lambda: FamilyGraph.from_tree(tree))
+    runner.time("build.search_index", lambda: SearchIndex.from_people(tree["people"]))
+
+    runner.time("build.kinship_index", lambda: KinshipIndex(graph))
+    runner.time("build.validate", lambda: validate_tree(tree))
+    root = tree["meta"].get("rootPersonId")
+
+    def layout():
+        structure, _ = build_structure(graph, root)
+        return compute_positions(graph, structure)
+
+    runner.time("build.layout", layout)
+    if HAVE_NUMPY:
+        runner.time("build.analytics", lambda: tree_stats(tree))
+    else:
+        print("⏭️  build.analytics skipped: install numpy to include it")
+    return graph
+
+
+def bench_queries(runner, tree, graph, count):
+    """Search, kinship and subtree queries against people picked at random"""
+    rng = random.Random(2)
+    people = tree["people"]
+    picks = [people[rng.randrange(len(people))] for _ in range(count)]
+    search = SearchIndex.from_people(people)
+    texts = [person["name"].split()[0][:rng.randint(3, 6)] + " " + person["name"].split()[-1][:3]
+             for person in picks]
+    texts += [person["name"].replace("a", "e", 1) for person in picks[:count // 4]]  # Misspelt, to reach the fuzzy pass
+    runner.time("query.search", lambda: [search.search(text) for text in texts], ops=len(texts))
+
+    pairs = [(picks[i]["id"], people[rng.randrange(len(people))]["id"]) for i in range(count)]
+    # A fresh index each run, so no answer comes from the last run's caches
+    runner.time("query.kinship", lambda kinship: [kinship.relate(a, b) for a, b in pairs], ops=len(pairs),
+                setup=lambda: KinshipIndex(graph))
+    runner.time("query.subtree", lambda: [graph.subtree(person["id"], 2, 2) for person in picks], ops=len(picks))
+
+
+class Server:
+    """server.py in a subprocess, serving a copy of the tree from a scratch directory"""
+
+    def __init__(self, tree_path, workdir, workers):
+        self.data = os.path.join(workdir, "family1.json")
+        shutil.copyfile(tree_path, self.data)
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "server.py"), "--port", str(self.port), "--data", self.data,
+             "--workers", str(workers)],
+            cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def wait(self, timeout=120):
+        """Block until the tree has been loaded and served once"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"server.py exited with status {self.process.returncode}")
+            try:
+                status, _, _ = self.request("GET", "/family1.json")
+                if status == 200:
+                    return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError("server.py did not start in time")
+
+    def connect(self):
+        return http.client.HTTPConnection("127.0.0.1", self.port, timeout=300)
+
+    def request(self, method, path, body=None, headers=None, conn=None):
+        own = conn is None
+        conn = conn or self.connect()
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.getheaders(), response.read()
+        finally:
+            if own:
+                conn.close()
+
+    def stop(self):
+        self.process.send_signal(signal.SIGINT)  # Lets it compact its journal on the way out
+        try:
+            self.process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def load(server, clients, requests, call):
+    """Run `requests` calls of call(conn, number) spread over `clients` threads with their own connections
+
+    Returns (wall seconds, per-request seconds, {status: count}).
+    """
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client():
+        conn = server.connect()
+        mine, seen = [], {}
+        try:
+            while True:
+                with lock:
+                    number = next(counter, None)
+                if number is None:
+                    break
+                started = time.perf_counter()
+                try:
+                    status = call(conn, number)
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    conn = server.connect()
+                    status = "error"
+                mine.append(time.perf_counter() - started)
+                seen[status] = seen.get(status, 0) + 1
+        finally:
+            conn.close()
+        with lock:
+            latencies.extend(mine)
+            for status, n in seen.items():
+                statuses[status] = statuses.get(status, 0) + n
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, latencies, {str(k): v for k, v in sorted(statuses.items(), key=str)}
+
+
+def bench_server(runner, tree_path, workdir, args):
+    """Static GETs and /save round trips against a live server.py under concurrent clients"""
+    server = Server(tree_path, workdir, args.workers)
+    try:
+        started = time.perf_counter()
+        server.wait()
+        runner.add("server.first_load", time.perf_counter() - started)
+
+        for path in ("/index.html", "/family1.json"):
+            def get(conn, number, path=path):
+                status, _, _ = server.request("GET", path, headers={"Accept-Encoding": "gzip"}, conn=conn)
+                return status
+
+            seconds, latencies, statuses = load(server, args.clients, args.requests, get)
+            runner.add(f"server.get{path}", seconds, len(latencies), statuses=statuses, clients=args.clients,
+                       **percentiles(latencies))
+
+        def save(conn, number):
+            # What the page does: fetch the tree, edit it, post it back against the version it fetched
+            _, _, body = server.request("GET", "/family1.json", conn=conn)
+            tree = json.loads(body)
+            tree["meta"]["notes"] = f"Benchmark save {number}"
+            status, _, _ = server.request(
+                "POST", "/save", body=json.dumps(tree).encode("utf-8"),
+                headers={"Content-Type": "application/json", "If-Match": str(tree["meta"].get("version", 0))},
+                conn=conn)
+            return status
+
+        seconds, latencies, statuses = load(server, args.writers, args.saves, save)
+        runner.add("server.save_round_trip", seconds, len(latencies), statuses=statuses, clients=args.writers,
+                   **percentiles(latencies))
+    finally:
+        server.stop()
+
+
+def git_state():
+    """(commit, whether the working tree has changes), or (None, None) outside a git checkout"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run(args):
+    only = set(args.only.split(",")) if args.only else set(GROUPS)
+    if args.skip_server:
+        only.discard("server")
+    unknown = only - set(GROUPS)
+    if unknown:
+        raise SystemExit(f"❌ Unknown benchmark group(s): {', '.join(sorted(unknown))} (choose from {', '.join(GROUPS)})")
+
+    commit, dirty = git_state()
+    options = generator_options(args)
+    report = {
+        "schema": SCHEMA,
+        "commit": commit,
+        "dirty": dirty,
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": HAVE_NUMPY,
+        "options": dict(options, repeat=args.repeat, queries=args.queries, ids=args.ids, clients=args.clients,
+                        requests=args.requests, writers=args.writers, saves=args.saves, workers=args.workers,
+                        groups=sorted(only)),
+    }
+    runner = Runner(args.repeat)
+    workdir = tempfile.mkdtemp(prefix="family-tree-bench-")
+    try:
+        tree_path = os.path.join(workdir, "tree.json")
+        started = time.perf_counter()
+        people, relationships = write_tree(tree_path, **options)
+        seconds = time.perf_counter() - started
+        report["tree"] = {"people": people, "relationships": relationships, "bytes": os.path.getsize(tree_path)}
+        print(f"🌳 {people:,} people, {relationships:,} relationships ({report['tree']['bytes'] / 1e6:,.1f} MB)")
+        if "generate" in only:
+            runner.add("generate.write_tree", seconds, people)
+            runner.time("generate.synthetic_tree", lambda: synthetic_tree(**options), ops=people, repeat=1)
+
+        builder_class = load_builder() if only & {"io", "ids"} else None
+        if "io" in only:
+            bench_io(runner, builder_class, tree_path, workdir)
+        if "memory" in only:
+            bench_memory(runner, tree_path)
+        if "ids" in only:
+            bench_ids(runner, builder_class, args.ids, max(1, args.ids // 1000))
+        if only & {"build", "queries"}:
+            with open(tree_path, "r", encoding="utf-8") as f:
+                tree = json.load(f)
+            graph = bench_build(runner, tree) if "build" in only else FamilyGraph.from_tree(tree)
+            if "queries" in only:
+                bench_queries(runner, tree, graph, args.queries)
+            del tree, graph
+        if "server" in only:
+            bench_server(runner, tree_path, workdir, args)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report["benchmarks"] = runner.results
+    return report
+
+
+def compare(base_path, new_path, threshold):
+    """Print each benchmark's change in time between two result files; returns the names that slowed down"""
+    with open(base_path, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"📊 {base.get('commit') or base_path} → {new.get('commit') or new_path}")
+    if base.get("tree") != new.get("tree"):
+        print(f"⚠️  Different trees: {base.get('tree')} vs {new.get('tree')}")
+    slower = []
+    for name in sorted(base["benchmarks"].keys() | new["benchmarks"].keys()):
+        before, after = base["benchmarks"].get(name), new["benchmarks"].get(name)
+        if before is None or after is None:
+            print(f"   {name:<28} {'only in ' + (new_path if before is None else base_path)}")
+            continue
+        # Server results are compared on median latency, everything else on best time
+        metric = "p50Ms" if "p50Ms" in before and "p50Ms" in after else "seconds"
+        old_value, new_value = before[metric], after[metric]
+        change = new_value / old_value - 1 if old_value else 0.0
+        mark = "🐢" if change > threshold else "🚀" if change < -threshold else "  "
+        if change > threshold:
+            slower.append(name)
+        unit = "ms" if metric == "p50Ms" else "s"
+        print(f"{mark} {name:<28} {old_value:>12,.4f}{unit} → {new_value:>12,.4f}{unit}  {change:+7.1%}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the family tree's hot paths on a synthetic tree")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"),
+                        help="Compare two result files instead of running the benchmarks")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Slowdown that counts as a regression in --compare (default: 0.10, i.e. 10%%)")
+    add_arguments(parser, generations=8)
+    parser.add_argument("--out", default=None, help="Write the results as JSON to this file")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--only", default=None, help=f"Comma-separated groups to run: {', '.join(GROUPS)} (default: all)")
+    parser.add_argument("--skip-server", action="store_true", help="Leave out the server benchmarks")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the best one counts (default: 3)")
+    parser.add_argument("--queries", type=int, default=1000, help="Search, kinship and subtree queries (default: 1000)")
+    parser.add_argument("--ids", type=int, default=100000, help="IDs to generate in the generate_id benchmark (default: 100000)")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients making GET requests (default: 8)")
+    parser.add_argument("--requests", type=int, default=500, help="GET requests per static file (default: 500)")
+    parser.add_argument("--writers", type=int, default=1,
+                        help="Concurrent clients saving the tree; with more than one, some saves conflict (default: 1)")
+    parser.add_argument("--saves", type=int, default=20, help="/save round trips (default: 20)")
+    parser.add_argument("--workers", type=int, default=16, help="Server worker threads (default: 16)")
+    args = parser.parse_args()
+
+    if args.compare:
+        slower = compare(*args.compare, args.threshold)
+        if slower:
+            print(f"🐢 {len(slower)} benchmark(s) more than {args.threshold:.0%} slower: {', '.join(slower)}")
+            sys.exit(1)
+        print("✅ No regressions")
+        return
+
+    report = run(args)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.out}")
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Change Feed
+Fans out tree change events to live subscribers, keeping the most recent ones
+so a reconnecting client can catch up instead of reloading the whole tree
+
+Every event is a dict with the tree "version" it produced and a "type":
+"change" events carry the applied "change", "changes" events the list of
+"changes" a save made, and "replace" events mean the whole tree was replaced
+(an import, an edit by another process, or a save too different to list).
+Versions go up by exactly one per event.
+"""
+
+import queue
+import threading
+from collections import deque
+
+HISTORY = 1000
+
+
+class ChangeFeed:
+    def __init__(self, history=HISTORY):
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def publish(self, event):
+        with self._lock:
+            self._history.append(event)
+            for subscriber in self._subscribers:
+                subscriber.put(event)
+
+    def subscribe(self, since=None, current=None):
+        """Start receiving events; returns (queue, backlog)
+
+        backlog holds the buffered events after version `since`, or is None
+        when some of them are no longer buffered and the client has to reload.
+        The caller must keep the tree from changing between reading `current`
+        and subscribing, and must call unsubscribe() with the queue when done.
+        """
+        subscriber = queue.SimpleQueue()
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if since is None or current is None or since >= current:
+                backlog = []
+            else:
+                backlog = [event for event in self._history if event["version"] > since]
+                if not backlog or backlog[0]["version"] != since + 1:
+                    backlog = None
+        return subscriber, backlog
+
+    def events_since(self, since, current):
+        """Buffered events after version `since` up to `current`, or None if some are gone"""
+        if since >= current:
+            return []
+        with self._lock:
+            events = [event for event in self._history if since < event["version"] <= current]
+        if len(events) != current - since or events[0]["version"] != since + 1:
+            return None
+        return events
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+Compact Tree
+Columnar, array-backed copy of a family tree for holding very large trees in memory
+
+People and relationships are stored column by column: ids are interned to
+integers, genders and relationship types to small codes, years and edge
+endpoints live in typed arrays and text is packed into UTF-8 buffers. Records
+that do not fit the standard schema (extra keys, unusual types or key order)
+are kept verbatim, so to_tree() always gives back exactly what went in.
+
+from_json() fills the columns straight from a JSON document, one record at a
+time, so a tree is never held as dicts at all. document() hands out the tree
+with its people and relationships as read-only sequences that build each
+record on access, for code that only reads the tree (validation, analytics,
+export); FamilyTreeBuilder loads trees this way for `stats` and `export`.
+
+Run `python3 compact_tree.py [FILE | --people N]` to compare memory use with
+the plain dict layout and check the round trip.
+"""
+
+import argparse
+import gc
+import io
+import json
+import re
+import sys
+import tracemalloc
+from array import array
+from collections import deque
+from collections.abc import Sequence
+
+from synthetic import synthetic_tree
+
+PERSON_KEYS = ("id", "name", "gender", "aliases", "birthYear", "deathYear", "notes")
+PARENT_CHILD_KEYS = ("type", "parentId", "childId", "biological", "notes")
+SPOUSE_KEYS = ("type", "people", "startYear", "endYear", "notes")
+
+RECORD_LISTS = ("people", "relationships")
+NO_YEAR = -2 ** 31  # int32 sentinel for a missing year
+PARENT_CHILD, SPOUSE = 0, 1
+BIOLOGICAL = {False: 0, True: 1, None: 2}
+BIOLOGICAL_VALUES = (False, True, None)
+
+
+def _year_fits(value):
+    return value is None or (type(value) is int and NO_YEAR < value < 2 ** 31)
+
+
+def _text_or_none(value):
+    return value is None or isinstance(value, str)
+
+
+_SPACE = re.compile(r'[ \t\n\r]*')
+
+
+class StringColumn:
+    """Append-only strings packed into one UTF-8 buffer with an offsets array"""
+
+    __slots__ = ("data", "offsets")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("Q", [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def append(self, text):
+        self.data += text.encode("utf-8", "surrogatepass")
+        self.offsets.append(len(self.data))
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode("utf-8", "surrogatepass")
+
+
+class RecordList(Sequence):
+    """Read-only sequence over a compact tree's people or relationships, building each dict on access"""
+
+    __slots__ = ("_count", "_record")
+
+    def __init__(self, count, record):
+        self._count = count
+        self._record = record
+
+    def __len__(self):
+        return self._count()
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self._record(i) for i in range(*row.indices(len(self)))]
+        count = len(self)
+        if row < 0:
+            row += count
+        if not 0 <= row < count:
+            raise IndexError(row)
+        return self._record(row)
+
+    def __iter__(self):
+        return map(self._record, range(len(self)))
+
+
+class CompactTree:
+    def __init__(self, meta=None):
+        # The document's other top-level keys; "people" and "relationships" keep their place in it as None
+        self.meta = meta if meta is not None else {}
+        # Interned person ids: id string <-> integer
+        self.ids = []
+        self.index = {}
+        # People, one row each
+        self.person_id = array("i")      # row -> interned id
+        self.row_of = array("i")         # interned id -> row, -1 for ids only seen on relationships
+        self.names = StringColumn()
+        self.gender_codes = array("B")
+        self.genders = [None]            # code -> gender string, 0 is None
+        self.birth = array("i")
+        self.death = array("i")
+        self.alias_end = array("Q")      # row -> end of its aliases in alias_text
+        self.alias_text = StringColumn()
+        self.person_notes = {}           # row -> notes, only for people with notes
+        self.odd_people = {}             # row -> original dict for records outside the schema
+        # Relationships, one row each, in document order
+        self.rel_type = array("B")
+        self.rel_a = array("i")          # parentId or first spouse
+        self.rel_b = array("i")          # childId or second spouse
+        self.biological = array("B")
+        self.start = array("i")
+        self.end = array("i")
+        self.rel_notes = {}              # row -> notes
+        self.odd_relationships = {}      # row -> original dict
+        self._adjacency = None
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Build from a tree document"""
+        compact = cls({k: None if k in RECORD_LISTS else v for k, v in tree.items()})
+        for person in tree.get("people", []):
+            compact.add_person(person)
+        for rel in tree.get("relationships", []):
+            compact.add_relationship(rel)
+        return compact
+
+    @classmethod
+    def from_json(cls, text):
+        """Build from the text of a tree document, decoding one record at a time
+
+        Raises json.JSONDecodeError for malformed JSON, like json.loads.
+        """
+        decoder = json.JSONDecoder()
+        compact = cls()
+
+        def punctuation(i, allowed):
+            """The next non-space character, which must be one of `allowed`, and where the value after it starts"""
+            i = _SPACE.match(text, i).end()
+            char = text[i:i + 1]
+            if not char or char not in allowed:
+                raise json.JSONDecodeError(f"Expecting {' or '.join(repr(c) for c in allowed)}", text, i)
+            return char, _SPACE.match(text, i + 1).end()
+
+        char, i = punctuation(0, "{")
+        if text[i:i + 1] == "}":
+            char, i = punctuation(i, "}")
+        else:
+            char = ","
+        while char == ",":
+            key, i = decoder.raw_decode(text, i)
+            if not isinstance(key, str):
+                raise json.JSONDecodeError("Expecting property name enclosed in double quotes", text, i)
+            _, i = punctuation(i, ":")
+            if key in RECORD_LISTS and text[i:i + 1] == "[":
+                compact.meta[key] = None
+                add = compact.add_person if key == "people" else compact.add_relationship
+                _, i = punctuation(i, "[")
+                char = "]" if text[i:i + 1] == "]" else ","
+                if char == "]":
+                    _, i = punctuation(i, "]")
+                while char == ",":
+                    record, i = decoder.raw_decode(text, i)
+                    add(record)
+                    char, i = punctuation(i, ",]")
+            else:
+                compact.meta[key], i = decoder.raw_decode(text, i)
+            char, i = punctuation(i, ",}")
+        if i != len(text):
+            raise json.JSONDecodeError("Extra data", text, i)
+        return compact
+
+    def intern(self, person_id):
+        """Integer for a person id, assigning the next one if it is new"""
+        number = self.index.get(person_id)
+        if number is None:
+            number = len(self.ids)
+            person_id = sys.intern(person_id)
+            self.ids.append(person_id)
+            self.index[person_id] = number
+            self.row_of.append(-1)
+        return number
+
+    def _gender_code(self, gender):
+        try:
+            return self.genders.index(gender)
+        except ValueError:
+            self.genders.append(sys.intern(gender))
+            return len(self.genders) - 1
+
+    def add_person(self, person):
+        row = len(self.person_id)
+        regular = (isinstance(person, dict) and tuple(person) == PERSON_KEYS and isinstance(person["id"], str)
+                   and isinstance(person["name"], str) and _text_or_none(person["gender"])
+                   and isinstance(person["aliases"], list) and all(isinstance(a, str) for a in person["aliases"])
+                   and _year_fits(person["birthYear"]) and _year_fits(person["deathYear"])
+                   and _text_or_none(person["notes"]))
+        person_id = person.get("id") if isinstance(person, dict) else None
+        number = self.intern(person_id) if isinstance(person_id, str) else -1
+        self.person_id.append(number)
+        if number >= 0 and self.row_of[number] < 0:
+            self.row_of[number] = row
+        if not regular:
+            self.odd_people[row] = person
+            self.names.append("")
+            self.gender_codes.append(0)
+            self.birth.append(NO_YEAR)
+            self.death.append(NO_YEAR)
+            self.alias_end.append(len(self.alias_text))
+            return row
+        self.names.append(person["name"])
+        self.gender_codes.append(self._gender_code(person["gender"]))
+        self.birth.append(NO_YEAR if person["birthYear"] is None else person["birthYear"])
+        self.death.append(NO_YEAR if person["deathYear"] is None else person["deathYear"])
+        for alias in person["aliases"]:
+            self.alias_text.append(alias)
+        self.alias_end.append(len(self.alias_text))
+        if person["notes"] is not None:
+            self.person_notes[row] = person["notes"]
+        return row
+
+    def add_relationship(self, rel):
+        row = len(self.rel_type)
+        self._adjacency = None
+        keys = tuple(rel) if isinstance(rel, dict) else ()
+        if (keys == PARENT_CHILD_KEYS and rel["type"] == "parentChild" and isinstance(rel["parentId"], str)
+                and isinstance(rel["childId"], str) and rel["biological"] in BIOLOGICAL
+                and type(rel["biological"]) in (bool, type(None)) and _text_or_none(rel["notes"])):
+            self.rel_type.append(PARENT_CHILD)
+            self.rel_a.append(self.intern(rel["parentId"]))
+            self.rel_b.append(self.intern(rel["childId"]))
+            self.biological.append(BIOLOGICAL[rel["biological"]])
+            self.start.append(NO_YEAR)
+            self.end.append(NO_YEAR)
+        elif (keys == SPOUSE_KEYS and rel["type"] == "spouse" and isinstance(rel["people"], list)
+                and len(rel["people"]) == 2 and all(isinstance(p, str) for p in rel["people"])
+                and _year_fits(rel["startYear"]) and _year_fits(rel["endYear"]) and _text_or_none(rel["notes"])):
+            self.rel_type.append(SPOUSE)
+            self.rel_a.append(self.intern(rel["people"][0]))
+            self.rel_b.append(self.intern(rel["people"][1]))
+            self.biological.append(BIOLOGICAL[None])
+            self.start.append(NO_YEAR if rel["startYear"] is None else rel["startYear"])
+            self.end.append(NO_YEAR if rel["endYear"] is None else rel["endYear"])
+        else:
+            # Kept verbatim, but a recognizable edge still goes into the adjacency arrays
+            self.odd_relationships[row] = rel
+            kind, a, b = self._odd_edge(rel)
+            self.rel_type.append(kind)
+            self.rel_a.append(a)
+            self.rel_b.append(b)
+            self.biological.append(BIOLOGICAL[None])
+            self.start.append(NO_YEAR)
+            self.end.append(NO_YEAR)
+            return row
+        if rel["notes"] is not None:
+            self.rel_notes[row] = rel["notes"]
+        return row
+
+    def _odd_edge(self, rel):
+        """(type code, a, b) for a verbatim relationship, interning its ids; 255, -1, -1 if it is no edge"""
+        if not isinstance(rel, dict):
+            return 255, -1, -1
+        kind = rel.get("type")
+        parent_id, child_id = rel.get("parentId"), rel.get("childId")
+        people = rel.get("people")
+        if kind == "parentChild" and isinstance(parent_id, str) and isinstance(child_id, str):
+            return PARENT_CHILD, self.intern(parent_id), self.intern(child_id)
+        if (kind == "spouse" and isinstance(people, list) and len(people) == 2
+                and all(isinstance(p, str) for p in people)):
+            return SPOUSE, self.intern(people[0]), self.intern(people[1])
+        return 255, -1, -1
+
+    @property
+    def person_count(self):
+        return len(self.person_id)
+
+    @property
+    def relationship_count(self):
+        return len(self.rel_type)
+
+    def person(self, row):
+        """The person in a row as a schema dict"""
+        if row in self.odd_people:
+            return self.odd_people[row]
+        first = self.alias_end[row - 1] if row else 0
+        birth, death = self.birth[row], self.death[row]
+        return {
+            "id": self.ids[self.person_id[row]],
+            "name": self.names[row],
+            "gender": self.genders[self.gender_codes[row]],
+            "aliases": [self.alias_text[i] for i in range(first, self.alias_end[row])],
+            "birthYear": None if birth == NO_YEAR else birth,
+            "deathYear": None if death == NO_YEAR else death,
+            "notes": self.person_notes.get(row)
+        }
+
+    def get_person(self, person_id):
+        number = self.index.get(person_id)
+        row = -1 if number is None else self.row_of[number]
+        return None if row < 0 else self.person(row)
+
+    def relationship(self, row):
+        """The relationship in a row as a schema dict"""
+        if row in self.odd_relationships:
+            return self.odd_relationships[row]
+        a, b = self.ids[self.rel_a[row]], self.ids[self.rel_b[row]]
+        if self.rel_type[row] == PARENT_CHILD:
+            return {
+                "type": "parentChild",
+                "parentId": a,
+                "childId": b,
+                "biological": BIOLOGICAL_VALUES[self.biological[row]],
+                "notes": self.rel_notes.get(row)
+            }
+        start, end = self.start[row], self.end[row]
+        return {
+            "type": "spouse",
+            "people": [a, b],
+            "startYear": None if start == NO_YEAR else start,
+            "endYear": None if end == NO_YEAR else end,
+            "notes": self.rel_notes.get(row)
+        }
+
+    def to_tree(self):
+        """The tree document this was built from"""
+        tree = dict(self.meta)
+        for key, records in self._record_lists().items():
+            if key in tree:
+                tree[key] = list(records)
+        return tree
+
+    def document(self):
+        """The tree document with people and relationships as RecordLists, for reading without copying"""
+        tree = dict(self.meta)
+        tree.update(self._record_lists())
+        return tree
+
+    def _record_lists(self):
+        return {"people": RecordList(lambda: self.person_count, self.person),
+                "relationships": RecordList(lambda: self.relationship_count, self.relationship)}
+
+    def write_json(self, f):
+        """Write the document to a text file as json.dump(..., indent=2) would, one record at a time"""
+        def indented(value):
+            return json.dumps(value, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+
+        records = self._record_lists()
+        f.write("{")
+        for number, (key, value) in enumerate(self.meta.items()):
+            value = records.get(key, value)
+            f.write(("," if number else "") + "\n  " + json.dumps(key, ensure_ascii=False) + ": ")
+            if not isinstance(value, RecordList):
+                f.write(indented(value))
+            elif not len(value):
+                f.write("[]")
+            else:
+                for row, record in enumerate(value):
+                    f.write(("[" if not row else ",") + "\n    " + indented(record).replace("\n", "\n  "))
+                f.write("\n  ]")
+        f.write("\n}" if self.meta else "}")
+
+    def adjacency(self):
+        """Parent, child and spouse lists for every interned id as CSR integer arrays
+
+        Returns {"parents"|"children"|"spouses": (offsets, targets)}; the
+        neighbours of id number n are targets[offsets[n]:offsets[n + 1]].
+        Built on first use and after any relationship is added.
+        """
+        if self._adjacency is not None:
+            return self._adjacency
+        size = len(self.ids)
+        edges = {"parents": [], "children": [], "spouses": []}
+        for row in range(self.relationship_count):
+            kind, a, b = self.rel_type[row], self.rel_a[row], self.rel_b[row]
+            if kind == PARENT_CHILD:
+                edges["parents"].append((b, a))
+                edges["children"].append((a, b))
+            elif kind == SPOUSE:
+                edges["spouses"].append((a, b))
+                edges["spouses"].append((b, a))
+        adjacency = {}
+        for name, pairs in edges.items():
+            offsets = array("i", bytes(4 * (size + 1)))
+            for source, _ in pairs:
+                offsets[source + 1] += 1
+            for i in range(size):
+                offsets[i + 1] += offsets[i]
+            targets = array("i", bytes(4 * len(pairs)))
+            fill = array("i", offsets[:-1])
+            for source, target in pairs:
+                targets[fill[source]] = target
+                fill[source] += 1
+            adjacency[name] = (offsets, targets)
+        self._adjacency = adjacency
+        return adjacency
+
+    def generation_count(self):
+        """Generations in the longest parent/child line, by one pass of Kahn's algorithm over the arrays"""
+        offsets, targets = self.adjacency()["children"]
+        parent_offsets = self.adjacency()["parents"][0]
+        waiting = array("i", (parent_offsets[n + 1] - parent_offsets[n] for n in range(len(self.ids))))
+        depth = array("i", bytes(4 * len(self.ids)))
+        queue = deque(n for n in range(len(self.ids)) if not waiting[n])
+        while queue:
+            number = queue.popleft()
+            for child in targets[offsets[number]:offsets[number + 1]]:
+                depth[child] = max(depth[child], depth[number] + 1)
+                waiting[child] -= 1
+                if not waiting[child]:
+                    queue.append(child)
+        return 1 + max(depth, default=-1)
+
+    def parentless_count(self):
+        """People and ids on relationships with no parent"""
+        offsets = self.adjacency()["parents"][0]
+        return sum(1 for n in range(len(self.ids)) if offsets[n + 1] == offsets[n])
+
+    def _linked(self, kind, number):
+        offsets, targets = self.adjacency()[kind]
+        return targets[offsets[number]:offsets[number + 1]]
+
+    def neighbors(self, person_id):
+        """Parent, child and spouse ids of one person, or None if the id is unknown"""
+        number = self.index.get(person_id)
+        if number is None:
+            return None
+        return {kind: [self.ids[n] for n in self._linked(kind, number)]
+                for kind in ("parents", "children", "spouses")}
+
+    def ancestors(self, person_id, max_depth=None):
+        """Yield (ancestorId, generation) breadth-first, each ancestor once"""
+        number = self.index.get(person_id)
+        if number is None:
+            return
+        offsets, targets = self.adjacency()["parents"]
+        seen = {number}
+        queue = deque([(number, 0)])
+        while queue:
+            current, depth = queue.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for parent in targets[offsets[current]:offsets[current + 1]]:
+                if parent not in seen:
+                    seen.add(parent)
+                    yield self.ids[parent], depth + 1
+                    queue.append((parent, depth + 1))
+
+
+def measure(text):
+    """Memory held by the dict and compact layouts of one JSON document, and whether the round trip is lossless
+
+    The compact layout is read with from_json(), so its peak is the columns
+    plus one record, never the whole tree as dicts.
+    """
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    tree = json.loads(text)
+    dict_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    del tree
+    gc.collect()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    compact = CompactTree.from_json(text)
+    compact_bytes, peak = (size - baseline for size in tracemalloc.get_traced_memory())
+    tracemalloc.stop()
+
+    expected = json.loads(text)
+    written = io.StringIO()
+    compact.write_json(written)
+    lossless = (json.dumps(compact.to_tree(), ensure_ascii=False) == json.dumps(expected, ensure_ascii=False)
+                and written.getvalue() == json.dumps(expected, indent=2, ensure_ascii=False))
+    return {
+        "people": compact.person_count,
+        "relationships": compact.relationship_count,
+        "dictBytes": dict_bytes,
+        "compactBytes": compact_bytes,
+        "compactPeakBytes": peak,
+        "ratio": round(dict_bytes / max(compact_bytes, 1), 2),
+        "lossless": lossless
+    }
+
+
+def main():
+    """Memory benchmark: python3 compact_tree.py [FILE | --people N] [--json]"""
+    parser = argparse.ArgumentParser(description="Compare memory use of the dict and compact tree layouts")
+    parser.add_argument("file", nargs="?", help="Tree JSON to measure (default: a synthetic tree)")
+    parser.add_argument("--people", type=int, default=100000, help="Size of the synthetic tree (default: 100000)")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = json.dumps(synthetic_tree(generations=40, max_people=args.people), indent=2, ensure_ascii=False)
+    result = measure(text)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        people = max(result['people'], 1)
+        print(f"🌳 {result['people']:,} people, {result['relationships']:,} relationships")
+        print(f"📦 dicts:   {result['dictBytes'] / 1e6:,.1f} MB ({result['dictBytes'] / people:,.0f} bytes/person)")
+        print(f"🗜️  compact: {result['compactBytes'] / 1e6:,.1f} MB ({result['compactBytes'] / people:,.0f} bytes/person,"
+              f" {result['compactPeakBytes'] / 1e6:,.1f} MB at the peak of loading)")
+        print(f"{'✅' if result['lossless'] else '❌'} {result['ratio']}x smaller, "
+              f"round trip {'lossless' if result['lossless'] else 'NOT lossless'}")
+    raise SystemExit(0 if result["lossless"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Duplicate Detection
+Finds the same people in two trees by phonetic blocking and scoring, and merges the trees
+
+Only people who share a blocking key (the Soundex codes of a given name and
+surname, or of a given name and birth decade, taken from the name and every
+alias) are compared, so the work grows with the size of the blocks rather
+than with every pair of people. Each candidate pair is scored on name
+similarity, birth and death years and how many relatives' names they share.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from difflib import SequenceMatcher
+
+from family_graph import FamilyGraph
+from search_index import normalize
+from validation import validate_tree
+
+MERGE_THRESHOLD = 0.85   # pairs at or above this with corroborating evidence are merged
+REVIEW_THRESHOLD = 0.6   # pairs at or above this are listed for a person to check
+MAX_BLOCK_PAIRS = 250000  # larger blocks are skipped and reported instead of compared
+PARALLEL_PAIRS = 20000   # below this many comparisons, scoring stays in this process
+CHUNK_PAIRS = 5000
+
+WEIGHTS = {"name": 0.5, "birth": 0.15, "death": 0.1, "relatives": 0.25}
+
+_SOUNDEX = {}
+for _letters, _digit in (("bfpv", "1"), ("cgjkqsxz", "2"), ("dt", "3"), ("l", "4"), ("mn", "5"), ("r", "6")):
+    for _letter in _letters:
+        _SOUNDEX[_letter] = _digit
+
+
+def soundex(word):
+    """American Soundex code of a normalized word, e.g. aneeta/anita -> a530"""
+    word = "".join(c for c in word if c.isalpha())
+    if not word:
+        return ""
+    code = word[0]
+    previous = _SOUNDEX.get(word[0], "")
+    for c in word[1:]:
+        digit = _SOUNDEX.get(c, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if c not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def person_names(person):
+    """Normalized name and aliases, name first, without repeats"""
+    names = []
+    for name in [person.get("name")] + list(person.get("aliases") or []):
+        name = normalize(name)
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def blocking_keys(person):
+    """Keys under which a person is compared with the other tree"""
+    keys = set()
+    birth = person.get("birthYear")
+    for name in person_names(person):
+        tokens = name.split()
+        given = soundex(tokens[0])
+        if len(tokens) > 1:
+            keys.add(("name", given, soundex(tokens[-1])))
+        else:
+            keys.add(("single", given))
+        if isinstance(birth, int):
+            keys.add(("born", given, birth // 10))
+    return keys
+
+
+def _features(tree):
+    """Per-person data the scorer needs, in tree order: (names, gender, birth, death, relative keys)"""
+    graph = FamilyGraph.from_tree(tree)
+
+    def given_key(person_id):
+        names = person_names(graph.people.get(person_id, {}))
+        return soundex(names[0].split()[0]) if names else ""
+
+    features = []
+    for person in tree["people"]:
+        person_id = person["id"]
+        relatives = set()
+        for role, index in (("parent", graph.parents), ("child", graph.children), ("spouse", graph.spouses)):
+            for other_id in index.get(person_id, ()):
+                key = given_key(other_id)
+                if key:
+                    relatives.add((role, key))
+        birth, death = person.get("birthYear"), person.get("deathYear")
+        features.append((
+            person_names(person),
+            person.get("gender"),
+            birth if isinstance(birth, int) else None,
+            death if isinstance(death, int) else None,
+            frozenset(relatives)
+        ))
+    return features
+
+
+def _ratio(a, b):
+    return SequenceMatcher(None, a, b).ratio() if a and b else 0.0
+
+
+def name_similarity(names_a, names_b):
+    """Best similarity between any name or alias of one person and any of the other's
+
+    Given names count for more than surnames, since surnames change with marriage.
+    """
+    best = 0.0
+    for a in names_a:
+        for b in names_b:
+            if a == b:
+                return 1.0
+            tokens_a, tokens_b = a.split(), b.split()
+            given = _ratio(tokens_a[0], tokens_b[0])
+            if len(tokens_a) > 1 and len(tokens_b) > 1:
+                rest = _ratio(" ".join(tokens_a[1:]), " ".join(tokens_b[1:]))
+            else:
+                rest = 0.5
+            best = max(best, _ratio(a, b), 0.75 * given + 0.25 * rest)
+    return best
+
+
+def _year_similarity(a, b):
+    if a is None or b is None:
+        return None
+    gap = abs(a - b)
+    if gap == 0:
+        return 1.0
+    if gap <= 2:
+        return 0.8
+    if gap <= 5:
+        return 0.4
+    return 0.0
+
+
+def score_pair(a, b):
+    """(score, evidence) for two feature tuples, or None if they cannot be the same person"""
+    names_a, gender_a, birth_a, death_a, relatives_a = a
+    names_b, gender_b, birth_b, death_b, relatives_b = b
+    if gender_a and gender_b and gender_a != gender_b:
+        return None
+    evidence = {
+        "name": name_similarity(names_a, names_b),
+        "birth": _year_similarity(birth_a, birth_b),
+        "death": _year_similarity(death_a, death_b),
+        "relatives": None
+    }
+    if evidence["birth"] == 0.0 or evidence["death"] == 0.0:
+        return None
+    if relatives_a and relatives_b:
+        evidence["relatives"] = len(relatives_a & relatives_b) / min(len(relatives_a), len(relatives_b))
+    known = [key for key, value in evidence.items() if value is not None]
+    score = sum(WEIGHTS[key] * evidence[key] for key in known) / sum(WEIGHTS[key] for key in known)
+    return round(score, 4), {key: None if value is None else round(value, 3) for key, value in evidence.items()}
+
+
+_worker_state = None
+
+
+def _init_worker(features_a, features_b, floor):
+    global _worker_state
+    _worker_state = (features_a, features_b, floor)
+
+
+def _score_chunk(pairs, state=None):
+    """Scores of the pairs that reach the floor"""
+    features_a, features_b, floor = state or _worker_state
+    scored = []
+    for i, j in pairs:
+        result = score_pair(features_a[i], features_b[j])
+        if result is not None and result[0] >= floor:
+            scored.append((i, j, result[0], result[1]))
+    return scored
+
+
+def candidate_pairs(tree_a, tree_b):
+    """(pairs of people indexes sharing a block, number of blocks, blocks skipped as too large)"""
+    blocks = {}
+    for side, tree in enumerate((tree_a, tree_b)):
+        for index, person in enumerate(tree["people"]):
+            for key in blocking_keys(person):
+                blocks.setdefault(key, ([], []))[side].append(index)
+    pairs = set()
+    shared = oversized = 0
+    for left, right in blocks.values():
+        if not left or not right:
+            continue
+        shared += 1
+        if len(left) * len(right) > MAX_BLOCK_PAIRS:
+            oversized += 1
+            continue
+        for i in left:
+            for j in right:
+                pairs.add((i, j))
+    return sorted(pairs), shared, oversized
+
+
+def find_matches(tree_a, tree_b, workers=None, floor=REVIEW_THRESHOLD):
+    """Score candidate pairs, using several processes when there are many
+
+    Returns (pairs scoring at least `floor` as (i, j, score, evidence), best first, stats).
+    """
+    pairs, blocks, oversized = candidate_pairs(tree_a, tree_b)
+    state = (_features(tree_a), _features(tree_b), floor)
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(pairs) >= PARALLEL_PAIRS:
+        chunks = [pairs[i:i + CHUNK_PAIRS] for i in range(0, len(pairs), CHUNK_PAIRS)]
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=state) as pool:
+            scored = [row for rows in pool.map(_score_chunk, chunks) for row in rows]
+    else:
+        workers = 1
+        scored = _score_chunk(pairs, state)
+    scored.sort(key=lambda row: (-row[2], row[0], row[1]))
+    return scored, {"blocks": blocks, "oversizedBlocks": oversized, "comparisons": len(pairs), "workers": workers}
+
+
+def _summary(person):
+    return {key: person.get(key) for key in ("id", "name", "aliases", "gender", "birthYear", "deathYear")}
+
+
+def merge_trees(tree_a, tree_b, workers=None, merge_threshold=MERGE_THRESHOLD, review_threshold=REVIEW_THRESHOLD):
+    """Merge tree_b into tree_a; returns (merged tree, match report)
+
+    A pair is merged when it scores at least merge_threshold and something
+    besides the name (years or relatives) backs it up; each person is merged
+    at most once, best score first. Merged people keep tree_a's id and gain
+    tree_b's name and aliases as aliases and any fields tree_a left empty.
+    Everyone else from tree_b is added, under a new id if theirs is taken.
+    """
+    scored, stats = find_matches(tree_a, tree_b, workers, review_threshold)
+    people_a, people_b = tree_a["people"], tree_b["people"]
+
+    matched_a, matched_b = {}, {}
+    merged, review = [], []
+    for i, j, score, evidence in scored:
+        if i in matched_a or j in matched_b:
+            continue
+        corroborated = any(evidence[key] is not None and evidence[key] >= 0.8 for key in ("birth", "death", "relatives"))
+        entry = {"score": score, "evidence": evidence, "base": _summary(people_a[i]), "other": _summary(people_b[j])}
+        if score >= merge_threshold and corroborated:
+            matched_a[i], matched_b[j] = j, i
+            merged.append(dict(entry, decision="merged"))
+        elif score >= review_threshold:
+            review.append(dict(entry, decision="review"))
+    # Pairs listed for review whose people were merged with someone else are no longer open
+    merged_a = {entry["base"]["id"] for entry in merged}
+    merged_b = {entry["other"]["id"] for entry in merged}
+    review = [entry for entry in review
+              if entry["base"]["id"] not in merged_a and entry["other"]["id"] not in merged_b]
+
+    result_people = [dict(person, aliases=list(person.get("aliases") or [])) for person in people_a]
+    ids = {person["id"] for person in result_people}
+    id_map = {}
+    for j, person in enumerate(people_b):
+        if j in matched_b:
+            target = result_people[matched_b[j]]
+            id_map[person["id"]] = target["id"]
+            for alias in [person.get("name")] + list(person.get("aliases") or []):
+                if alias and alias != target.get("name") and alias not in target["aliases"]:
+                    target["aliases"].append(alias)
+            for key in ("gender", "birthYear", "deathYear", "notes"):
+                if target.get(key) is None and person.get(key) is not None:
+                    target[key] = person[key]
+            continue
+        new_id, counter = person["id"], 1
+        while new_id in ids:
+            new_id = f"{person['id']}_{counter}"
+            counter += 1
+        ids.add(new_id)
+        id_map[person["id"]] = new_id
+        result_people.append(dict(person, id=new_id))
+
+    relationships = [dict(rel) for rel in tree_a["relationships"]]
+    seen = set()
+    for rel in relationships:
+        seen.add(_edge(rel))
+    added_relationships = 0
+    for rel in tree_b["relationships"]:
+        rel = dict(rel)
+        if rel.get("type") == "parentChild":
+            rel["parentId"] = id_map.get(rel["parentId"], rel["parentId"])
+            rel["childId"] = id_map.get(rel["childId"], rel["childId"])
+        elif rel.get("type") == "spouse":
+            rel["people"] = [id_map.get(pid, pid) for pid in rel["people"]]
+        key = _edge(rel)
+        if key in seen:
+            continue
+        seen.add(key)
+        relationships.append(rel)
+        added_relationships += 1
+
+    meta = dict(tree_a.get("meta", {}))
+    meta["modified"] = datetime.now().isoformat()
+    result = {"meta": meta, "people": result_people, "relationships": relationships}
+
+    report = dict(stats, **{
+        "people": {"base": len(people_a), "other": len(people_b), "merged": len(merged),
+                   "added": len(people_b) - len(merged), "total": len(result_people)},
+        "relationshipsAdded": added_relationships,
+        "idsChanged": {old: new for old, new in id_map.items() if old != new},
+        "merged": merged,
+        "review": review,
+        "issues": validate_tree(result)
+    })
+    return result, report
+
+
+def _edge(rel):
+    if rel.get("type") == "spouse":
+        return ("spouse",) + tuple(sorted(rel.get("people") or [], key=str))
+    return (rel.get("type"), rel.get("parentId"), rel.get("childId"))
@@ -1,11 +1,20 @@
 // Edit Mode Functionality
 let originalTreeData = null;
+let treeVersion = null; // Server version the local tree is based on (sent as If-Match)
+let changeFeed = null;
+let savedModified = null; // meta.modified as last loaded or saved; local edits change it
+let renderPending = false;
+let saving = false; // Our own save's event can arrive before its response
+let heldEdits = []; // Edit events that arrived during our own save, applied once it answers
 
 // Initialize edit mode
 function initEditMode() {
     // Store original data for reload
     if (treeData) {
         originalTreeData = JSON.parse(JSON.stringify(treeData));
+        treeVersion = Number.isInteger(treeData.meta.version) ? treeData.meta.version : 0;
+        savedModified = treeData.meta.modified;
+        startChangeFeed();
     }
 
     // Initialize autocomplete fields
@@ -401,17 +410,20 @@ function wouldCreateCycle(parentId, childId) {
         }
     });
 
-    // Check if childId is an ancestor of parentId
-    function isAncestor(ancestorId, descendantId) {
-        if (ancestorId === descendantId) return true;
-        const parents = parentMap[descendantId] || [];
-        for (const parent of parents) {
-            if (isAncestor(ancestorId, parent)) return true;
+    // Check if childId is an ancestor of parentId, visiting each ancestor once
+    const seen = new Set([parentId]);
+    const stack = [parentId];
+    while (stack.length > 0) {
+        const id = stack.pop();
+        if (id === childId) return true;
+        for (const parent of parentMap[id] || []) {
+            if (!seen.has(parent)) {
+                seen.add(parent);
+                stack.push(parent);
+            }
         }
-        return false;
     }
-
-    return isAncestor(childId, parentId);
+    return false;
 }
 
 // Handle add parent-child relationship
@@ -730,19 +742,29 @@ async function saveToServer() {
     const saveSection = document.querySelector('.edit-section:last-child');
     const msgContainer = saveSection || document.body;
 
+    saving = true;
     try {
-        const response = await fetch('/save', {
+        const response = await fetch('save', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                // Only overwrite the version this copy is based on; edits from others arrive via the change feed
+                'If-Match': treeVersion === null ? '*' : `"${treeVersion}"`
             },
             body: JSON.stringify(treeData, null, 2) // Pretty print
         });
 
         if (response.ok) {
+            const result = await response.json();
+            treeVersion = result.version;
+            treeData.meta.version = result.version;
+            savedModified = treeData.meta.modified;
             showMessageInElement(msgContainer, '✅ Saved to family1.json successfully!', 'success');
             // Optionally reload the tree to ensure consistency, preserving collapsed state
             // renderTree(); // Already handled by not resetting collapsedNodes
+        } else if (response.status === 409) {
+            const err = await response.json();
+            throw new Error(`${err.message}. Your unsaved edits are still here; download them before reloading`);
         } else {
             const err = await response.json();
             throw new Error(err.message || 'Unknown server error');
@@ -750,6 +772,138 @@ async function saveToServer() {
     } catch (error) {
         console.error("Save failed:", error);
         showMessageInElement(msgContainer, `❌ Save Failed: ${error.message}. Make sure server.py is running!`, 'error');
+    } finally {
+        saving = false;
+        heldEdits.splice(0).forEach(receiveEdits);
+    }
+}
+
+// Live change feed: apply other people's edits as they happen instead of reloading the tree
+function startChangeFeed() {
+    if (typeof EventSource === 'undefined' || changeFeed || location.protocol === 'file:') {
+        return;
+    }
+    changeFeed = new EventSource(`api/events?since=${treeVersion}`);
+    // One PATCH /api/changes edit, or every edit a /save made
+    changeFeed.addEventListener('change', e => receiveEdits(JSON.parse(e.data)));
+    changeFeed.addEventListener('changes', e => receiveEdits(JSON.parse(e.data)));
+    changeFeed.addEventListener('replace', e => {
+        const event = JSON.parse(e.data);
+        if (event.version <= treeVersion || saving) {
+            return;
+        }
+        if (treeData.meta.modified !== savedModified) {
+            const saveSection = document.querySelector('.edit-section:last-child');
+            showMessageInElement(saveSection || document.body,
+                '⚠️ Someone else saved the whole tree. Download your unsaved edits, then reload the page.', 'error');
+            return;
+        }
+        reloadFromServer();
+    });
+}
+
+function receiveEdits(event) {
+    if (saving) {
+        heldEdits.push(event); // Might be our own save, which the response will tell
+        return;
+    }
+    if (event.version <= treeVersion) {
+        return; // Already have it
+    }
+    (event.changes || [event.change]).forEach(applyRemoteChange);
+    treeVersion = event.version;
+    treeData.meta.version = event.version;
+    scheduleRender();
+}
+
+// Mirror of TreeStore._apply in tree_store.py for one PATCH /api/changes edit
+function applyRemoteChange(change) {
+    const sameEdge = (a, b) => a.type === b.type && (a.type === 'parentChild'
+        ? a.parentId === b.parentId && a.childId === b.childId
+        : a.people.includes(b.people[0]) && a.people.includes(b.people[1]));
+    const removeRelationships = keep => {
+        // Splice in place: `relationships` refers to the same array
+        for (let i = treeData.relationships.length - 1; i >= 0; i--) {
+            if (!keep(treeData.relationships[i])) {
+                treeData.relationships.splice(i, 1);
+            }
+        }
+    };
+
+    switch (change.op) {
+        case 'addPerson':
+            if (!peopleMap[change.person.id]) {
+                const person = Object.assign({}, change.person);
+                treeData.people.push(person);
+                peopleMap[person.id] = person;
+            }
+            break;
+        case 'updatePerson':
+            if (peopleMap[change.id]) {
+                Object.assign(peopleMap[change.id], change.fields);
+            }
+            break;
+        case 'deletePerson':
+            removeRelationships(rel => rel.type === 'parentChild'
+                ? rel.parentId !== change.id && rel.childId !== change.id
+                : !rel.people.includes(change.id));
+            treeData.people = treeData.people.filter(p => p.id !== change.id);
+            delete peopleMap[change.id];
+            if (treeData.meta.rootPersonId === change.id) {
+                treeData.meta.rootPersonId = null;
+            }
+            break;
+        case 'addRelationship':
+            treeData.relationships.push(Object.assign({}, change.relationship));
+            break;
+        case 'deleteRelationship':
+            removeRelationships(rel => !sameEdge(rel, change.relationship));
+            break;
+        case 'updateMeta':
+            Object.assign(treeData.meta, change.fields);
+            break;
+    }
+    if (treeData.meta.rootPersonId && peopleMap[treeData.meta.rootPersonId]) {
+        rootPersonId = treeData.meta.rootPersonId;
+    } else if (!peopleMap[rootPersonId] && treeData.people.length > 0) {
+        rootPersonId = treeData.people[0].id;
+    }
+}
+
+// Coalesce a burst of remote edits into one redraw
+function scheduleRender() {
+    if (renderPending) {
+        return;
+    }
+    renderPending = true;
+    requestAnimationFrame(() => {
+        renderPending = false;
+        renderTree();
+        updateEditForms();
+    });
+}
+
+// The whole tree was replaced on the server (a save or import): fetch it again
+async function reloadFromServer() {
+    try {
+        const response = await fetch('family1.json', { cache: 'no-cache' });
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        treeData = data;
+        originalTreeData = JSON.parse(JSON.stringify(data));
+        peopleMap = {};
+        treeData.people.forEach(person => {
+            peopleMap[person.id] = person;
+        });
+        relationships = treeData.relationships;
+        rootPersonId = treeData.meta.rootPersonId || treeData.people[0].id;
+        treeVersion = Number.isInteger(treeData.meta.version) ? treeData.meta.version : 0;
+        savedModified = treeData.meta.modified;
+        scheduleRender();
+    } catch (error) {
+        console.error('Reload after remote save failed:', error);
     }
 }
 
@@ -4,9 +4,68 @@ Interactive Family Tree Builder
 Build a family tree in JSON format with people and relationships
 """
 
+import argparse
+import csv
+import gc
 import json
 import os
+import sqlite3
+from collections import Counter
 from datetime import datetime
+from itertools import islice
+
+from analytics import HAVE_NUMPY, tree_stats
+from compact_tree import CompactTree
+from dedupe import MERGE_THRESHOLD, REVIEW_THRESHOLD, merge_trees
+from family_graph import FamilyGraph
+from gedcom import GedcomReader, new_meta, print_progress, read_gedcom, write_gedcom
+from kinship import KinshipIndex
+from storage import SQLITE_EXTENSIONS, SqliteStorage
+from undo import UndoHistory
+from validation import ValidationError, check_new_edge, cycle_issues, errors_only, validate_tree
+
+
+def parse_year(value):
+    """CSV cell -> int year or None"""
+    value = (value or "").strip()
+    if not value:
+        return None
+    if not value.lstrip("-").isdigit():
+        raise ValueError(f"Expected a year, got {value!r}")
+    return int(value)
+
+
+def parse_flag(value, default=True):
+    """CSV cell like yes/no/true/false/1/0 -> bool"""
+    value = (value or "").strip().lower()
+    if not value:
+        return default
+    if value in ("1", "true", "yes", "y"):
+        return True
+    if value in ("0", "false", "no", "n"):
+        return False
+    raise ValueError(f"Expected yes or no, got {value!r}")
+
+
+def read_csv(path):
+    """(line number, {column: value}) for each row of a CSV file with a header row"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = [column.strip() for column in next(reader, [])]
+        for line, row in enumerate(reader, 2):
+            if row:
+                yield line, dict(zip(header, row))
+
+
+def batches(rows, size):
+    """Lists of up to `size` items from an iterator"""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
 
 class FamilyTreeBuilder:
     def __init__(self):
@@ -21,7 +80,13 @@ class FamilyTreeBuilder:
             "people": [],
             "relationships": []
         }
-        self.people_dict = {}  # For quick lookup
+        self.graph = FamilyGraph()  # Parent/child/spouse indexes
+        self.people_dict = self.graph.people  # For quick lookup
+        self.storage = None  # SQLite database edits are written through to, if any
+        self.compact = None  # The tree in columns when loaded read-only with load_file(..., compact=True)
+        self.kinship = None  # Ancestry index, rebuilt after relationships change
+        self.next_suffix = {}  # ID base -> next numeric suffix to try
+        self.history = UndoHistory()  # Checkpoints for undo/redo, sharing unchanged records
         
     def clear_screen(self):
         """Clear terminal screen"""
@@ -34,16 +99,27 @@ class FamilyTreeBuilder:
         print("=" * 60)
         print()
     
+    def save_changes(self, *changes):
+        """Write one edit through to the attached database in a single transaction"""
+        if self.storage is None:
+            return
+        try:
+            self.storage.append_batch(changes)
+        except sqlite3.Error as e:
+            print(f"❌ Error saving to {self.storage.path}: {e}")
+    
     def generate_id(self, name):
         """Generate a unique ID from a name"""
         base = name.lower().replace(" ", "_")
         base = ''.join(c for c in base if c.isalnum() or c == '_')
         
-        # Check if ID exists, append number if needed
+        # Check if ID exists, append number if needed. Each base remembers the
+        # next suffix to try, so repeated names don't rescan from _1
         if base in self.people_dict:
-            counter = 1
+            counter = self.next_suffix.get(base, 1)
             while f"{base}_{counter}" in self.people_dict:
                 counter += 1
+            self.next_suffix[base] = counter + 1
             return f"{base}_{counter}"
         return base
     
@@ -101,8 +177,10 @@ class FamilyTreeBuilder:
             "notes": notes
         }
         
+        self.history.record(self.tree, f"add {name}")
         self.tree["people"].append(person)
-        self.people_dict[person_id] = person
+        self.graph.add_person(person)
+        self.kinship = None
         print(f"\n✅ Added: {name} (ID: {person_id})")
         
         # If this is the first person, ask if they should be root
@@ -114,6 +192,11 @@ class FamilyTreeBuilder:
         
         # Update modification timestamp
         self.tree["meta"]["modified"] = datetime.now().isoformat()
+        self.save_changes(
+            {"op": "addPerson", "person": person},
+            {"op": "updateMeta", "fields": {"rootPersonId": self.tree["meta"]["rootPersonId"],
+                                            "modified": self.tree["meta"]["modified"]}}
+        )
         input("\nPress Enter to continue...")
     
     def add_spouse_relationship(self):
@@ -133,8 +216,10 @@ class FamilyTreeBuilder:
         person1 = input("\nEnter ID of first spouse: ").strip()
         person2 = input("Enter ID of second spouse: ").strip()
         
-        if person1 not in self.people_dict or person2 not in self.people_dict:
-            print("❌ One or both people not found!")
+        issues = check_new_edge(self.graph, {"type": "spouse", "people": [person1, person2]})
+        if issues:
+            for issue in issues:
+                print(f"❌ {issue['message']}")
             input("\nPress Enter to continue...")
             return
         
@@ -154,8 +239,15 @@ class FamilyTreeBuilder:
             "notes": notes
         }
         
+        self.history.record(self.tree, f"spouses {person1} and {person2}")
         self.tree["relationships"].append(relationship)
+        self.graph.add_relationship(relationship)
+        self.kinship = None
         self.tree["meta"]["modified"] = datetime.now().isoformat()
+        self.save_changes(
+            {"op": "addRelationship", "relationship": relationship},
+            {"op": "updateMeta", "fields": {"modified": self.tree["meta"]["modified"]}}
+        )
         print(f"\n✅ Added spouse relationship between {self.people_dict[person1]['name']} and {self.people_dict[person2]['name']}")
         input("\nPress Enter to continue...")
     
@@ -176,8 +268,10 @@ class FamilyTreeBuilder:
         parent_id = input("\nEnter ID of parent: ").strip()
         child_id = input("Enter ID of child: ").strip()
         
-        if parent_id not in self.people_dict or child_id not in self.people_dict:
-            print("❌ One or both people not found!")
+        issues = check_new_edge(self.graph, {"type": "parentChild", "parentId": parent_id, "childId": child_id})
+        if issues:
+            for issue in issues:
+                print(f"❌ {issue['message']}")
             input("\nPress Enter to continue...")
             return
         
@@ -194,8 +288,15 @@ class FamilyTreeBuilder:
             "notes": notes
         }
         
+        self.history.record(self.tree, f"{parent_id} parent of {child_id}")
         self.tree["relationships"].append(relationship)
+        self.graph.add_relationship(relationship)
+        self.kinship = None
         self.tree["meta"]["modified"] = datetime.now().isoformat()
+        self.save_changes(
+            {"op": "addRelationship", "relationship": relationship},
+            {"op": "updateMeta", "fields": {"modified": self.tree["meta"]["modified"]}}
+        )
         print(f"\n✅ Added parent-child relationship: {self.people_dict[parent_id]['name']} -> {self.people_dict[child_id]['name']}")
         input("\nPress Enter to continue...")
     
@@ -248,11 +349,95 @@ class FamilyTreeBuilder:
         
         input("\nPress Enter to continue...")
     
+    def view_relatives(self):
+        """Display a person's immediate family, ancestors and descendants"""
+        self.clear_screen()
+        self.print_header()
+        print("EXPLORE RELATIVES")
+        print("-" * 40)
+        
+        if not self.tree["people"]:
+            print("❌ No people in tree!")
+            input("\nPress Enter to continue...")
+            return
+        
+        self.list_people()
+        
+        person_id = input("\nEnter ID of person: ").strip()
+        if person_id not in self.people_dict:
+            print("❌ Person not found!")
+            input("\nPress Enter to continue...")
+            return
+        
+        depth = input("Generations to show (or press Enter for all): ").strip()
+        depth = int(depth) if depth else None
+        
+        def name_of(pid):
+            return self.people_dict.get(pid, {}).get("name", pid)
+        
+        print(f"\n{name_of(person_id)} ({person_id})")
+        for label, ids in (("Parents", self.graph.get_parents(person_id)),
+                           ("Spouses", self.graph.get_spouses(person_id)),
+                           ("Siblings", self.graph.get_siblings(person_id)),
+                           ("Children", self.graph.get_children(person_id))):
+            print(f"  {label}: {', '.join(name_of(pid) for pid in ids) or '-'}")
+        
+        print("\n⬆️  Ancestors:")
+        for ancestor_id, generation in self.graph.ancestors(person_id, depth):
+            print(f"  {'  ' * (generation - 1)}{generation}. {name_of(ancestor_id)}")
+        
+        print("\n⬇️  Descendants:")
+        for descendant_id, generation in self.graph.descendants(person_id, depth):
+            print(f"  {'  ' * (generation - 1)}{generation}. {name_of(descendant_id)}")
+        
+        input("\nPress Enter to continue...")
+    
+    def find_kinship(self):
+        """Explain how two people are related"""
+        self.clear_screen()
+        self.print_header()
+        print("HOW ARE THEY RELATED?")
+        print("-" * 40)
+        
+        if len(self.tree["people"]) < 2:
+            print("❌ Need at least 2 people to compare!")
+            input("\nPress Enter to continue...")
+            return
+        
+        self.list_people()
+        
+        person1 = input("\nEnter ID of first person: ").strip()
+        person2 = input("Enter ID of second person: ").strip()
+        
+        if person1 not in self.people_dict or person2 not in self.people_dict:
+            print("❌ One or both people not found!")
+            input("\nPress Enter to continue...")
+            return
+        
+        if self.kinship is None:
+            self.kinship = KinshipIndex(self.graph)
+        result = self.kinship.relate(person1, person2)
+        
+        def name_of(pid):
+            return self.people_dict.get(pid, {}).get("name", pid)
+        
+        print(f"\n🧬 {name_of(person1)} is {name_of(person2)}'s {result['relationship']}")
+        if result["lowestCommonAncestors"]:
+            closest = ", ".join(name_of(pid) for pid in result["lowestCommonAncestors"][:2])
+            print(f"   Closest common ancestor(s): {closest}")
+            print(f"   Generations up: {result['generationsFromA']} / {result['generationsFromB']}")
+        if result["path"]:
+            steps = [name_of(result["path"][0]["id"])]
+            steps += [f"{step['via']} {name_of(step['id'])}" for step in result["path"][1:]]
+            print(f"   Path: {' → '.join(steps)}")
+        
+        input("\nPress Enter to continue...")
+    
     def export_to_json(self):
-        """Export the tree to a JSON file"""
+        """Export the tree to a JSON file, SQLite database or GEDCOM file"""
         self.clear_screen()
         self.print_header()
-        print("EXPORT TO JSON")
+        print("EXPORT TO JSON / SQLITE / GEDCOM")
         print("-" * 40)
         
         if not self.tree["people"]:
@@ -263,26 +448,43 @@ class FamilyTreeBuilder:
         # Update modification timestamp
         self.tree["meta"]["modified"] = datetime.now().isoformat()
         
-        filename = input("Enter filename (default: family_tree.json): ").strip()
+        filename = input("Enter filename, .json, .db or .ged (default: family_tree.json): ").strip()
         if not filename:
             filename = "family_tree.json"
-        if not filename.endswith('.json'):
+        if not filename.endswith(('.json', '.ged') + SQLITE_EXTENSIONS):
             filename += '.json'
         
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(self.tree, f, indent=2, ensure_ascii=False)
+            self.save_file(filename)
             print(f"\n✅ Successfully exported to {filename}")
+            if filename.endswith(SQLITE_EXTENSIONS):
+                print("💾 Further edits will be saved to this database as you make them")
         except Exception as e:
             print(f"\n❌ Error exporting: {e}")
         
         input("\nPress Enter to continue...")
     
+    def save_file(self, filename):
+        """Write the tree to a .json, .db or .ged file; a database also receives later edits"""
+        if filename.endswith('.ged'):
+            with open(filename, 'w', encoding='utf-8') as f:
+                write_gedcom(self.tree, f, progress=print_progress)
+        elif filename.endswith(SQLITE_EXTENSIONS):
+            storage = SqliteStorage(filename)
+            storage.write_snapshot(self.tree)
+            self.storage = storage
+        elif self.compact is not None:
+            with open(filename, 'w', encoding='utf-8') as f:
+                self.compact.write_json(f)
+        else:
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(self.tree, f, indent=2, ensure_ascii=False)
+    
     def import_from_json(self):
-        """Import a tree from a JSON file"""
+        """Import a tree from a JSON file, SQLite database or GEDCOM file"""
         self.clear_screen()
         self.print_header()
-        print("IMPORT FROM JSON")
+        print("IMPORT FROM JSON / SQLITE / GEDCOM")
         print("-" * 40)
         
         filename = input("Enter filename to import: ").strip()
@@ -291,33 +493,14 @@ class FamilyTreeBuilder:
             input("\nPress Enter to continue...")
             return
         
-        if not filename.endswith('.json'):
+        if not filename.endswith(('.json', '.ged') + SQLITE_EXTENSIONS):
             filename += '.json'
         
         try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                imported_tree = json.load(f)
-            
-            # Validate basic structure
-            if "people" not in imported_tree or "relationships" not in imported_tree:
-                print("❌ Invalid family tree file!")
-                input("\nPress Enter to continue...")
-                return
-            
-            self.tree = imported_tree
-            
-            # Ensure meta has created and modified fields
-            if "created" not in self.tree["meta"]:
-                self.tree["meta"]["created"] = datetime.now().isoformat()
-            if "modified" not in self.tree["meta"]:
-                self.tree["meta"]["modified"] = datetime.now().isoformat()
-            
-            # Rebuild people_dict
-            self.people_dict = {}
-            for person in self.tree["people"]:
-                self.people_dict[person["id"]] = person
-            
+            self.load_file(filename)
             print(f"\n✅ Successfully imported {len(self.tree['people'])} people and {len(self.tree['relationships'])} relationships")
+            if self.storage is not None:
+                print("💾 Further edits will be saved to this database as you make them")
         except FileNotFoundError:
             print(f"\n❌ File not found: {filename}")
         except json.JSONDecodeError:
@@ -327,6 +510,230 @@ class FamilyTreeBuilder:
         
         input("\nPress Enter to continue...")
     
+    def load_file(self, filename, compact=False):
+        """Replace the tree with one read from a .json, .db or .ged file; a database receives later edits
+
+        A .ged file is built into a whole tree in memory, since the builder
+        edits it there; `gedcom.py tree.ged family.db` streams a large file.
+        With compact=True the tree is read straight into a CompactTree and
+        self.tree serves its records on access, so a large tree takes a
+        fraction of the memory. Such a builder is for reading the tree
+        (stats, save_file), not editing it.
+        """
+        if compact:
+            self._load_compact(filename)
+            return
+        storage = None
+        if filename.endswith('.ged'):
+            title = os.path.splitext(os.path.basename(filename))[0]
+            with open(filename, 'rb') as f:
+                imported_tree, _ = read_gedcom(f, title, total_bytes=os.path.getsize(filename),
+                                               progress=print_progress)
+        elif filename.endswith(SQLITE_EXTENSIONS):
+            if not os.path.exists(filename):
+                raise FileNotFoundError(filename)
+            storage = SqliteStorage(filename)
+            imported_tree, _ = storage.read()
+        else:
+            with open(filename, 'r', encoding='utf-8') as f:
+                imported_tree = json.load(f)
+        
+        # Validate basic structure
+        if "people" not in imported_tree or "relationships" not in imported_tree:
+            raise ValueError("Invalid family tree file!")
+        
+        self.tree = imported_tree
+        
+        # Ensure meta has created and modified fields
+        if "created" not in self.tree["meta"]:
+            self.tree["meta"]["created"] = datetime.now().isoformat()
+        if "modified" not in self.tree["meta"]:
+            self.tree["meta"]["modified"] = datetime.now().isoformat()
+        
+        # Rebuild indexes in one pass over people and relationships
+        self.graph = FamilyGraph.from_tree(self.tree)
+        self.people_dict = self.graph.people
+        self.storage = storage
+        self.compact = None
+        self.kinship = None
+        self.next_suffix = {}
+        self.history = UndoHistory()  # Undo goes back to the loaded tree, not across files
+    
+    def _load_compact(self, filename):
+        """load_file(filename, compact=True): records go into the columns one at a time"""
+        if filename.endswith('.ged'):
+            title = os.path.splitext(os.path.basename(filename))[0]
+            compact = CompactTree({"meta": new_meta(title), "people": None, "relationships": None})
+            with open(filename, 'rb') as f:
+                reader = GedcomReader(f, total_bytes=os.path.getsize(filename), progress=print_progress)
+                for change in reader.changes():
+                    if change["op"] == "addPerson":
+                        compact.add_person(change["person"])
+                    else:
+                        compact.add_relationship(change["relationship"])
+            if compact.person_count:
+                compact.meta["meta"]["rootPersonId"] = compact.ids[compact.person_id[0]]
+        elif filename.endswith(SQLITE_EXTENSIONS):
+            if not os.path.exists(filename):
+                raise FileNotFoundError(filename)
+            storage = SqliteStorage(filename)
+            try:
+                meta, people, relationships = storage.records()
+                compact = CompactTree({"meta": meta, "people": None, "relationships": None})
+                for person in people:
+                    compact.add_person(person)
+                for rel in relationships:
+                    compact.add_relationship(rel)
+            finally:
+                storage.close()
+        else:
+            with open(filename, 'r', encoding='utf-8') as f:
+                compact = CompactTree.from_json(f.read())
+        
+        if "people" not in compact.meta or "relationships" not in compact.meta:
+            raise ValueError("Invalid family tree file!")
+        self.compact = compact
+        self.tree = compact.document()
+        self.tree["meta"].setdefault("created", datetime.now().isoformat())
+        self.tree["meta"].setdefault("modified", datetime.now().isoformat())
+        self.graph = None
+        self.people_dict = {}
+        self.storage = None
+        self.kinship = None
+        self.next_suffix = {}
+        self.history = UndoHistory()
+    
+    def commit_batch(self, changes):
+        """Stamp the tree once for a whole batch of edits and write them in one transaction"""
+        if not changes:
+            return
+        meta = self.tree["meta"]
+        if meta.get("rootPersonId") is None and self.tree["people"]:
+            meta["rootPersonId"] = self.tree["people"][0]["id"]
+        meta["modified"] = datetime.now().isoformat()
+        self.kinship = None
+        self.save_changes(*changes, {"op": "updateMeta", "fields": {"rootPersonId": meta["rootPersonId"],
+                                                                   "modified": meta["modified"]}})
+    
+    def ingest_csv(self, people_path, relationships_path=None, batch_size=10000):
+        """Bulk-load people and relationships from CSV files
+        
+        people.csv columns: name, and optionally id, gender, aliases (separated
+        by ";"), birthYear, deathYear and notes. A missing or taken id is
+        generated from the name. relationships.csv columns: type (parentChild or
+        spouse), person1 and person2 (for parentChild, the parent then the
+        child), and optionally biological, startYear, endYear and notes; people
+        are referred to by the id column of people.csv or by ids already in the
+        tree. Bad rows are skipped and reported.
+        
+        Rows are indexed first and checked for parent/child cycles in one pass
+        (raising ValidationError, with nothing written, if there are any), then
+        written out `batch_size` records per transaction.
+        """
+        self.history.record(self.tree, f"ingest {people_path}")
+        # Millions of new dicts would otherwise trigger the cycle collector over and over
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return self._ingest_csv(people_path, relationships_path, batch_size)
+        finally:
+            if collecting:
+                gc.enable()
+    
+    def _ingest_csv(self, people_path, relationships_path, batch_size):
+        people, relationships = self.tree["people"], self.tree["relationships"]
+        first_person, first_relationship = len(people), len(relationships)
+        skipped = []
+        ids = {}  # people.csv id -> id actually used, where they differ
+        
+        for line, row in read_csv(people_path):
+            name = (row.get("name") or "").strip()
+            try:
+                if not name:
+                    raise ValueError("name is required")
+                person = {
+                    "id": None,
+                    "name": name,
+                    "gender": (row.get("gender") or "").strip().upper() or None,
+                    "aliases": [a.strip() for a in (row.get("aliases") or "").split(";") if a.strip()],
+                    "birthYear": parse_year(row.get("birthYear")),
+                    "deathYear": parse_year(row.get("deathYear")),
+                    "notes": (row.get("notes") or "").strip() or None
+                }
+            except ValueError as e:
+                skipped.append((people_path, line, str(e)))
+                continue
+            key = (row.get("id") or "").strip()
+            person_id = key if key and key not in self.people_dict else self.generate_id(name)
+            if key and key != person_id:
+                ids[key] = person_id
+            person["id"] = person_id
+            people.append(person)
+            self.graph.add_person(person)
+        
+        if relationships_path:
+            for line, row in read_csv(relationships_path):
+                rel_type = (row.get("type") or "").strip()
+                person1 = (row.get("person1") or "").strip()
+                person2 = (row.get("person2") or "").strip()
+                person1, person2 = ids.get(person1, person1), ids.get(person2, person2)
+                notes = (row.get("notes") or "").strip() or None
+                try:
+                    if rel_type == "parentChild":
+                        relationship = {"type": "parentChild", "parentId": person1, "childId": person2,
+                                        "biological": parse_flag(row.get("biological")), "notes": notes}
+                    elif rel_type == "spouse":
+                        relationship = {"type": "spouse", "people": [person1, person2],
+                                        "startYear": parse_year(row.get("startYear")),
+                                        "endYear": parse_year(row.get("endYear")), "notes": notes}
+                    else:
+                        raise ValueError(f"type must be parentChild or spouse, not {rel_type!r}")
+                except ValueError as e:
+                    skipped.append((relationships_path, line, str(e)))
+                    continue
+                issues = check_new_edge(self.graph, relationship, check_cycles=False)
+                if issues:
+                    skipped.append((relationships_path, line, issues[0]["message"]))
+                    continue
+                relationships.append(relationship)
+                self.graph.add_relationship(relationship)
+        
+        if len(relationships) > first_relationship:
+            cycles = cycle_issues(self.graph.parents)
+            if cycles:
+                del people[first_person:]
+                del relationships[first_relationship:]
+                self.graph = FamilyGraph.from_tree(self.tree)
+                self.people_dict = self.graph.people
+                raise ValidationError(cycles)
+        
+        for batch in batches(people[first_person:], batch_size):
+            self.commit_batch([{"op": "addPerson", "person": person} for person in batch])
+        for batch in batches(relationships[first_relationship:], batch_size):
+            self.commit_batch([{"op": "addRelationship", "relationship": rel} for rel in batch])
+        
+        added = {"people": len(people) - first_person, "relationships": len(relationships) - first_relationship}
+        return added, skipped
+    
+    def stats(self):
+        """Summary counts for the current tree"""
+        relationships = Counter(rel.get("type") for rel in self.tree["relationships"])
+        births = [p["birthYear"] for p in self.tree["people"] if isinstance(p.get("birthYear"), int)]
+        graph = self.compact if self.compact is not None else self.graph
+        issues = validate_tree(self.tree)
+        return {
+            "people": len(self.tree["people"]),
+            "parentChild": relationships["parentChild"],
+            "spouse": relationships["spouse"],
+            "genders": dict(Counter(p.get("gender") or "unknown" for p in self.tree["people"])),
+            "generations": graph.generation_count(),
+            "withoutParents": graph.parentless_count(),
+            "earliestBirth": min(births, default=None),
+            "latestBirth": max(births, default=None),
+            "errors": len(errors_only(issues)),
+            "warnings": len(issues) - len(errors_only(issues))
+        }
+    
     def edit_meta(self):
         """Edit metadata"""
         self.clear_screen()
@@ -334,6 +741,7 @@ class FamilyTreeBuilder:
         print("EDIT METADATA")
         print("-" * 40)
         
+        self.history.record(self.tree, "edit metadata")
         print(f"Current title: {self.tree['meta']['title']}")
         new_title = input("New title (or press Enter to keep): ").strip()
         if new_title:
@@ -355,9 +763,41 @@ class FamilyTreeBuilder:
             self.tree['meta']['notes'] = new_notes
         
         self.tree['meta']['modified'] = datetime.now().isoformat()
+        self.save_changes({"op": "updateMeta", "fields": dict(self.tree['meta'])})
         print("\n✅ Metadata updated")
         input("\nPress Enter to continue...")
     
+    def undo(self):
+        """Go back to the tree as it was before the last edit"""
+        self.step(self.history.undo, "↩️  Undid", "undo")
+    
+    def redo(self):
+        """Make the last undone edit again"""
+        self.step(self.history.redo, "↪️  Redid", "redo")
+    
+    def step(self, move, done, action):
+        """Apply an undo or redo to the tree, its indexes and any attached database"""
+        result = move(self.tree)
+        if result is None:
+            print(f"\n❌ Nothing to {action}!")
+            input("\nPress Enter to continue...")
+            return
+        label, changes = result
+        for change in changes:
+            if change["op"] == "deleteRelationship":
+                self.graph.remove_relationship(change["relationship"])
+            elif change["op"] == "deletePerson":
+                self.graph.remove_person(change["id"])
+            elif change["op"] == "addPerson":
+                self.graph.add_person(change["person"])
+            elif change["op"] == "addRelationship":
+                self.graph.add_relationship(change["relationship"])
+        self.kinship = None
+        self.next_suffix = {}
+        self.save_changes(*changes)
+        print(f"\n{done}: {label}")
+        input("\nPress Enter to continue...")
+    
     def run(self):
         """Main interactive loop"""
         while True:
@@ -376,14 +816,18 @@ class FamilyTreeBuilder:
             print("3. 👪 Add Parent-Child Relationship")
             print("4. 👥 List All People")
             print("5. 🌳 View Family Tree")
-            print("6. 📤 Export to JSON")
-            print("7. 📥 Import from JSON")
+            print("6. 📤 Export (JSON / SQLite / GEDCOM)")
+            print("7. 📥 Import (JSON / SQLite / GEDCOM)")
             print("8. ⚙️  Edit Metadata")
             print("9. 🧹 New Tree (Clear All)")
+            print("10. 🔎 Explore Relatives")
+            print("11. 🧬 How Are They Related?")
+            print("12. ↩️  Undo" + (f" ({self.history.undo_stack[-1].label})" if self.history.can_undo() else ""))
+            print("13. ↪️  Redo" + (f" ({self.history.redo_stack[-1].label})" if self.history.can_redo() else ""))
             print("0. 🚪 Exit")
             print()
             
-            choice = input("Enter your choice (0-9): ").strip()
+            choice = input("Enter your choice (0-13): ").strip()
             
             if choice == '1':
                 self.add_person()
@@ -410,6 +854,14 @@ class FamilyTreeBuilder:
                     self.__init__()
                     print("✅ Created new empty tree")
                     input("\nPress Enter to continue...")
+            elif choice == '10':
+                self.view_relatives()
+            elif choice == '11':
+                self.find_kinship()
+            elif choice == '12':
+                self.undo()
+            elif choice == '13':
+                self.redo()
             elif choice == '0':
                 print("\n👋 Goodbye!")
                 break
@@ -418,7 +870,7 @@ class FamilyTreeBuilder:
                 input("Press Enter to continue...")
 
 
-def main():
+def interactive():
     builder = FamilyTreeBuilder()
     
     # Optional: Load example data from your JSON
@@ -455,13 +907,175 @@ def main():
             ]
         }
         builder.tree = example_data
-        for person in example_data["people"]:
-            builder.people_dict[person["id"]] = person
+        builder.graph = FamilyGraph.from_tree(example_data)
+        builder.people_dict = builder.graph.people
         print("✅ Loaded example family tree")
         input("\nPress Enter to continue...")
     
     builder.run()
 
 
+def ingest_command(args):
+    builder = FamilyTreeBuilder()
+    if os.path.exists(args.tree):
+        builder.load_file(args.tree)
+    elif args.tree.endswith(SQLITE_EXTENSIONS):
+        builder.save_file(args.tree)  # New database that the batches are written into
+    
+    started = datetime.now()
+    added, skipped = builder.ingest_csv(args.people, args.relationships, args.batch_size)
+    if not args.tree.endswith(SQLITE_EXTENSIONS):
+        builder.save_file(args.tree)
+    seconds = (datetime.now() - started).total_seconds()
+    
+    for path, line, message in skipped[:10]:
+        print(f"❌ {path}:{line}: {message}")
+    if len(skipped) > 10:
+        print(f"❌ ... and {len(skipped) - 10} more rows skipped")
+    print(f"✅ Added {added['people']:,} people and {added['relationships']:,} relationships to {args.tree} "
+          f"in {seconds:.1f}s ({len(skipped):,} rows skipped)")
+    return 1 if skipped else 0
+
+
+def export_command(args):
+    builder = FamilyTreeBuilder()
+    builder.load_file(args.source, compact=True)
+    builder.save_file(args.dest)
+    print(f"✅ Exported {len(builder.tree['people']):,} people to {args.dest}")
+    return 0
+
+
+def merge_command(args):
+    base, other = FamilyTreeBuilder(), FamilyTreeBuilder()
+    base.load_file(args.base)
+    other.load_file(args.other)
+    
+    started = datetime.now()
+    merged, report = merge_trees(base.tree, other.tree, args.workers, args.threshold, args.review)
+    seconds = (datetime.now() - started).total_seconds()
+    report = dict(report, base=args.base, other=args.other, seconds=round(seconds, 3))
+    
+    result = FamilyTreeBuilder()
+    result.tree = merged
+    result.save_file(args.out)
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    
+    counts = report["people"]
+    print(f"🔎 Compared {report['comparisons']:,} candidate pairs in {report['blocks']:,} blocks "
+          f"on {report['workers']} worker(s) in {seconds:.1f}s")
+    if report["oversizedBlocks"]:
+        print(f"⚠️  Skipped {report['oversizedBlocks']:,} blocks too large to compare pair by pair")
+    for entry in report["merged"][:args.show]:
+        print(f"  🔗 {entry['other']['name']} ({entry['other']['id']}) = {entry['base']['name']} ({entry['base']['id']})"
+              f"  score {entry['score']:.2f}")
+    for entry in report["review"][:args.show]:
+        print(f"  ❓ {entry['other']['name']} ({entry['other']['id']}) ~ {entry['base']['name']} ({entry['base']['id']})"
+              f"  score {entry['score']:.2f}")
+    errors = errors_only(report["issues"])
+    print(f"✅ Merged {counts['merged']:,} people, added {counts['added']:,} people and "
+          f"{report['relationshipsAdded']:,} relationships: {counts['total']:,} people in {args.out}")
+    print(f"📝 {len(report['merged']):,} merges and {len(report['review']):,} pairs to review in {args.report}")
+    if errors:
+        print(f"❌ The merged tree has {len(errors)} validation errors, e.g. {errors[0]['message']}")
+        return 1
+    return 0
+
+
+def stats_command(args):
+    builder = FamilyTreeBuilder()
+    builder.load_file(args.source, compact=True)
+    stats = builder.stats()
+    report = tree_stats(builder.tree) if HAVE_NUMPY else None
+    if args.json:
+        print(json.dumps(dict(stats, analytics=report), indent=2))
+        return 0
+    print(f"🌳 {builder.tree['meta'].get('title') or args.source}")
+    print(f"👥 People: {stats['people']:,}  ({', '.join(f'{g}: {n:,}' for g, n in sorted(stats['genders'].items()))})")
+    print(f"👪 Parent-child: {stats['parentChild']:,}  |  💑 Spouses: {stats['spouse']:,}")
+    print(f"🧬 Generations: {stats['generations']}  |  People without parents: {stats['withoutParents']:,}")
+    if stats['earliestBirth'] is not None:
+        print(f"📅 Births: {stats['earliestBirth']}–{stats['latestBirth']}")
+    print(f"🩺 Validation: {stats['errors']} errors, {stats['warnings']} warnings")
+    if report is None:
+        print("\n📊 Install numpy for generation, lifespan, marriage-age, branch and coverage statistics")
+        return 0
+    
+    def describe(summary, unit="years"):
+        if not summary['known']:
+            return "no data"
+        return (f"mean {summary['mean']:g}, median {summary['median']:g}, {summary['min']}–{summary['max']} {unit} "
+                f"({summary['known']:,} known)")
+    
+    print(f"\n📊 People per generation: {', '.join(f'{n:,}' for n in report['generations']['people'])}"
+          + (f"  ({report['generations']['inCycles']:,} in cycles)" if report['generations']['inCycles'] else ""))
+    print(f"⏳ Lifespan: {describe(report['lifespans'])}")
+    for gender, summary in sorted(report['lifespans']['byGender'].items()):
+        if summary['known']:
+            print(f"   {gender}: {describe(summary)}")
+    print(f"💍 Age at marriage: {describe(report['marriageAge'])}")
+    for gender, summary in sorted(report['marriageAge']['byGender'].items()):
+        if summary['known']:
+            print(f"   {gender}: {describe(summary)}")
+    branches = report['branches']
+    print(f"🌿 Branches: {branches['count']:,} ({branches['singletons']:,} with one person)")
+    for branch in branches['largest']:
+        if branch['people'] > 1:
+            print(f"   {branch['name']} ({branch['id']}): {branch['people']:,} people, down to generation "
+                  f"{branch['deepestGeneration']}")
+    print("🧾 Coverage: " + ", ".join(f"{field} {share:.0%}" for field, share in report['coverage'].items()
+                                     if share is not None))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build family trees interactively, or in bulk with a subcommand")
+    commands = parser.add_subparsers(dest="command")
+    
+    ingest = commands.add_parser("ingest", help="Add people and relationships from CSV files")
+    ingest.add_argument("people", help="CSV with name and optional id, gender, aliases, birthYear, deathYear, notes")
+    ingest.add_argument("relationships", nargs="?",
+                        help="CSV with type, person1, person2 and optional biological, startYear, endYear, notes")
+    ingest.add_argument("--tree", default="family_tree.json",
+                        help="Tree to add to, created if missing (.json or .db, default: family_tree.json)")
+    ingest.add_argument("--batch-size", type=int, default=10000,
+                        help="Rows per batch; each batch is one database transaction (default: 10000)")
+    ingest.set_defaults(handler=ingest_command)
+    
+    export = commands.add_parser("export", help="Convert a tree between .json, .db and .ged")
+    export.add_argument("source")
+    export.add_argument("dest")
+    export.set_defaults(handler=export_command)
+    
+    merge = commands.add_parser("merge", help="Merge two trees, matching up people who appear in both")
+    merge.add_argument("base", help="Tree whose ids and details take precedence")
+    merge.add_argument("other", help="Tree to merge into it")
+    merge.add_argument("--out", default="merged.json", help="Merged tree (.json, .db or .ged, default: merged.json)")
+    merge.add_argument("--report", default="merge-report.json", help="Match report (default: merge-report.json)")
+    merge.add_argument("--threshold", type=float, default=MERGE_THRESHOLD,
+                       help=f"Score needed to merge two people (default: {MERGE_THRESHOLD})")
+    merge.add_argument("--review", type=float, default=REVIEW_THRESHOLD,
+                       help=f"Score needed to list a pair for review (default: {REVIEW_THRESHOLD})")
+    merge.add_argument("--workers", type=int, default=None,
+                       help="Processes for scoring large blocks (default: one per CPU)")
+    merge.add_argument("--show", type=int, default=10, help="Matches to print (default: 10)")
+    merge.set_defaults(handler=merge_command)
+    
+    stats = commands.add_parser("stats", help="Summarize a tree, with distributions and coverage when numpy is installed")
+    stats.add_argument("source", nargs="?", default="family1.json")
+    stats.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+    stats.set_defaults(handler=stats_command)
+    
+    args = parser.parse_args()
+    if args.command is None:
+        interactive()
+        return
+    try:
+        raise SystemExit(args.handler(args))
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Family Graph
+Adjacency indexes over a family tree's people and relationships
+"""
+
+from collections import deque
+
+
+class FamilyGraph:
+    def __init__(self):
+        self.people = {}     # personId -> person
+        self.parents = {}    # childId -> {parentId: relationship}
+        self.children = {}   # parentId -> {childId: relationship}
+        self.spouses = {}    # personId -> {spouseId: relationship}
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Build a graph from a tree document in a single pass"""
+        graph = cls()
+        for person in tree.get("people", []):
+            graph.add_person(person)
+        for rel in tree.get("relationships", []):
+            graph.add_relationship(rel)
+        return graph
+
+    def _ensure(self, person_id):
+        """Make sure a person has (possibly empty) adjacency entries"""
+        if person_id not in self.parents:
+            self.parents[person_id] = {}
+            self.children[person_id] = {}
+            self.spouses[person_id] = {}
+
+    def add_person(self, person):
+        """Index a person dict by its id"""
+        self.people[person["id"]] = person
+        self._ensure(person["id"])
+
+    def remove_person(self, person_id):
+        """Drop a person and every edge touching them, returning the removed relationships"""
+        self.people.pop(person_id, None)
+        removed = []
+        for parent_id, rel in self.parents.pop(person_id, {}).items():
+            self.children.get(parent_id, {}).pop(person_id, None)
+            removed.append(rel)
+        for child_id, rel in self.children.pop(person_id, {}).items():
+            self.parents.get(child_id, {}).pop(person_id, None)
+            removed.append(rel)
+        for spouse_id, rel in self.spouses.pop(person_id, {}).items():
+            self.spouses.get(spouse_id, {}).pop(person_id, None)
+            removed.append(rel)
+        return removed
+
+    def add_relationship(self, rel):
+        """Index a spouse or parentChild relationship"""
+        if rel.get("type") == "parentChild":
+            parent_id, child_id = rel["parentId"], rel["childId"]
+            self._ensure(parent_id)
+            self._ensure(child_id)
+            self.children[parent_id][child_id] = rel
+            self.parents[child_id][parent_id] = rel
+        elif rel.get("type") == "spouse":
+            p1, p2 = rel["people"][0], rel["people"][1]
+            self._ensure(p1)
+            self._ensure(p2)
+            self.spouses[p1][p2] = rel
+            self.spouses[p2][p1] = rel
+
+    def remove_relationship(self, rel):
+        """Remove a relationship's edge from the indexes"""
+        if rel.get("type") == "parentChild":
+            self.children.get(rel["parentId"], {}).pop(rel["childId"], None)
+            self.parents.get(rel["childId"], {}).pop(rel["parentId"], None)
+        elif rel.get("type") == "spouse":
+            p1, p2 = rel["people"][0], rel["people"][1]
+            self.spouses.get(p1, {}).pop(p2, None)
+            self.spouses.get(p2, {}).pop(p1, None)
+
+    def get_parents(self, person_id):
+        """Ids of a person's parents"""
+        return list(self.parents.get(person_id, ()))
+
+    def get_children(self, person_id):
+        """Ids of a person's children"""
+        return list(self.children.get(person_id, ()))
+
+    def get_spouses(self, person_id):
+        """Ids of a person's spouses"""
+        return list(self.spouses.get(person_id, ()))
+
+    def get_siblings(self, person_id):
+        """Ids of everyone sharing at least one parent with a person"""
+        siblings = {}
+        for parent_id in self.parents.get(person_id, ()):
+            for child_id in self.children.get(parent_id, ()):
+                if child_id != person_id:
+                    siblings[child_id] = True
+        return list(siblings)
+
+    def neighbors(self, person_id):
+        """Parents, children and spouses of a person"""
+        return {
+            "parents": self.get_parents(person_id),
+            "children": self.get_children(person_id),
+            "spouses": self.get_spouses(person_id)
+        }
+
+    def _walk(self, start_id, index, max_depth):
+        """Breadth-first walk along one index, yielding (personId, depth) once per person"""
+        seen = {start_id}
+        queue = deque([(start_id, 0)])
+        while queue:
+            person_id, depth = queue.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for next_id in index.get(person_id, ()):
+                if next_id not in seen:
+                    seen.add(next_id)
+                    yield next_id, depth + 1
+                    queue.append((next_id, depth + 1))
+
+    def ancestors(self, person_id, max_depth=None):
+        """Yield (ancestorId, generation) pairs, nearest generation first"""
+        return self._walk(person_id, self.parents, max_depth)
+
+    def descendants(self, person_id, max_depth=None):
+        """Yield (descendantId, generation) pairs, nearest generation first"""
+        return self._walk(person_id, self.children, max_depth)
+
+    def subtree(self, root_id, up=None, down=None, mode="extended"):
+        """Collect the people and relationships in a window around a person
+
+        Descendants mode walks down from the root only. Extended mode also climbs
+        `up` generations and walks down from every ancestor, picking up siblings,
+        aunts, uncles and cousins. `down` is measured from the root's generation.
+        Spouses of everyone in the window are included at their partner's level.
+        """
+        generations = {root_id: 0}
+        if mode == "extended":
+            for ancestor_id, generation in self.ancestors(root_id, up):
+                generations[ancestor_id] = -generation
+
+        queue = deque(generations.items())
+        while queue:
+            person_id, generation = queue.popleft()
+            if down is not None and generation >= down:
+                continue
+            for child_id in self.children.get(person_id, ()):
+                if child_id not in generations:
+                    generations[child_id] = generation + 1
+                    queue.append((child_id, generation + 1))
+
+        for person_id, generation in list(generations.items()):
+            for spouse_id in self.spouses.get(person_id, ()):
+                generations.setdefault(spouse_id, generation)
+
+        relationships = []
+        frontier = []
+        for person_id in generations:
+            complete = True
+            for child_id, rel in self.children.get(person_id, {}).items():
+                if child_id in generations:
+                    relationships.append(rel)
+                else:
+                    complete = False
+            for spouse_id, rel in self.spouses.get(person_id, {}).items():
+                if spouse_id not in generations:
+                    complete = False
+                elif rel["people"][0] == person_id:
+                    relationships.append(rel)
+            if any(p not in generations for p in self.parents.get(person_id, ())):
+                complete = False
+            if not complete:
+                frontier.append(person_id)
+
+        return {
+            "rootId": root_id,
+            "mode": mode,
+            "people": [self.people[pid] for pid in generations if pid in self.people],
+            "relationships": relationships,
+            "generations": generations,
+            "frontier": frontier
+        }
+
+    def generation_count(self):
+        """Generations in the longest parent/child line, by one pass of Kahn's algorithm over the edges"""
+        waiting = {person_id: len(parents) for person_id, parents in self.parents.items()}
+        queue = deque(person_id for person_id, count in waiting.items() if count == 0)
+        depth = dict.fromkeys(queue, 0)
+        while queue:
+            person_id = queue.popleft()
+            for child_id in self.children.get(person_id, ()):
+                depth[child_id] = max(depth.get(child_id, 0), depth[person_id] + 1)
+                waiting[child_id] -= 1
+                if waiting[child_id] == 0:
+                    queue.append(child_id)
+        return 1 + max(depth.values(), default=-1)
+
+    def parentless_count(self):
+        """People and ids on relationships with no parent"""
+        return sum(1 for parents in self.parents.values() if not parents)
+
+    def relationship_count(self):
+        """Number of distinct indexed edges"""
+        parent_child = sum(len(c) for c in self.children.values())
+        spouse = sum(len(s) for s in self.spouses.values()) // 2
+        return parent_child + spouse
@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+GEDCOM
+Streaming GEDCOM 5.5.1 import and export for the people/relationships schema
+
+Records are read one level-0 record at a time and turned into the same
+addPerson / addRelationship changes the server's /api/changes accepts, so an
+import into a SQLite database keeps only the current record, the current
+batch and a few sparse lookup tables in memory, whatever the file size.
+
+Mapping:
+  INDI            -> person; id from the xref (@I12@ -> I12) unless an _ID tag says otherwise
+  NAME            -> name ("Given /Surname/" -> "Given Surname"); further NAMEs and NICK -> aliases
+  SEX, BIRT/DEAT DATE, NOTE -> gender, birthYear/deathYear, notes; SEX M/F -> M/F, X -> Other,
+                     U -> none, other values as they are, and a _GENDER tag says otherwise
+  FAM HUSB + WIFE -> spouse relationship when the family has a MARR/DIV event or no children;
+                     MARR/DIV DATE -> startYear/endYear
+  FAM CHIL        -> parentChild from each partner; biological is false when the
+                     child's FAMC PEDI (or the CHIL's _FREL/_MREL) is not birth/natural
+
+Limitations: the pedigree of a child whose INDI comes after its FAM record is
+only seen through _FREL/_MREL, NOTE records referenced by pointer are skipped,
+and text is decoded as UTF-8 (ANSEL files should be converted first).
+"""
+
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+from storage import SQLITE_EXTENSIONS, SqliteStorage, write_json_atomic
+
+_LINE = re.compile(r'^\s*(\d+)\s+(?:(@[^@]+@)\s+)?(\S+)(?: (.*))?$')
+_YEAR = re.compile(r'\b(\d{3,4})\b')
+_XREF_SAFE = re.compile(r'^[A-Za-z0-9_]{1,20}$')
+MAX_LINE = 240  # GEDCOM allows 255 characters per line including level and tag
+BIRTH_PEDIGREES = ("birth", "natural", "")
+SEXES = {"M": "M", "MALE": "M", "F": "F", "FEMALE": "F", "X": "Other", "U": None, "UNKNOWN": None}
+MARRIAGE_EVENTS = ("MARR", "DIV", "ENGA", "MARB", "MARC", "MARL", "MARS", "ANUL", "DIVF")
+
+
+def parse_lines(lines):
+    """(level, xref, tag, value) for each non-blank line of an iterable of bytes or str"""
+    first = True
+    for raw in lines:
+        line = raw.decode('utf-8', 'replace') if isinstance(raw, bytes) else raw
+        if first:
+            line = line.lstrip('\ufeff')
+            first = False
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        match = _LINE.match(line)
+        if match is None:
+            raise ValueError(f"Malformed GEDCOM line: {line[:80]}")
+        level, xref, tag, value = match.groups()
+        yield int(level), xref, tag.upper(), value or ''
+
+
+def iter_records(lines):
+    """Level-0 records as nested {tag, xref, value, children} dicts, one at a time
+
+    CONC and CONT lines are folded into their parent's value.
+    """
+    record = None
+    stack = []
+    for level, xref, tag, value in parse_lines(lines):
+        if level == 0:
+            if record is not None:
+                yield record
+            record = {"tag": tag, "xref": xref, "value": value, "children": []}
+            stack = [record]
+            continue
+        if record is None:
+            raise ValueError("GEDCOM file must start with a level 0 record")
+        del stack[level:]
+        if not stack:
+            raise ValueError(f"GEDCOM level jumps to {level} under {record['tag']}")
+        parent = stack[-1]
+        if tag == "CONT":
+            parent["value"] += "\n" + value
+            continue
+        if tag == "CONC":
+            parent["value"] += value
+            continue
+        node = {"tag": tag, "xref": xref, "value": value, "children": []}
+        parent["children"].append(node)
+        stack.append(node)
+    if record is not None:
+        yield record
+
+
+def _first(node, tag):
+    for child in node["children"]:
+        if child["tag"] == tag:
+            return child
+    return None
+
+
+def _year(node, tag):
+    event = _first(node, tag)
+    date = _first(event, "DATE") if event else None
+    match = _YEAR.search(date["value"]) if date else None
+    return int(match.group(1)) if match else None
+
+
+def _notes(node):
+    """Inline notes joined together; pointers to NOTE records are skipped"""
+    texts = [child["value"] for child in node["children"]
+             if child["tag"] == "NOTE" and child["value"] and not child["value"].startswith("@")]
+    return "\n".join(texts) or None
+
+
+def _gender(record):
+    """The person's gender from _GENDER or SEX, or None when unknown"""
+    explicit = _first(record, "_GENDER")
+    if explicit and explicit["value"].strip():
+        return explicit["value"].strip()
+    sex = _first(record, "SEX")
+    value = sex["value"].strip() if sex else ""
+    gender = SEXES.get(value.upper(), value)
+    return gender or None
+
+
+def _name(value):
+    """'Given /Surname/ Jr.' -> 'Given Surname Jr.'"""
+    return " ".join(value.replace("/", " ").split())
+
+
+class GedcomReader:
+    """Turns a GEDCOM stream into addPerson / addRelationship changes
+
+    `progress`, if given, is called with a stats dict every `every` records
+    and once more at the end with stats["done"] set.
+    """
+
+    def __init__(self, lines, total_bytes=None, progress=None, every=10000):
+        self.lines = lines
+        self.total_bytes = total_bytes
+        self.progress = progress
+        self.every = every
+        self.ids = {}           # xref -> person id, only where an _ID tag overrides the xref
+        self.pedigrees = {}     # (family xref, child xref) -> PEDI, only for non-birth links
+        self.stats = {"records": 0, "people": 0, "relationships": 0, "bytes": 0,
+                      "totalBytes": total_bytes, "seconds": 0.0, "done": False}
+        self._started = None
+
+    def _counted(self):
+        """Pass lines through while counting their bytes"""
+        for line in self.lines:
+            self.stats["bytes"] += len(line)
+            yield line
+
+    def _person_id(self, xref):
+        if xref in self.ids:
+            return self.ids[xref]
+        return xref.strip("@") if xref else None
+
+    def changes(self):
+        """Yield changes in file order"""
+        self._started = time.perf_counter()
+        for record in iter_records(self._counted()):
+            self.stats["records"] += 1
+            if record["tag"] == "INDI" and record["xref"]:
+                yield {"op": "addPerson", "person": self._person(record)}
+                self.stats["people"] += 1
+            elif record["tag"] == "FAM":
+                for rel in self._family(record):
+                    yield {"op": "addRelationship", "relationship": rel}
+                    self.stats["relationships"] += 1
+            if self.progress and self.stats["records"] % self.every == 0:
+                self._report()
+        self.stats["done"] = True
+        self._report()
+
+    def _report(self):
+        stats = self.stats
+        stats["seconds"] = time.perf_counter() - self._started
+        elapsed = stats["seconds"] or 1e-9
+        stats["recordsPerSecond"] = round(stats["records"] / elapsed)
+        stats["bytesPerSecond"] = round(stats["bytes"] / elapsed)
+        if self.progress:
+            self.progress(dict(stats))
+
+    def _person(self, record):
+        explicit = _first(record, "_ID")
+        if explicit and explicit["value"]:
+            self.ids[record["xref"]] = explicit["value"]
+        names = [_name(child["value"]) for child in record["children"] if child["tag"] == "NAME"]
+        nicknames = [_name(nick["value"]) for child in record["children"] if child["tag"] == "NAME"
+                     for nick in child["children"] if nick["tag"] == "NICK"]
+        nicknames += [_name(child["value"]) for child in record["children"] if child["tag"] == "NICK"]
+        names = [name for name in names if name]
+        aliases = []
+        for alias in names[1:] + nicknames:
+            if alias and alias not in aliases and alias != names[0]:
+                aliases.append(alias)
+        gender = _gender(record)
+
+        for famc in record["children"]:
+            if famc["tag"] == "FAMC" and famc["value"]:
+                pedigree = _first(famc, "PEDI")
+                if pedigree and pedigree["value"].strip().lower() not in BIRTH_PEDIGREES:
+                    self.pedigrees[(famc["value"], record["xref"])] = pedigree["value"]
+
+        return {
+            "id": self._person_id(record["xref"]),
+            "name": names[0] if names else self._person_id(record["xref"]),
+            "gender": gender,
+            "aliases": aliases,
+            "birthYear": _year(record, "BIRT"),
+            "deathYear": _year(record, "DEAT"),
+            "notes": _notes(record)
+        }
+
+    def _family(self, record):
+        partners = [(child["tag"], child["value"]) for child in record["children"]
+                    if child["tag"] in ("HUSB", "WIFE") and child["value"]]
+        children = [child for child in record["children"] if child["tag"] == "CHIL" and child["value"]]
+        married = any(_first(record, tag) for tag in MARRIAGE_EVENTS)
+        if len(partners) == 2 and (married or not children):
+            yield {
+                "type": "spouse",
+                "people": [self._person_id(xref) for _, xref in partners],
+                "startYear": _year(record, "MARR"),
+                "endYear": _year(record, "DIV"),
+                "notes": _notes(record)
+            }
+        for child in children:
+            pedigree = self.pedigrees.pop((record["xref"], child["value"]), None)
+            for role, parent_xref in partners:
+                relation = _first(child, "_FREL" if role == "HUSB" else "_MREL")
+                if relation is not None:
+                    biological = relation["value"].strip().lower() in BIRTH_PEDIGREES
+                else:
+                    biological = pedigree is None
+                yield {
+                    "type": "parentChild",
+                    "parentId": self._person_id(parent_xref),
+                    "childId": self._person_id(child["value"]),
+                    "biological": biological,
+                    "notes": None
+                }
+
+
+def new_meta(title):
+    now = datetime.now().isoformat()
+    return {"title": title, "rootPersonId": None, "notes": "", "created": now, "modified": now}
+
+
+def read_gedcom(lines, title="Family Tree", **options):
+    """Build a whole tree document in memory; returns (tree, stats)"""
+    reader = GedcomReader(lines, **options)
+    tree = {"meta": new_meta(title), "people": [], "relationships": []}
+    for change in reader.changes():
+        if change["op"] == "addPerson":
+            tree["people"].append(change["person"])
+        else:
+            tree["relationships"].append(change["relationship"])
+    if tree["people"]:
+        tree["meta"]["rootPersonId"] = tree["people"][0]["id"]
+    return tree, reader.stats
+
+
+def import_into(storage, lines, title="Family Tree", batch_size=5000, **options):
+    """Stream a GEDCOM file into a storage backend, one transaction per batch
+
+    The backend is emptied first. Returns the reader's final stats.
+    """
+    storage.write_snapshot({"meta": new_meta(title), "people": [], "relationships": []})
+    reader = GedcomReader(lines, **options)
+    batch = []
+    root = None
+    for change in reader.changes():
+        if root is None and change["op"] == "addPerson":
+            root = change["person"]["id"]
+            batch.append({"op": "updateMeta", "fields": {"rootPersonId": root}})
+        batch.append(change)
+        if len(batch) >= batch_size:
+            storage.append_batch(batch)
+            batch = []
+    if batch:
+        storage.append_batch(batch)
+    return reader.stats
+
+
+def _xrefs(ids, prefix, taken):
+    """Cross-reference ids for records: the record's own id where GEDCOM allows it, else prefix + n"""
+    xrefs = {}
+    generated = 0
+    for record_id in ids:
+        if _XREF_SAFE.match(record_id) and record_id not in taken:
+            xref = record_id
+        else:
+            generated += 1
+            while f"{prefix}{generated}" in taken:
+                generated += 1
+            xref = f"{prefix}{generated}"
+        taken.add(xref)
+        xrefs[record_id] = f"@{xref}@"
+    return xrefs
+
+
+def _text(level, tag, text):
+    """A tag whose value may need CONT lines for newlines and CONC lines for length"""
+    lines = []
+    for i, part in enumerate(str(text).split("\n")):
+        chunks = [part[j:j + MAX_LINE] for j in range(0, len(part), MAX_LINE)] or [""]
+        for k, chunk in enumerate(chunks):
+            if i == 0 and k == 0:
+                lines.append(f"{level} {tag} {chunk}".rstrip())
+            else:
+                lines.append(f"{level + 1} {'CONC' if k else 'CONT'} {chunk}".rstrip())
+    return lines
+
+
+def _gedcom_name(name):
+    """'Given Surname' -> 'Given /Surname/'"""
+    words = (name or "").split()
+    if len(words) < 2:
+        return " ".join(words)
+    return f"{' '.join(words[:-1])} /{words[-1]}/"
+
+
+def _families(tree, person_xrefs):
+    """Group spouse and parent/child links into GEDCOM families
+
+    Returns {sorted partner ids: {"partners", "spouse", "children": {childId: {parentId: biological}}}}.
+    """
+    families = {}
+
+    def family(partners):
+        key = tuple(sorted(partners))
+        if key not in families:
+            families[key] = {"partners": list(partners), "spouse": None, "children": {}}
+        return families[key]
+
+    spouses = {}
+    for rel in tree["relationships"]:
+        if rel.get("type") == "spouse":
+            a, b = rel["people"]
+            if a in person_xrefs and b in person_xrefs:
+                entry = family((a, b))
+                if entry["spouse"] is None:
+                    entry["spouse"] = rel
+                spouses.setdefault(a, set()).add(b)
+                spouses.setdefault(b, set()).add(a)
+
+    parents = {}
+    for rel in tree["relationships"]:
+        if rel.get("type") == "parentChild" and rel["parentId"] in person_xrefs and rel["childId"] in person_xrefs:
+            parents.setdefault(rel["childId"], {}).setdefault(rel["parentId"], rel.get("biological") is not False)
+
+    for child_id, links in parents.items():
+        remaining = list(links)
+        while remaining:
+            parent_id = remaining.pop(0)
+            partner = next((p for p in remaining if p in spouses.get(parent_id, ())), None)
+            if partner is None and len(remaining) == 1 and len(links) == 2:
+                partner = remaining[0]  # the two parents of a child form a family even if unmarried
+            if partner is not None:
+                remaining.remove(partner)
+                group = (parent_id, partner)
+            else:
+                group = (parent_id,)
+            family(group)["children"][child_id] = {p: links[p] for p in group}
+    return families
+
+
+def iter_gedcom(tree, source="FamilyTree"):
+    """GEDCOM 5.5.1 lines for a tree document, produced record by record"""
+    meta = tree.get("meta", {})
+    yield "0 HEAD"
+    yield f"1 SOUR {source}"
+    yield "1 GEDC"
+    yield "2 VERS 5.5.1"
+    yield "2 FORM LINEAGE-LINKED"
+    yield "1 CHAR UTF-8"
+    yield f"1 DATE {datetime.now().strftime('%d %b %Y').upper()}"
+    if meta.get("notes"):
+        yield from _text(1, "NOTE", meta["notes"])
+
+    people = tree["people"]
+    root_id = meta.get("rootPersonId")
+    # The root person goes first so importers pick it as the root again
+    people = sorted(people, key=lambda p: p["id"] != root_id)
+    taken = set()
+    person_xrefs = _xrefs((p["id"] for p in people), "I", taken)
+    families = _families(tree, person_xrefs)
+    family_xrefs = _xrefs((f"F{i}" for i in range(1, len(families) + 1)), "F", taken)
+    for i, entry in enumerate(families.values(), 1):
+        entry["xref"] = family_xrefs[f"F{i}"]
+    own_families, child_families = {}, {}
+    for entry in families.values():
+        for partner in entry["partners"]:
+            own_families.setdefault(partner, []).append(entry)
+        for child_id, links in entry["children"].items():
+            child_families.setdefault(child_id, []).append((entry, links))
+
+    for person in people:
+        xref = person_xrefs[person["id"]]
+        yield f"0 {xref} INDI"
+        if xref.strip("@") != person["id"]:
+            yield f"1 _ID {person['id']}"
+        yield f"1 NAME {_gedcom_name(person.get('name'))}".rstrip()
+        for alias in person.get("aliases") or []:
+            yield f"1 NAME {alias}"
+        gender = person.get("gender")
+        if gender in ("M", "F"):
+            yield f"1 SEX {gender}"
+        elif gender:
+            # GEDCOM 5.5.1 only knows M, F and U; keep the tree's own value next to it
+            yield "1 SEX U"
+            yield f"1 _GENDER {gender}"
+        for tag, key in (("BIRT", "birthYear"), ("DEAT", "deathYear")):
+            if person.get(key) is not None:
+                yield f"1 {tag}"
+                yield f"2 DATE {person[key]}"
+        if person.get("notes"):
+            yield from _text(1, "NOTE", person["notes"])
+        for entry in own_families.get(person["id"], ()):
+            yield f"1 FAMS {entry['xref']}"
+        for entry, links in child_families.get(person["id"], ()):
+            yield f"1 FAMC {entry['xref']}"
+            yield f"2 PEDI {'birth' if all(links.values()) else 'adopted'}"
+
+    genders = {p["id"]: p.get("gender") for p in people}
+    for entry in families.values():
+        yield f"0 {entry['xref']} FAM"
+        # Women go in WIFE; a same-sex couple fills HUSB then WIFE in order
+        partners = sorted(entry["partners"], key=lambda p: genders.get(p) == "F")
+        if len(partners) == 2:
+            roles = dict(zip(partners, ("HUSB", "WIFE")))
+        else:
+            roles = {partners[0]: "WIFE" if genders.get(partners[0]) == "F" else "HUSB"}
+        for partner in partners:
+            yield f"1 {roles[partner]} {person_xrefs[partner]}"
+        spouse = entry["spouse"]
+        if spouse is not None:
+            if spouse.get("startYear") is not None:
+                yield "1 MARR"
+                yield f"2 DATE {spouse['startYear']}"
+            else:
+                yield "1 MARR Y"
+            if spouse.get("endYear") is not None:
+                yield "1 DIV"
+                yield f"2 DATE {spouse['endYear']}"
+            if spouse.get("notes"):
+                yield from _text(1, "NOTE", spouse["notes"])
+        for child_id, links in entry["children"].items():
+            yield f"1 CHIL {person_xrefs[child_id]}"
+            if not all(links.values()):
+                for parent_id, biological in links.items():
+                    tag = "_MREL" if roles[parent_id] == "WIFE" else "_FREL"
+                    yield f"2 {tag} {'Natural' if biological else 'Adopted'}"
+    yield "0 TRLR"
+
+
+def write_gedcom(tree, out, progress=None, every=10000):
+    """Write a tree to a text file object line by line; returns the number of lines"""
+    started = time.perf_counter()
+    count = 0
+    for count, line in enumerate(iter_gedcom(tree), 1):
+        out.write(line + "\n")
+        if progress and count % every == 0:
+            progress({"lines": count, "seconds": time.perf_counter() - started, "done": False})
+    if progress:
+        progress({"lines": count, "seconds": time.perf_counter() - started, "done": True})
+    return count
+
+
+def print_progress(stats):
+    """Progress line for terminals, rewritten in place"""
+    if "records" in stats:
+        text = f"{stats['records']:,} records, {stats['people']:,} people, {stats['relationships']:,} relationships"
+        if stats.get("totalBytes"):
+            text = f"{100 * stats['bytes'] / stats['totalBytes']:.0f}%  " + text
+        text += f"  ({stats.get('recordsPerSecond', 0):,} records/s, {stats.get('bytesPerSecond', 0) / 1e6:.1f} MB/s)"
+    else:
+        text = f"{stats['lines']:,} lines written"
+    print(f"\r⏳ {text}", end="\n" if stats["done"] else "", flush=True)
+
+
+def main():
+    """Convert between GEDCOM and this project's formats, e.g. tree.ged -> family.db"""
+    if len(sys.argv) != 3 or not (sys.argv[1].lower().endswith(".ged") or sys.argv[2].lower().endswith(".ged")):
+        print("Usage: python3 gedcom.py SOURCE.ged DEST(.json|.db)  or  python3 gedcom.py SOURCE(.json|.db) DEST.ged")
+        sys.exit(1)
+    source, dest = sys.argv[1], sys.argv[2]
+    if source.lower().endswith(".ged"):
+        title = os.path.splitext(os.path.basename(source))[0]
+        with open(source, "rb") as f:
+            options = {"total_bytes": os.path.getsize(source), "progress": print_progress}
+            if dest.endswith(SQLITE_EXTENSIONS):
+                storage = SqliteStorage(dest)
+                stats = import_into(storage, f, title, **options)
+                storage.close()
+            else:
+                tree, stats = read_gedcom(f, title, **options)
+                write_json_atomic(dest, tree)
+        print(f"✅ Imported {stats['people']:,} people and {stats['relationships']:,} relationships "
+              f"into {dest} in {stats['seconds']:.1f}s")
+    else:
+        if source.endswith(SQLITE_EXTENSIONS):
+            tree, _ = SqliteStorage(source).read()
+        else:
+            with open(source, "r", encoding="utf-8") as f:
+                tree = json.load(f)
+        with open(dest, "w", encoding="utf-8") as f:
+            lines = write_gedcom(tree, f, progress=print_progress)
+        print(f"✅ Wrote {len(tree['people']):,} people as {lines:,} GEDCOM lines to {dest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Snapshot History
+Every saved version of a tree, kept as content-addressed chunks in a SQLite
+file next to it, so versions share whatever records they have in common
+
+Each person and relationship record is stored once, as written, under the
+SHA-256 of its canonical JSON, so a loaded version keeps its field order. A version's people and relationships lists are each a
+prolly tree over those hashes: leaves hold runs of record hashes and inner
+nodes hold runs of child hashes, with a run ending after any hash whose first
+bits happen to be zero. Because boundaries depend only on content, an edit
+changes one leaf and its few ancestors, so a new version stores O(changes)
+objects and two versions are diffed by skipping every subtree they share.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime
+
+FANOUT = 32  # average hashes per node
+BATCH = 500  # hashes per IN (...) lookup
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    hash TEXT PRIMARY KEY,
+    body BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS versions (
+    version INTEGER PRIMARY KEY,
+    saved TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    people TEXT NOT NULL,
+    relationships TEXT NOT NULL,
+    people_count INTEGER NOT NULL,
+    relationship_count INTEGER NOT NULL
+);
+"""
+
+
+_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+_record_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+
+def encode(value):
+    """Canonical JSON bytes: equal values always hash the same"""
+    return _encoder.encode(value).encode('utf-8')
+
+
+def digest(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+def build_nodes(hashes):
+    """Root hash of the prolly tree over a list of hashes, and {hash: (level, items, body)} of its nodes"""
+    nodes = {}
+    level = 0
+    while True:
+        runs, run = [], []
+        for item in hashes:
+            run.append(item)
+            if int(item[:8], 16) % FANOUT == 0:
+                runs.append(run)
+                run = []
+        if run or not runs:
+            runs.append(run)
+        hashes = []
+        for items in runs:
+            body = encode({"level": level, "items": items})
+            node = digest(body)
+            nodes[node] = (level, items, body)
+            hashes.append(node)
+        if len(hashes) == 1:
+            return hashes[0], nodes
+        level += 1
+
+
+def record_key(kind, record):
+    """What identifies a record across versions: a person's id, or the ends of an edge"""
+    if kind == "people":
+        return str(record.get("id"))
+    if record.get("type") == "spouse":
+        return "spouse:" + "&".join(sorted(str(p) for p in record.get("people") or []))
+    return f"parentChild:{record.get('parentId')}>{record.get('childId')}"
+
+
+class Snapshot:
+    """A tree's records and nodes by hash, and the root of each list"""
+
+    def __init__(self):
+        self.records = {}  # canonical hash -> record JSON as written
+        self.nodes = {}  # hash -> (level, items, node JSON)
+        self.roots = {}  # "people"/"relationships" -> root hash
+        self.counts = {}  # "people"/"relationships" -> number of records
+
+
+class History:
+    """Versions of one tree, stored in <tree file>.history
+
+    The database is opened on first use, so a store that never saves creates no file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def chunk(self, tree):
+        """Hash a tree's records and build its nodes, ready for store(); touches no database
+
+        Done before taking any lock on a tree that is about to be saved, since
+        this is the part that grows with the size of the tree.
+        """
+        snapshot = Snapshot()
+        for kind in ("people", "relationships"):
+            hashes = []
+            for record in tree[kind]:
+                key = digest(encode(record))
+                if key not in snapshot.records:
+                    snapshot.records[key] = _record_encoder.encode(record).encode('utf-8')
+                hashes.append(key)
+            snapshot.roots[kind], nodes = build_nodes(hashes)
+            snapshot.nodes.update(nodes)
+            snapshot.counts[kind] = len(hashes)
+        return snapshot
+
+    def store(self, snapshot, meta):
+        """Store a chunked tree as the version in meta; returns how many new objects that took
+
+        Only chunks not already stored are written: the walk stops at the
+        first node of each subtree that an earlier version also has.
+        """
+        with self._lock, self.conn:
+            before = self.conn.total_changes
+            frontier = set(snapshot.roots.values())
+            while frontier:
+                missing = frontier - self._existing(frontier)
+                frontier = set()
+                rows = []
+                for node in missing:
+                    level, items, body = snapshot.nodes[node]
+                    rows.append((node, body))
+                    if level:
+                        frontier.update(items)
+                    else:
+                        rows.extend((item, snapshot.records[item]) for item in items)
+                rows.sort()  # In key order the B-tree is appended to rather than split all over
+                self.conn.executemany("INSERT OR IGNORE INTO objects (hash, body) VALUES (?, ?)", rows)
+            added = self.conn.total_changes - before
+            self.conn.execute(
+                "INSERT OR REPLACE INTO versions (version, saved, meta, people, relationships, people_count, "
+                "relationship_count) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (meta.get("version", 0), datetime.now().isoformat(timespec='seconds'),
+                 json.dumps(meta, ensure_ascii=False), snapshot.roots["people"], snapshot.roots["relationships"],
+                 snapshot.counts["people"], snapshot.counts["relationships"]))
+        return added
+
+    def record(self, tree):
+        """chunk() and store() in one step"""
+        return self.store(self.chunk(tree), tree["meta"])
+
+    def same(self, version, snapshot):
+        """Whether a stored version holds exactly a chunked tree's records; None if it is not stored"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT people, relationships FROM versions WHERE version = ?", (version,)).fetchone()
+        if row is None:
+            return None
+        return row == (snapshot.roots["people"], snapshot.roots["relationships"])
+
+    def latest(self):
+        """The newest stored version, or None"""
+        with self._lock:
+            return self.conn.execute("SELECT MAX(version) FROM versions").fetchone()[0]
+
+    def _existing(self, hashes):
+        """The subset of hashes already stored"""
+        hashes = list(hashes)
+        found = set()
+        for start in range(0, len(hashes), BATCH):
+            batch = hashes[start:start + BATCH]
+            found.update(row[0] for row in self.conn.execute(
+                f"SELECT hash FROM objects WHERE hash IN ({','.join('?' * len(batch))})", batch))
+        return found
+
+    def _bodies(self, hashes, decode=True):
+        """{hash: decoded object} for stored hashes, or {hash: JSON bytes} without decode"""
+        hashes = list(hashes)
+        bodies = {}
+        for start in range(0, len(hashes), BATCH):
+            batch = hashes[start:start + BATCH]
+            bodies.update(self.conn.execute(
+                f"SELECT hash, body FROM objects WHERE hash IN ({','.join('?' * len(batch))})", batch))
+        if decode:
+            return {key: json.loads(body) for key, body in bodies.items()}
+        return bodies
+
+    def _version(self, version):
+        row = self.conn.execute(
+            "SELECT meta, people, relationships FROM versions WHERE version = ?", (version,)).fetchone()
+        if row is None:
+            raise KeyError(version)
+        return json.loads(row[0]), {"people": row[1], "relationships": row[2]}
+
+    def versions(self, limit=50, before=None):
+        """Stored versions, newest first, with the size of the history file's contents"""
+        with self._lock:
+            query = "SELECT version, saved, people_count, relationship_count FROM versions"
+            params = []
+            if before is not None:
+                query += " WHERE version < ?"
+                params.append(before)
+            rows = self.conn.execute(query + " ORDER BY version DESC LIMIT ?", params + [limit]).fetchall()
+            objects, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM objects").fetchone()
+        return {
+            "versions": [{"version": v, "saved": saved, "people": people, "relationships": rels}
+                         for v, saved, people, rels in rows],
+            "objects": objects,
+            "bytes": size
+        }
+
+    def load(self, version):
+        """The tree document saved as `version`; raises KeyError if it is not stored"""
+        with self._lock:
+            meta, roots = self._version(version)
+            tree = {"meta": meta}
+            for kind, root in roots.items():
+                hashes, level = [root], None
+                while level != 0:  # Nodes are never empty above the leaves
+                    bodies = self._bodies(set(hashes))
+                    level = bodies[hashes[0]]["level"]
+                    hashes = [item for node in hashes for item in bodies[node]["items"]]
+                records = self._bodies(set(hashes), decode=False)
+                # One parse of the whole list is much faster than one per record
+                tree[kind] = json.loads(b'[' + b','.join(records[key] for key in hashes) + b']')
+        return tree
+
+    def diff(self, a, b):
+        """What changed from version a to version b; raises KeyError if either is not stored
+
+        People and relationships are "added", "removed" or "changed" (same
+        id or edge, different record); meta lists the fields that differ.
+        """
+        with self._lock:
+            meta_a, roots_a = self._version(a)
+            meta_b, roots_b = self._version(b)
+            result = {"from": a, "to": b, "meta": {
+                key: {"from": meta_a.get(key), "to": meta_b.get(key)}
+                for key in sorted(meta_a.keys() | meta_b.keys())
+                if key != "version" and meta_a.get(key) != meta_b.get(key)}}
+            for kind in ("people", "relationships"):
+                removed, added = self._diff_lists(roots_a[kind], roots_b[kind])
+                by_key = {}  # key -> ([removed records], [added records]); duplicate edges share a key
+                for side, records in enumerate((removed, added)):
+                    for record in records:
+                        by_key.setdefault(record_key(kind, record), ([], []))[side].append(record)
+                result[kind] = {"added": [], "removed": [], "changed": []}
+                for key in sorted(by_key):
+                    old, new = by_key[key]
+                    for before, after in zip(old, new):
+                        result[kind]["changed"].append({"from": before, "to": after, "fields": sorted(
+                            field for field in before.keys() | after.keys() if before.get(field) != after.get(field))})
+                    result[kind]["removed"].extend(old[len(new):])
+                    result[kind]["added"].extend(new[len(old):])
+        return result
+
+    def _diff_lists(self, root_a, root_b):
+        """(records only in a, records only in b), opening only the nodes the two lists do not share
+
+        Both sides are expanded from the highest level down; after each step,
+        hashes on both sides cancel out, along with everything beneath them.
+        """
+        old, new = Counter([root_a]), Counter([root_b])
+        levels = {}  # hash -> node level, -1 for records
+        for key, body in self._bodies({root_a, root_b}).items():
+            levels[key] = body["level"]
+        while True:
+            common = old & new
+            old -= common
+            new -= common
+            pending = [key for key in old.keys() | new.keys() if levels[key] >= 0]
+            if not pending:
+                break
+            top = max(levels[key] for key in pending)
+            expand = [key for key in pending if levels[key] == top]
+            for key, body in self._bodies(expand).items():
+                for side in (old, new):
+                    count = side.pop(key, 0)
+                    for item in body["items"] if count else ():
+                        side[item] += count
+                        levels[item] = top - 1
+        bodies = self._bodies(old.keys() | new.keys())
+        return ([bodies[key] for key, count in old.items() for _ in range(count)],
+                [bodies[key] for key, count in new.items() for _ in range(count)])
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Kinship
+Answers "how is X related to Y" from precomputed generation depths and
+ancestor bitsets over the parent/child DAG
+"""
+
+from collections import deque
+
+from cache import LRUCache
+
+
+def ordinal(n):
+    """1 -> 1st, 2 -> 2nd, 11 -> 11th, 23 -> 23rd"""
+    if 10 <= n % 100 <= 20:
+        suffix = "th"
+    else:
+        suffix = {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return f"{n}{suffix}"
+
+
+def _gendered(gender, male, female, neutral):
+    if gender == "M":
+        return male
+    if gender == "F":
+        return female
+    return neutral
+
+
+def _greats(n, word):
+    """Prefix `word` with the right number of greats: 0 -> word, 1 -> great-word, 2 -> 2nd great-word"""
+    if n <= 0:
+        return word
+    if n == 1:
+        return f"great-{word}"
+    return f"{ordinal(n)} great-{word}"
+
+
+def _times(n):
+    return {1: "once", 2: "twice"}.get(n, f"{n} times")
+
+
+def describe(up, down, gender=None, half=False):
+    """How someone `up` generations below and `down` generations beside a common ancestor
+    is related to the other person, from the first person's side
+
+    `up` is the first person's distance to the common ancestor and `down`
+    the second person's; `gender` is the first person's.
+    """
+    if up == 0 and down == 0:
+        return "self"
+    if up == 0:
+        word = _gendered(gender, "father", "mother", "parent") if down == 1 else \
+            _gendered(gender, "grandfather", "grandmother", "grandparent")
+        return word if down <= 2 else _greats(down - 2, word)
+    if down == 0:
+        word = _gendered(gender, "son", "daughter", "child") if up == 1 else \
+            _gendered(gender, "grandson", "granddaughter", "grandchild")
+        return word if up <= 2 else _greats(up - 2, word)
+    if up == 1 and down == 1:
+        word = _gendered(gender, "brother", "sister", "sibling")
+        return f"half-{word}" if half else word
+    if up == 1:
+        return _greats(down - 2, _gendered(gender, "uncle", "aunt", "aunt/uncle"))
+    if down == 1:
+        return _greats(up - 2, _gendered(gender, "nephew", "niece", "niece/nephew"))
+    degree, removal = min(up, down) - 1, abs(up - down)
+    label = f"{ordinal(degree)} cousin"
+    if removal:
+        label += f" {_times(removal)} removed"
+    return f"half-{label}" if half else label
+
+
+class KinshipIndex:
+    def __init__(self, graph, cache_size=4096, bitset_cache_bytes=64 << 20):
+        self.graph = graph
+        self.order = {}       # personId -> topological index, ancestors before descendants
+        self.ids = []         # topological index -> personId
+        self.generation = {}  # personId -> generations below their furthest known ancestor
+        self._results = LRUCache(cache_size)
+        self._build()
+        # personId -> bitset of ancestor indexes, each up to V bits, as many as fit in bitset_cache_bytes
+        self._ancestors = LRUCache(max(64, bitset_cache_bytes // max(1, len(self.ids) // 8)))
+
+    def _build(self):
+        """Kahn's algorithm over parent -> child edges in one O(V+E) pass"""
+        parents, children = self.graph.parents, self.graph.children
+        indegree = {pid: len(ps) for pid, ps in parents.items()}
+        queue = deque(pid for pid, n in indegree.items() if n == 0)
+        for pid in queue:
+            self.generation[pid] = 0
+        while queue:
+            pid = queue.popleft()
+            self.order[pid] = len(self.ids)
+            self.ids.append(pid)
+            for child_id in children.get(pid, ()):
+                self.generation[child_id] = max(self.generation.get(child_id, 0), self.generation[pid] + 1)
+                indegree[child_id] -= 1
+                if indegree[child_id] == 0:
+                    queue.append(child_id)
+        # People caught in a parent/child cycle still get an index so lookups work
+        for pid in parents:
+            if pid not in self.order:
+                self.order[pid] = len(self.ids)
+                self.ids.append(pid)
+                self.generation.setdefault(pid, 0)
+
+    def ancestor_bits(self, person_id):
+        """Bitset with one bit per ancestor, computed on demand and cached
+
+        Walks the ancestors once, stopping at any whose bitset is already
+        cached. Only the asked-for person's bitset is cached, since each one
+        takes up to V bits and caching every ancestor's would grow as V^2.
+        """
+        cached = self._ancestors.get(person_id)
+        if cached is not None:
+            return cached
+        parents, order = self.graph.parents, self.order
+        bits = bytearray((len(self.ids) + 7) // 8)
+        extra = 0  # cached bitsets of ancestors met on the way, held here so eviction cannot lose them
+        seen = set()
+        stack = list(parents.get(person_id, ()))
+        while stack:
+            pid = stack.pop()
+            if pid in seen:
+                continue
+            seen.add(pid)
+            index = order[pid]
+            bits[index >> 3] |= 1 << (index & 7)
+            above = self._ancestors.get(pid)
+            if above is not None:
+                extra |= above
+            else:
+                stack.extend(parents.get(pid, ()))
+        result = int.from_bytes(bits, "little") | extra
+        self._ancestors.put(person_id, result)
+        return result
+
+    def lowest_common_ancestors(self, a, b):
+        """Common ancestors (counting a and b themselves) that have no common descendant in the set"""
+        common = (self.ancestor_bits(a) | (1 << self.order[a])) & (self.ancestor_bits(b) | (1 << self.order[b]))
+        lowest = []
+        while common:
+            top = common.bit_length() - 1
+            person_id = self.ids[top]
+            lowest.append(person_id)
+            common &= ~(self.ancestor_bits(person_id) | (1 << top))
+        return lowest
+
+    def _distances_up(self, start, targets):
+        """Fewest generations from start up to each target"""
+        found = {start: 0} if start in targets else {}
+        remaining = len(targets) - len(found)
+        seen = {start}
+        queue = deque([(start, 0)])
+        while queue and remaining:
+            pid, depth = queue.popleft()
+            for parent_id in self.graph.parents.get(pid, ()):
+                if parent_id in seen:
+                    continue
+                seen.add(parent_id)
+                if parent_id in targets:
+                    found[parent_id] = depth + 1
+                    remaining -= 1
+                queue.append((parent_id, depth + 1))
+        return found
+
+    def shortest_path(self, a, b):
+        """Fewest-hop chain of parent, child and spouse links from a to b, or None"""
+        if a == b:
+            return [{"id": a, "via": None}]
+        graph = self.graph
+        links = (("parent", graph.parents), ("child", graph.children), ("spouse", graph.spouses))
+        back = {a: None}
+        forward = {b: None}
+        frontier_a, frontier_b = [a], [b]
+        while frontier_a and frontier_b:
+            # Expand the smaller side first
+            swap = len(frontier_a) > len(frontier_b)
+            frontier, seen, other = (frontier_b, forward, back) if swap else (frontier_a, back, forward)
+            next_frontier = []
+            meet = None
+            for pid in frontier:
+                for via, index in links:
+                    for next_id in index.get(pid, ()):
+                        if next_id in seen:
+                            continue
+                        seen[next_id] = (pid, via)
+                        if next_id in other:
+                            meet = next_id
+                            break
+                        next_frontier.append(next_id)
+                    if meet:
+                        break
+                if meet:
+                    break
+            if meet:
+                return self._join(meet, back, forward)
+            if swap:
+                frontier_b = next_frontier
+            else:
+                frontier_a = next_frontier
+        return None
+
+    @staticmethod
+    def _join(meet, back, forward):
+        inverse = {"parent": "child", "child": "parent", "spouse": "spouse"}
+        left = []
+        pid = meet
+        while back[pid] is not None:
+            prev, via = back[pid]
+            left.append({"id": pid, "via": via})
+            pid = prev
+        left.append({"id": pid, "via": None})
+        left.reverse()
+        pid = meet
+        while forward[pid] is not None:
+            nxt, via = forward[pid]
+            left.append({"id": nxt, "via": inverse[via]})
+            pid = nxt
+        return left
+
+    def relate(self, a, b):
+        """Describe how a is related to b
+
+        Returns the lowest common ancestors (closest first), each side's
+        distance to the closest one, cousin degree and removal where those
+        apply, and the shortest chain of links between the two.
+        """
+        key = (a, b)
+        cached = self._results.get(key)
+        if cached is not None:
+            return cached
+
+        gender = self.graph.people.get(a, {}).get("gender")
+        lowest = self.lowest_common_ancestors(a, b)
+        result = {
+            "a": a,
+            "b": b,
+            "relationship": None,
+            "lowestCommonAncestors": [],
+            "generationsFromA": None,
+            "generationsFromB": None,
+            "cousinDegree": None,
+            "removal": None,
+            "half": False,
+            "path": self.shortest_path(a, b)
+        }
+
+        if lowest:
+            targets = set(lowest)
+            from_a = self._distances_up(a, targets)
+            from_b = self._distances_up(b, targets)
+            ranked = sorted(lowest, key=lambda pid: (from_a[pid] + from_b[pid], abs(from_a[pid] - from_b[pid])))
+            closest = ranked[0]
+            up, down = from_a[closest], from_b[closest]
+            # Half relations share one closest ancestor whose partner is not shared
+            nearest = [pid for pid in ranked if (from_a[pid], from_b[pid]) == (up, down)]
+            half = up > 0 and down > 0 and len(nearest) == 1 and bool(self.graph.spouses.get(closest))
+            result.update({
+                "relationship": describe(up, down, gender, half),
+                "lowestCommonAncestors": ranked,
+                "generationsFromA": up,
+                "generationsFromB": down,
+                "half": half
+            })
+            if up >= 2 and down >= 2:
+                result["cousinDegree"] = min(up, down) - 1
+                result["removal"] = abs(up - down)
+        elif b in self.graph.spouses.get(a, ()):
+            result["relationship"] = _gendered(gender, "husband", "wife", "spouse")
+        elif result["path"] is not None:
+            result["relationship"] = "related by marriage"
+        else:
+            result["relationship"] = "not related"
+
+        self._results.put(key, result)
+        return result
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Layout
+Server-side port of the front end's tree layout (buildTreeStructure and
+calculatePositions in tree-visualization.js), so clients can just draw coordinates
+
+The traversal order, and so every position, matches the browser's. The
+recursive walks run on an explicit stack, per-level membership checks use
+sets instead of scanning the level, and spouses come from the graph's index
+rather than a scan of every relationship, so a layout takes O(V + E).
+"""
+
+import gc
+
+from cache import LRUCache
+
+WIDTH = 1600
+HEIGHT = 1200
+HORIZONTAL_SPACING = 200
+VERTICAL_SPACING = 150
+LAYOUT_OPS = ("addPerson", "deletePerson", "addRelationship", "deleteRelationship")
+
+
+def _run(call):
+    """Drive a recursive generator without using the Python stack
+
+    A generator recurses by yielding another generator and receives its return value.
+    """
+    stack = [call]
+    value = None
+    while stack:
+        try:
+            call = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            value = stop.value
+            continue
+        stack.append(call)
+        value = None
+    return value
+
+
+class _Node:
+    __slots__ = ("id", "children", "spouses", "siblings", "parents")
+
+    def __init__(self, person_id):
+        self.id = person_id
+        self.children = []
+        self.spouses = []   # ids only: spouses are never expanded
+        self.siblings = []
+        self.parents = []
+
+
+def build_structure(graph, root_id, mode="extended", focus=None):
+    """The nested tree the browser's buildTreeStructure produces, or None if its root is unknown
+
+    Returns (root node, every id the walk looked at, present in the tree or not).
+    """
+    people, children, parents, spouses = graph.people, graph.children, graph.parents, graph.spouses
+    touched = set()
+
+    def add_spouses(node, visited):
+        for spouse_id in spouses.get(node.id, ()):
+            touched.add(spouse_id)
+            if spouse_id not in visited and spouse_id in people:
+                node.spouses.append(spouse_id)
+
+    def build_down(person_id, visited):
+        touched.add(person_id)
+        if person_id in visited or person_id not in people:
+            return None
+        visited.add(person_id)
+        node = _Node(person_id)
+        for child_id in children.get(person_id, ()):
+            child = yield build_down(child_id, visited)
+            if child:
+                node.children.append(child)
+        add_spouses(node, visited)
+        return node
+
+    def build_up(person_id, visited, exclude_child_id):
+        touched.add(person_id)
+        if person_id in visited or person_id not in people:
+            return None
+        visited.add(person_id)
+        node = _Node(person_id)
+        for parent_id in parents.get(person_id, ()):
+            parent = yield build_up(parent_id, visited, person_id)
+            if parent:
+                node.parents.append(parent)
+        siblings = {}
+        for parent_id in parents.get(person_id, ()):
+            for sibling_id in children.get(parent_id, ()):
+                if sibling_id != person_id and sibling_id != exclude_child_id and sibling_id not in visited:
+                    siblings[sibling_id] = None
+        for sibling_id in siblings:
+            sibling = yield build_down(sibling_id, visited)
+            if sibling:
+                node.siblings.append(sibling)
+        add_spouses(node, visited)
+        return node
+
+    def build_root():
+        start = focus if mode == "descendants" and focus else root_id
+        touched.add(start)
+        if start not in people:
+            return None
+        root = _Node(start)
+        visited_down = {start}
+        for child_id in children.get(start, ()):
+            child = yield build_down(child_id, visited_down)
+            if child:
+                root.children.append(child)
+        if start == focus and mode == "descendants":
+            add_spouses(root, visited_down)
+            return root
+
+        visited_up = {start}
+        for parent_id in parents.get(start, ()):
+            parent = yield build_up(parent_id, visited_up, start)
+            if parent:
+                root.parents.append(parent)
+        siblings = {}
+        for parent_id in parents.get(start, ()):
+            for sibling_id in children.get(parent_id, ()):
+                if sibling_id != start:
+                    siblings[sibling_id] = None
+        for sibling_id in siblings:
+            sibling = yield build_down(sibling_id, visited_down)
+            if sibling:
+                root.siblings.append(sibling)
+        touched.update(spouses.get(start, ()))
+        root.spouses = [spouse_id for spouse_id in spouses.get(start, ()) if spouse_id in people]
+        return root
+
+    root = _run(build_root())
+    return root, touched
+
+
+def compute_positions(graph, root, mode="extended", collapsed=frozenset()):
+    """Positions for a built structure, as the browser's calculatePositions would place them
+
+    Returns {personId: {"x", "y", "level", "generation", "hasChildren"}} in
+    the browser's key order; people reached at several levels keep the deepest.
+    hasChildren is what decides whether the browser draws a collapse button.
+    """
+    people, spouses = graph.people, graph.spouses
+    extended = mode == "extended"
+    visited = set()
+    generation_map = {}
+    levels = {}  # level -> {id: whether it was reached with children of its own}, in placement order
+
+    def place(person_id, level, generation, has_children=False):
+        placed = levels.setdefault(level, {})
+        if person_id in placed:
+            return False
+        placed[person_id] = has_children
+        generation_map[person_id] = generation
+        return True
+
+    def collect(node, level, generation):
+        if node is None or node.id in visited:
+            return
+        visited.add(node.id)
+        generation_map[node.id] = generation
+        place(node.id, level, generation, bool(node.children))
+        if node.id in collapsed:
+            return
+
+        if extended:
+            for spouse_id in node.spouses:
+                if spouse_id not in visited:
+                    place(spouse_id, level, generation)
+            for sibling in node.siblings:
+                if sibling.id in visited or not place(sibling.id, level, generation):
+                    continue
+                for spouse_id in spouses.get(sibling.id, ()):
+                    if spouse_id not in visited and spouse_id in people:
+                        place(spouse_id, level, generation)
+                if sibling.id not in collapsed:
+                    for child in sibling.children:
+                        yield collect(child, level + 1, generation + 1)
+
+        for child in node.children:
+            yield collect(child, level + 1, generation + 1)
+        for parent in node.parents:
+            yield collect(parent, level - 1, generation - 1)
+
+    _run(collect(root, 0, 0))
+
+    center_x, center_y = WIDTH / 2, HEIGHT / 2
+    positions = {}
+    for level in sorted(levels):
+        placed = levels[level]
+        start_x = center_x - max(0, (len(placed) - 1) * HORIZONTAL_SPACING) / 2
+        y = center_y + level * VERTICAL_SPACING
+        for index, (person_id, has_children) in enumerate(placed.items()):
+            positions[person_id] = {"x": start_x + index * HORIZONTAL_SPACING, "y": y, "level": level,
+                                    "generation": generation_map[person_id], "hasChildren": has_children}
+    return positions
+
+
+def affects_layout(change, touched):
+    """Whether an edit can move anything in a layout whose walk looked at the `touched` ids
+
+    An edit elsewhere cannot reach the layout: the walk only ever follows
+    edges out of people it looked at.
+    """
+    op = change.get("op")
+    if op not in LAYOUT_OPS:
+        return False  # Names, years and meta never move a node
+    if op == "addPerson":
+        return change["person"]["id"] in touched
+    if op == "deletePerson":
+        return change["id"] in touched
+    rel = change["relationship"]
+    if rel.get("type") == "spouse":
+        ids = rel.get("people") or []
+    else:
+        ids = [rel.get("parentId"), rel.get("childId")]
+    return any(person_id in touched for person_id in ids)
+
+
+class LayoutEngine:
+    """Layouts per view, cached by tree version
+
+    A structure (which depends on root, mode and focus) is shared by every
+    collapsed set. When the tree moves on, the change feed tells which edits
+    happened: layouts none of them touch are carried over to the new version,
+    and the rest are rebuilt the next time they are asked for.
+    """
+
+    def __init__(self, graph, feed, maxsize=256):
+        self.graph = graph
+        self.feed = feed
+        self.structures = LRUCache(maxsize=32)  # (root, mode, focus) -> [version, root node, touched]
+        self.layouts = LRUCache(maxsize=maxsize)  # (root, mode, focus, collapsed) -> [version, positions, touched]
+
+    def _current(self, cache, key, version):
+        """The cached entry for key, brought up to `version` if no edit since touched it"""
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] != version:
+            events = self.feed.events_since(entry[0], version)
+            if events is None or any(event["type"] != "change" or affects_layout(event["change"], entry[2])
+                                     for event in events):
+                return None
+            entry[0] = version
+        return entry
+
+    def layout(self, version, root_id, mode="extended", focus=None, collapsed=frozenset()):
+        """{"positions", "version", "cached"} for one view, or None if the root is unknown"""
+        collapsed = frozenset(collapsed)
+        key = (root_id, mode, focus, collapsed)
+        entry = self._current(self.layouts, key, version)
+        if entry is not None:
+            return {"version": version, "cached": True, "positions": entry[1]}
+
+        # A node per person would otherwise trigger the cycle collector over and over
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            structure_key = (root_id, mode, focus)
+            structure = self._current(self.structures, structure_key, version)
+            if structure is None:
+                root, touched = build_structure(self.graph, root_id, mode, focus)
+                if root is None:
+                    return None
+                structure = [version, root, touched]
+                self.structures.put(structure_key, structure)
+            positions = compute_positions(self.graph, structure[1], mode, collapsed)
+        finally:
+            if collecting:
+                gc.enable()
+        self.layouts.put(key, [version, positions, structure[2]])
+        return {"version": version, "cached": False, "positions": positions}
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Metrics
+Thread-safe request counters, latency histograms and phase timings rendered in Prometheus text format
+"""
+
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Cumulative-bucket histogram; callers serialize access"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        """(sample name, labels, value) rows for this histogram"""
+        running = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            running += count
+            yield name + '_bucket', dict(labels, le=str(bound)), running
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, self.count
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format(name, labels, value):
+    if labels:
+        name += '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return f"{name} {value}"
+
+
+class Metrics:
+    def __init__(self, prefix='familytree'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.latency = {}    # (route, method) -> Histogram
+        self.requests = {}   # (route, method, status) -> count
+        self.bytes_in = {}   # route -> request body bytes
+        self.bytes_out = {}  # route -> response bytes, headers included
+        self.phases = {}     # (operation, phase) -> Histogram
+
+    def observe_request(self, route, method, status, seconds, bytes_in=0, bytes_out=0):
+        with self._lock:
+            key = (route, method)
+            if key not in self.latency:
+                self.latency[key] = Histogram()
+            self.latency[key].observe(seconds)
+            key = (route, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.bytes_in[route] = self.bytes_in.get(route, 0) + bytes_in
+            self.bytes_out[route] = self.bytes_out.get(route, 0) + bytes_out
+
+    def observe_phases(self, operation, timings):
+        """Record seconds per phase of one operation, e.g. ("save", {"parse": 0.2, "write": 0.5})"""
+        with self._lock:
+            for phase, seconds in timings.items():
+                key = (operation, phase)
+                if key not in self.phases:
+                    self.phases[key] = Histogram()
+                self.phases[key].observe(seconds)
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of everything recorded plus the given gauges
+
+        gauges is an iterable of (name, help, labels, value); rows sharing a
+        name must be adjacent.
+        """
+        p = self.prefix
+        lines = []
+
+        def family(name, kind, help_text, rows):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(_format(*row) for row in rows)
+
+        with self._lock:
+            family(f"{p}_http_requests_total", "counter", "HTTP requests by route, method and status",
+                   [(f"{p}_http_requests_total", {"route": r, "method": m, "status": s}, n)
+                    for (r, m, s), n in sorted(self.requests.items())])
+            family(f"{p}_http_request_duration_seconds", "histogram", "Time from request line to last byte written",
+                   [row for (r, m), h in sorted(self.latency.items())
+                    for row in h.samples(f"{p}_http_request_duration_seconds", {"route": r, "method": m})])
+            family(f"{p}_http_request_bytes_total", "counter", "Request body bytes received",
+                   [(f"{p}_http_request_bytes_total", {"route": r}, n) for r, n in sorted(self.bytes_in.items())])
+            family(f"{p}_http_response_bytes_total", "counter", "Response bytes sent, headers included",
+                   [(f"{p}_http_response_bytes_total", {"route": r}, n) for r, n in sorted(self.bytes_out.items())])
+            family(f"{p}_phase_duration_seconds", "histogram", "Time spent in each phase of saves and imports",
+                   [row for (o, ph), h in sorted(self.phases.items())
+                    for row in h.samples(f"{p}_phase_duration_seconds", {"operation": o, "phase": ph})])
+
+        previous = None
+        for name, help_text, labels, value in gauges:
+            name = f"{p}_{name}"
+            if name != previous:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                previous = name
+            lines.append(_format(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+class CountingWriter:
+    """Wraps a handler's wfile and counts the bytes written through it"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.raw.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Search Index
+Prefix and trigram index over people's names, aliases and ids
+"""
+
+import bisect
+import heapq
+import re
+import unicodedata
+
+MAX_PREFIX = 12  # longer query tokens are looked up by their first MAX_PREFIX chars, then verified
+TOP_K = 100  # best matches kept for each common prefix; the most results a search can ask for
+COMMON = 128  # prefixes matching more people than this keep their top TOP_K ranked in advance
+
+# Rank buckets, best first
+EXACT, STARTS_WITH, TOKEN_PREFIX, SUBSTRING, FUZZY = range(5)
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """Case-fold, strip diacritics and collapse punctuation to single spaces"""
+    text = text or ''
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _NON_WORD.sub(' ', text.casefold()).strip()
+
+
+def trigrams(text):
+    """Character trigrams of a normalized string, padded so short words still get one"""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    def __init__(self):
+        self.people = {}     # personId -> person
+        self.terms = {}      # personId -> [(normalized term, is_alias)]
+        self.prefixes = {}   # token prefix -> {personId}
+        self.grams = {}      # trigram -> {personId}
+        self.tops = {}       # common prefix -> best TOP_K result rows as a one-word query, best first
+
+    @classmethod
+    def from_people(cls, people):
+        index = cls()
+        for person in people:
+            index.add(person)
+        return index
+
+    def _keys(self, person_id):
+        """Prefix and trigram keys for a person's indexed terms
+
+        Prefixes come as {prefix: what _rank gives when the prefix alone is
+        the query}, i.e. the best (bucket, is_alias, term) among the terms
+        with a word starting with it.
+        """
+        prefixes, grams = {}, set()
+        for term, is_alias in self.terms[person_id]:
+            for position, token in enumerate(term.split()):
+                for i in range(1, min(len(token), MAX_PREFIX) + 1):
+                    prefix = token[:i]
+                    if position:
+                        bucket = TOKEN_PREFIX  # Any better match comes from the first word too
+                    else:
+                        bucket = EXACT if term == prefix else STARTS_WITH
+                    key = (bucket, is_alias, term)
+                    current = prefixes.get(prefix)
+                    if current is None or key < current:
+                        prefixes[prefix] = key
+            grams |= trigrams(term)
+        return prefixes, grams
+
+    def add(self, person):
+        """Index a person, replacing any earlier entry for the same id"""
+        person_id = person["id"]
+        if person_id in self.terms:
+            self.remove(person_id)
+        terms = [(normalize(person.get("name")), False)]
+        terms += [(normalize(alias), True) for alias in person.get("aliases") or []]
+        terms.append((normalize(person_id), True))
+        self.people[person_id] = person
+        self.terms[person_id] = [(t, is_alias) for t, is_alias in terms if t]
+        prefixes, grams = self._keys(person_id)
+        for index, keys in ((self.prefixes, prefixes), (self.grams, grams)):
+            for key in keys:
+                ids = index.get(key)
+                if ids is None:
+                    index[key] = {person_id}
+                else:
+                    ids.add(person_id)
+
+        name_length = len(person.get("name") or '')
+        for prefix, rank in prefixes.items():
+            top = self.tops.get(prefix)
+            if top is not None:
+                row = (rank[0], rank[1], name_length, person_id, rank[2])
+                # After removals a short list is still the best so far, but it
+                # only takes rows past its end while it holds everyone
+                if len(top) == len(self.prefixes[prefix]) - 1 or (top and row < top[-1]):
+                    bisect.insort(top, row)
+                    del top[TOP_K:]
+            elif len(self.prefixes[prefix]) > COMMON:
+                self._rerank(prefix)  # Just became common: rank its few people once, then keep it up to date
+
+    def remove(self, person_id):
+        """Drop a person from the index"""
+        if person_id not in self.terms:
+            return
+        prefixes, grams = self._keys(person_id)
+        for index, keys in ((self.prefixes, prefixes), (self.grams, grams)):
+            for key in keys:
+                ids = index.get(key)
+                if ids is not None:
+                    ids.discard(person_id)
+                    if not ids:
+                        del index[key]
+        for prefix in prefixes:
+            top = self.tops.get(prefix)
+            if top is None:
+                continue
+            for i, row in enumerate(top):
+                if row[3] == person_id:
+                    del top[i]  # The rest are still the best, just fewer of them
+                    break
+            if prefix not in self.prefixes:
+                del self.tops[prefix]
+        del self.terms[person_id]
+        del self.people[person_id]
+
+    def _rerank(self, prefix):
+        """Rank every person with a prefix to fill its top list"""
+        rows = []
+        for person_id in self.prefixes[prefix]:
+            rank = self._rank(person_id, prefix, [prefix])
+            rows.append((rank[0], rank[1], len(self.people[person_id].get("name") or ''), person_id, rank[2]))
+        top = self.tops[prefix] = heapq.nsmallest(TOP_K, rows)
+        return top
+
+    def _top(self, prefix, limit):
+        """Best `limit` result rows for a common prefix searched for as one word, or None for other prefixes"""
+        top = self.tops.get(prefix)
+        if top is None:
+            return None
+        if len(top) < limit < len(self.prefixes[prefix]):
+            # Removals used up the list
+            top = self._rerank(prefix)
+        return top[:limit]
+
+    def _rank(self, person_id, query, tokens):
+        """Best (bucket, matched term) for a candidate, or None if it does not match"""
+        best = None
+        for term, is_alias in self.terms[person_id]:
+            if term == query:
+                bucket = EXACT
+            elif term.startswith(query):
+                bucket = STARTS_WITH
+            elif all(any(word.startswith(t) for word in term.split()) for t in tokens):
+                bucket = TOKEN_PREFIX
+            elif query in term:
+                bucket = SUBSTRING
+            else:
+                continue
+            key = (bucket, is_alias, term)
+            if best is None or key < best:
+                best = key
+        return best
+
+    def search(self, text, limit=10):
+        """Top `limit` people matching a query, best first
+
+        Every query word must prefix some word of a name, alias or id; failing
+        that, the whole query may appear anywhere inside one; failing that,
+        names sharing at least half of the query's trigrams are returned.
+        """
+        query = normalize(text)
+        if not query or limit <= 0:
+            return []
+        tokens = query.split()
+
+        if len(tokens) == 1 and len(query) <= MAX_PREFIX and limit <= TOP_K:
+            # A common one-word prefix already has its best matches ranked
+            top = self._top(query, limit)
+            if top is not None:
+                return self._results(top)
+
+        candidates = None
+        for token in sorted(tokens, key=len, reverse=True):
+            ids = self.prefixes.get(token[:MAX_PREFIX], set())
+            candidates = set(ids) if candidates is None else candidates & ids
+            if not candidates:
+                break
+
+        if not candidates or len(candidates) < limit:
+            gram_sets = sorted((self.grams.get(g, set()) for g in trigrams(query)), key=len)
+            if gram_sets and gram_sets[0]:
+                substring = set(gram_sets[0])
+                for ids in gram_sets[1:]:
+                    substring &= ids
+                    if not substring:
+                        break
+                candidates = (candidates or set()) | substring
+
+        scored = []
+        for person_id in candidates or ():
+            rank = self._rank(person_id, query, tokens)
+            if rank is not None:
+                scored.append((rank[0], rank[1], len(self.people[person_id].get("name") or ''), person_id, rank[2]))
+
+        if not scored:
+            scored = self._fuzzy(query)
+
+        return self._results(heapq.nsmallest(limit, scored))
+
+    def _results(self, rows):
+        return [{"person": self.people[row[3]], "matched": row[4], "rank": row[0]} for row in rows]
+
+    def _fuzzy(self, query):
+        """Candidates sharing at least half of the query's trigrams"""
+        query_grams = trigrams(query)
+        counts = {}
+        for gram in query_grams:
+            for person_id in self.grams.get(gram, ()):
+                counts[person_id] = counts.get(person_id, 0) + 1
+        needed = max(1, len(query_grams) // 2)
+        scored = []
+        for person_id, count in counts.items():
+            if count >= needed:
+                name = self.people[person_id].get("name") or ''
+                scored.append((FUZZY, -count, len(name), person_id, normalize(name)))
+        return scored
@@ -1,66 +1,1021 @@
+import argparse
+import cProfile
+import hashlib
 import http.server
+import pstats
+import queue
 import socketserver
 import json
 import os
+import re
+import sys
+import threading
+import time
+import zlib
+from urllib.parse import urlparse, parse_qs, quote, unquote
+
+from analytics import HAVE_NUMPY
+from gedcom import read_gedcom
+from metrics import CONTENT_TYPE, CountingWriter, Metrics
+from svg_render import THEMES, render_tile, write_svg
+from tree_pool import MAX_BYTES, MAX_IDLE, TreePool
+from tree_store import TreeStore, VersionConflict
+from validation import ValidationError, check_new_edge, errors_only, validate_tree
 
 PORT = 8000
-DATA_FILE = 'family1.json'
+DATA_FILE = 'family1.json'  # or a .db/.sqlite file for the SQLite backend
+TREE_URL = '/family1.json'  # where the front end fetches the tree from
+MAX_WORKERS = 32  # requests handled at once
+MAX_CONNECTIONS = 1024  # open connections, idle keep-alive ones included
+KEEP_ALIVE_TIMEOUT = 15  # seconds an idle keep-alive connection stays open
+SLOW_REQUEST_SECONDS = None  # log requests slower than this (--slow-ms)
+PROFILE_DIR = None  # where requests sent with "X-Profile: 1" leave their cProfile output (--profile-dir)
+EVENT_KEEPALIVE = 15  # seconds between comments on an idle /api/events stream
+MAX_IMPORT_BYTES = 256 * 1024 * 1024  # largest GEDCOM upload; the imported tree is held in memory (--max-import-mb)
+
+event_slots = threading.Semaphore(MAX_WORKERS // 2)  # open /api/events streams, each on its own thread; None to refuse them
+shutting_down = threading.Event()
+
+store = TreeStore(DATA_FILE)  # the tree served at the root, None when only /trees/<name>/ is hosted
+trees = None  # TreePool of the trees hosted under /trees/<name>/ (--trees)
+metrics = Metrics()
+
+NEIGHBORS_PATH = re.compile(r'^/api/node/([^/]+)/neighbors$')
+TREE_PATH = re.compile(r'^/trees/([^/?]+)(.*)$')
+TILE_PATH = re.compile(r'^/api/tiles/(\d+)/(\d+)/(\d+)\.svg$')
+VERSION_PATH = re.compile(r'^/api/history/(\d+)$')
+RESTORE_PATH = re.compile(r'^/api/history/(\d+)/restore$')
+ETAG = re.compile(r'^"[0-9a-f]{32}"$')  # the tree's ETag, as GET /family1.json sends it
+API_ROUTES = ('/api/subtree', '/api/search', '/api/kinship', '/api/layout', '/api/tiles', '/api/export.svg',
+              '/api/validate', '/api/changes', '/api/import/gedcom', '/api/events', '/api/history', '/api/diff',
+              '/api/stats', '/save')
+SERVER_ROUTES = ('/metrics', '/trees', '/trees/')  # not tied to any one tree
+# Files the server keeps next to a tree, never served as static files
+PRIVATE_SUFFIXES = ('.journal', '.bak', '.tmp', '.tiles', '.history', '.history-wal', '.history-shm',
+                    '.history-journal')
+
+def route_label(path):
+    """Metrics label for a request path; static files share one label to keep the series bounded"""
+    path = urlparse(path).path
+    if path in API_ROUTES or path in SERVER_ROUTES or path == TREE_URL:
+        return path
+    if NEIGHBORS_PATH.match(path):
+        return '/api/node/{id}/neighbors'
+    if TILE_PATH.match(path):
+        return '/api/tiles/{z}/{x}/{y}.svg'
+    if VERSION_PATH.match(path):
+        return '/api/history/{version}'
+    if RESTORE_PATH.match(path):
+        return '/api/history/{version}/restore'
+    return 'static'
+
+def is_private(path):
+    """Whether a static path names a hidden file or one of the server's own files"""
+    parts = [part for part in unquote(urlparse(path).path).split('/') if part]
+    return any(part.startswith('.') or part.endswith(PRIVATE_SUFFIXES) for part in parts)
+
+def parse_if_match(header):
+    """Tree version a write was based on, from an If-Match header; None for "*"
+
+    Accepts the bare version or a quoted (optionally weak) one, or the tree
+    ETags the header lists, returned as a list of quoted tags. Raises
+    ValueError otherwise.
+    """
+    value = header.strip()
+    if value == '*':
+        return None
+    tags = [tag.strip() for tag in value.split(',')]
+    tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+    if all(ETAG.match(tag) for tag in tags):
+        return tags
+    if len(tags) > 1:
+        raise ValueError(value)
+    return int(tags[0].strip('"'))
+
+def tree_gauges():
+    """Size and storage gauges of every loaded tree, plus the tree cache, for /metrics"""
+    stores = ([('default', store)] if store is not None else []) + (trees.loaded() if trees is not None else [])
+    rows = {}
+    for name, tree_store in stores:
+        labels = {'tree': name}
+        with tree_store.lock.reading():
+            tree, graph = tree_store.tree, tree_store.graph
+            if tree is None:
+                continue
+            rows.setdefault('people', []).append(('People in the tree', labels, len(graph.people)))
+            rows.setdefault('relationships', []).append(
+                ('Relationships in the tree', labels, len(tree['relationships'])))
+        rows.setdefault('tree_revision', []).append(
+            ('In-memory changes since the tree was loaded', labels, tree_store.revision))
+        rows.setdefault('journal_pending_changes', []).append(
+            ('Edits not yet folded into the snapshot', labels, tree_store.storage.pending))
+        rows.setdefault('tree_memory_bytes', []).append(
+            ('Estimated memory held by the tree and its indexes', labels, tree_store.footprint()))
+        for label, path in (('data', tree_store.path), ('journal', getattr(tree_store.storage, 'journal_path', None))):
+            if path and os.path.exists(path):
+                rows.setdefault('file_bytes', []).append(
+                    ('Size of the stored tree files', dict(labels, file=label), os.path.getsize(path)))
+    if trees is not None:
+        rows['loaded_trees'] = [('Trees held in the tree cache', {}, len(trees.loaded()))]
+        rows['trees_evicted'] = [('Trees unloaded from the tree cache since startup', {}, trees.evictions)]
+    return [(name, help_text, labels, value) for name, values in rows.items() for help_text, labels, value in values]
+
+def parse_view(query):
+    """(root, mode, focus, collapsed) of a layout view from query parameters; raises ValueError"""
+    mode = query.get('mode', ['extended'])[0]
+    if mode not in ('extended', 'descendants'):
+        raise ValueError("mode must be extended or descendants")
+    collapsed = [c for c in query.get('collapsed', [''])[0].split(',') if c]
+    return query.get('root', [None])[0], mode, query.get('focus', [None])[0], collapsed
+
+def parse_theme(query):
+    theme = query.get('theme', ['light'])[0]
+    if theme not in THEMES:
+        raise ValueError(f"theme must be one of {', '.join(THEMES)}")
+    return theme
+
+def accepted_encodings(header):
+    """Content codings a client accepts, from an Accept-Encoding header"""
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip().lower())
+    return accepted
 
 class FamilyTreeHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive for static assets and API calls alike
+    timeout = KEEP_ALIVE_TIMEOUT
+    # Headers and body go out in separate writes; with Nagle the body waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+
+    def handle_one_request(self):
+        self.started = None
+        self.profiler = None
+        self.tree_name = None
+        self.worker = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.worker is not None:
+                self.worker.release()
+            if self.profiler is not None:
+                self.profiler.disable()
+            if self.tree_name is not None:
+                trees.release(self.tree_name)
+        if self.started is not None:
+            self.record_request()
+
+    def parse_request(self):
+        # Timing starts once the request line is in, so keep-alive idle time is not counted
+        self.started = time.perf_counter()
+        # A worker is only taken once there is a request to handle, and waiting for one counts
+        self.worker = getattr(self.server, 'workers', None)
+        if self.worker is not None:
+            self.worker.acquire()
+        self.status_code = None
+        self.timings = None
+        self.bytes_before = self.wfile.bytes
+        if not super().parse_request():
+            return False
+        self.original_path = self.path
+        if not self.select_tree():
+            self.close_connection = True  # Any request body was left unread
+            return False
+        if PROFILE_DIR and self.headers.get('X-Profile') == '1':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return True
+
+    def select_tree(self):
+        """Point self.store at the tree a request is for, stripping any /trees/<name> prefix
+
+        Holds a lease on a hosted tree until the request is done. Returns False
+        once an error or redirect has been sent instead.
+        """
+        self.store = store
+        match = TREE_PATH.match(self.path) if trees is not None else None
+        if match:
+            name, rest = unquote(match.group(1)), match.group(2)
+            if not rest.startswith('/'):
+                # Relative URLs in the front end need the trailing slash
+                self.send_response(301)
+                self.send_header('Location', f"/trees/{match.group(1)}/{rest}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return False
+            create = self.command == 'POST' and urlparse(rest).path in ('/save', '/api/import/gedcom')
+            try:
+                self.store = trees.acquire(name, create)
+            except KeyError:
+                self.send_json_error(404, f"Tree not found: {name}")
+                return False
+            self.tree_name = name
+            self.path = rest
+        elif self.store is None and route_label(self.path) not in SERVER_ROUTES + ('static',):
+            self.send_json_error(404, "No tree is served here; use /trees/<name>/")
+            return False
+        return True
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+
+    def record_request(self):
+        """Add the finished request to the metrics, the slow-request log and its profile"""
+        seconds = time.perf_counter() - self.started
+        path = getattr(self, 'original_path', getattr(self, 'path', ''))
+        route = route_label(getattr(self, 'path', ''))
+        if self.tree_name is not None and route != 'static':
+            route = '/trees/{name}' + route
+        method = self.command or '-'
+        headers = getattr(self, 'headers', None)
+        try:
+            bytes_in = int(headers.get('Content-Length') or 0) if headers else 0
+        except ValueError:
+            bytes_in = 0
+        bytes_out = self.wfile.bytes - self.bytes_before
+        metrics.observe_request(route, method, self.status_code or 0, seconds, bytes_in, bytes_out)
+
+        if SLOW_REQUEST_SECONDS is not None and seconds >= SLOW_REQUEST_SECONDS:
+            phases = ''
+            if self.timings:
+                phases = ' (' + ', '.join(f"{k} {v * 1000:,.0f} ms" for k, v in self.timings.items()) + ')'
+            print(f"⏳ Slow request: {method} {path} → {self.status_code} in {seconds * 1000:,.0f} ms, "
+                  f"{bytes_in:,} bytes in, {bytes_out:,} bytes out{phases}")
+        if self.profiler is not None:
+            name = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+            filename = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{method}-{name}-{threading.get_ident()}.prof")
+            self.profiler.dump_stats(filename)
+            print(f"🔬 Profile of {method} {path} ({seconds * 1000:,.0f} ms) saved to {filename}")
+            pstats.Stats(self.profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(15)
+
+    def send_json(self, status, payload):
+        self.send_json_body(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+    def send_json_body(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json_error(self, status, message):
+        self.send_json(status, {'status': 'error', 'message': message})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/api/subtree':
+            self.handle_subtree(parse_qs(url.query))
+        elif NEIGHBORS_PATH.match(url.path):
+            self.handle_neighbors(unquote(NEIGHBORS_PATH.match(url.path).group(1)))
+        elif url.path == '/api/kinship':
+            self.handle_kinship(parse_qs(url.query))
+        elif url.path == '/api/search':
+            self.handle_search(parse_qs(url.query))
+        elif url.path == '/api/layout':
+            self.handle_layout(parse_qs(url.query))
+        elif url.path == '/api/tiles':
+            self.handle_tiles(parse_qs(url.query))
+        elif TILE_PATH.match(url.path):
+            z, x, y = map(int, TILE_PATH.match(url.path).groups())
+            self.handle_tile(z, x, y, parse_qs(url.query))
+        elif url.path == '/api/export.svg':
+            self.handle_export(parse_qs(url.query))
+        elif url.path == '/api/validate':
+            self.handle_validate(parse_qs(url.query))
+        elif url.path == '/api/stats':
+            self.handle_stats()
+        elif url.path == '/api/events':
+            self.handle_events(parse_qs(url.query))
+        elif url.path == '/api/history':
+            self.handle_history(parse_qs(url.query))
+        elif VERSION_PATH.match(url.path):
+            self.handle_history_version(int(VERSION_PATH.match(url.path).group(1)))
+        elif url.path == '/api/diff':
+            self.handle_diff(parse_qs(url.query))
+        elif url.path == TREE_URL:
+            self.serve_tree()
+        elif url.path == '/metrics':
+            self.handle_metrics()
+        elif url.path in ('/trees', '/trees/') and trees is not None and self.tree_name is None:
+            self.handle_tree_list()
+        else:
+            super().do_GET()
+
+    def do_HEAD(self):
+        # The tree's headers have to match what GET serves from memory, not the file on disk
+        if urlparse(self.path).path == TREE_URL:
+            self.serve_tree(head=True)
+        else:
+            super().do_HEAD()
+
+    def send_head(self):
+        if is_private(self.path):
+            self.send_error(404, "File not found")
+            return None
+        return super().send_head()
+
+    def handle_tree_list(self):
+        loaded = dict(trees.loaded())
+        self.send_json(200, {'trees': [
+            {'name': name, 'url': f"/trees/{name}/", 'loaded': name in loaded,
+             'memoryBytes': loaded[name].footprint() if name in loaded else 0}
+            for name in trees.names()
+        ]})
+
+    def handle_metrics(self):
+        body = metrics.render(tree_gauges()).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def serve_tree(self, head=False):
+        # Serve from memory so journaled changes are visible before compaction; HEAD gets the headers only
+        payload = self.store.payload()
+        etag = payload['etag']
+        if_none_match = self.headers.get('If-None-Match', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('X-Tree-Version', str(payload['version']))
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            return
+
+        accepted = accepted_encodings(self.headers.get('Accept-Encoding'))
+        encoding = next((e for e in ('br', 'gzip') if e in accepted and e in payload), None)
+        body = payload[encoding or 'identity']
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('X-Tree-Version', str(payload['version']))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def handle_subtree(self, query):
+        try:
+            root = query.get('root', [None])[0]
+            up = int(query.get('up', ['2'])[0])
+            down = int(query.get('down', ['2'])[0])
+            mode = query.get('mode', ['extended'])[0]
+        except ValueError:
+            self.send_json_error(400, "up and down must be integers")
+            return
+        if mode not in ('extended', 'descendants'):
+            self.send_json_error(400, "mode must be 'extended' or 'descendants'")
+            return
+        if up < 0 or down < 0:
+            self.send_json_error(400, "up and down must not be negative")
+            return
+
+        with self.store.read() as (tree, graph):
+            root = root or tree['meta'].get('rootPersonId')
+            if root not in graph.people:
+                subtree = None
+            else:
+                subtree = graph.subtree(root, up=up, down=down, mode=mode)
+                subtree['meta'] = tree['meta']
+                body = json.dumps(subtree, ensure_ascii=False)
+        if subtree is None:
+            self.send_json_error(404, f"Person not found: {root}")
+            return
+        self.send_json_body(200, body.encode('utf-8'))
+
+    def handle_search(self, query):
+        text = query.get('q', [''])[0]
+        try:
+            limit = int(query.get('limit', ['10'])[0])
+        except ValueError:
+            self.send_json_error(400, "limit must be an integer")
+            return
+        limit = max(1, min(limit, 100))
+
+        results = self.store.search(text, limit)
+        self.send_json(200, {
+            'query': text,
+            'results': [dict(r['person'], matched=r['matched']) for r in results]
+        })
+
+    def handle_kinship(self, query):
+        a = query.get('a', [None])[0]
+        b = query.get('b', [None])[0]
+        if not a or not b:
+            self.send_json_error(400, "Both a and b person ids are required")
+            return
+        try:
+            result = self.store.kinship(a, b)
+        except KeyError as e:
+            self.send_json_error(404, f"Person not found: {e.args[0]}")
+            return
+        self.send_json(200, result)
+
+    def handle_layout(self, query):
+        """Node positions for a view: root, mode (extended or descendants), focus and collapsed ids"""
+        try:
+            view = parse_view(query)
+        except ValueError as e:
+            self.send_json_error(400, str(e))
+            return
+        try:
+            result = self.store.layout(*view)
+        except KeyError as e:
+            self.send_json_error(404, f"Person not found: {e.args[0]}")
+            return
+        self.send_json(200, result)
+
+    def view_scene(self, query):
+        """(scene, theme, view key) for the view a tile or export request asks for, or None once an error is sent"""
+        try:
+            view, theme = parse_view(query), parse_theme(query)
+        except ValueError as e:
+            self.send_json_error(400, str(e))
+            return None
+        try:
+            scene = self.store.scene(*view)
+        except KeyError as e:
+            self.send_json_error(404, f"Person not found: {e.args[0]}")
+            return None
+        _, mode, focus, collapsed = view
+        key = json.dumps([scene.root, mode, focus, sorted(set(collapsed)), theme])
+        return scene, theme, hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+    def handle_tiles(self, query):
+        """Tile grid of a view: bounds, zoom levels and the URL template for /api/tiles/<z>/<x>/<y>.svg"""
+        found = self.view_scene(query)
+        if found is None:
+            return
+        scene, _, _ = found
+        params = '&'.join(f"{k}={quote(v[0])}" for k, v in sorted(query.items()))
+        self.send_json(200, dict(scene.describe(), url='api/tiles/{z}/{x}/{y}.svg' + (f'?{params}' if params else '')))
+
+    def handle_tile(self, z, x, y, query):
+        """One SVG tile, drawn once per tree content and kept in the store's tile cache"""
+        found = self.view_scene(query)
+        if found is None:
+            return
+        scene, theme, view = found
+        try:
+            scene.tile_box(z, x, y)
+        except ValueError as e:
+            self.send_json_error(404, str(e))
+            return
+        # Tiles are keyed by the tree's content hash (its ETag), not just its
+        # version, which a hand edit of the file can leave unchanged
+        tree_etag, version = self.store.etag()
+        etag = None
+        if version == scene.version:
+            digest = tree_etag.strip('"')
+            etag = f'"{digest}-{view}-{z}-{x}-{y}"'
+        if etag is not None and etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            return
+        body = self.store.tiles.get(scene.version, digest, view, z, x, y) if etag is not None else None
+        if body is None:
+            body = render_tile(scene, z, x, y, theme)
+            if etag is not None:  # Otherwise the tree changed while drawing; the next request caches it
+                self.store.tiles.put(scene.version, digest, view, z, x, y, body)
+        self.send_response(200)
+        self.send_header('Content-type', 'image/svg+xml')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('X-Tree-Version', str(scene.version))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_export(self, query):
+        """The whole view as one SVG file, streamed as it is drawn (gzipped if the client accepts it)"""
+        found = self.view_scene(query)
+        if found is None:
+            return
+        scene, theme, _ = found
+        compress = 'gzip' in accepted_encodings(self.headers.get('Accept-Encoding'))
+        self.close_connection = True  # No Content-Length: the body ends when the connection does
+        self.send_response(200)
+        self.send_header('Content-type', 'image/svg+xml')
+        self.send_header('Content-Disposition', f'attachment; filename="family-tree-v{scene.version}.svg"')
+        self.send_header('X-Tree-Version', str(scene.version))
+        self.send_header('Vary', 'Accept-Encoding')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        try:
+            if compress:
+                gzipper = zlib.compressobj(6, zlib.DEFLATED, 31)
+                write_svg(scene, lambda data: self.wfile.write(gzipper.compress(data)), theme)
+                self.wfile.write(gzipper.flush())
+            else:
+                write_svg(scene, self.wfile.write, theme)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def handle_validate(self, query):
+        """Issues in the stored tree, or with one proposed edge if parentId/childId or spouses are given"""
+        parent_id = query.get('parentId', [None])[0]
+        child_id = query.get('childId', [None])[0]
+        spouses = query.get('spouses', [''])[0].split(',')
+        with self.store.read() as (tree, graph):
+            if parent_id or child_id:
+                issues = check_new_edge(graph, {'type': 'parentChild', 'parentId': parent_id, 'childId': child_id})
+            elif len(spouses) == 2:
+                issues = check_new_edge(graph, {'type': 'spouse', 'people': spouses})
+            else:
+                issues = validate_tree(tree)
+        self.send_json(200, {'valid': not errors_only(issues), 'issues': issues})
+
+    def handle_history(self, query):
+        """Saved versions, newest first: ?limit= of them, ?before= a version to page back from"""
+        try:
+            limit = min(int(query.get('limit', ['50'])[0]), 1000)
+            before = query.get('before', [None])[0]
+            before = int(before) if before is not None else None
+        except ValueError:
+            self.send_json_error(400, "limit and before must be numbers")
+            return
+        self.store.ensure_loaded()  # Loading adds the stored version to the history
+        self.send_json(200, dict(self.store.history.versions(limit, before), current=self.store.version))
+
+    def handle_history_version(self, version):
+        """The whole tree document as it was saved at one version"""
+        self.store.ensure_loaded()
+        try:
+            tree = self.store.history.load(version)
+        except KeyError:
+            self.send_json_error(404, f"Version not in the history: {version}")
+            return
+        self.send_json(200, tree)
+
+    def handle_diff(self, query):
+        """People, relationships and meta fields that differ between ?from= and ?to= (default: current) versions"""
+        self.store.ensure_loaded()
+        try:
+            a = int(query['from'][0])
+            b = int(query.get('to', [self.store.version])[0])
+        except KeyError:
+            self.send_json_error(400, "from is required")
+            return
+        except ValueError:
+            self.send_json_error(400, "from and to must be version numbers")
+            return
+        try:
+            result = self.store.history.diff(a, b)
+        except KeyError as e:
+            self.send_json_error(404, f"Version not in the history: {e.args[0]}")
+            return
+        self.send_json(200, result)
+
+    def handle_stats(self):
+        """Generation, lifespan, marriage-age, branch and coverage statistics, cached per version"""
+        try:
+            stats = self.store.stats()
+        except RuntimeError as e:
+            self.send_json_error(501, str(e))
+            return
+        self.send_json(200, stats)
+
+    def handle_events(self, query):
+        """Server-Sent Events stream with one event per new version of the tree
+
+        A client passes the version it has as ?since=<version> (or, when
+        reconnecting, Last-Event-ID) and first gets every event after it, or a
+        single "replace" event if those are no longer buffered.
+        """
+        try:
+            since = self.headers.get('Last-Event-ID') or query.get('since', [None])[0]
+            since = int(since) if since is not None else None
+        except ValueError:
+            self.send_json_error(400, "since must be a version number")
+            return
+        if event_slots is None:
+            # A stream would keep the one thread busy until it closed
+            self.send_json_error(503, "Event streams need a threaded server (--workers above 0)")
+            return
+        if not event_slots.acquire(blocking=False):
+            self.send_json_error(503, "Too many open event streams")
+            return
+        feed = self.store.feed
+        try:
+            with self.store.read():
+                current = self.store.version
+                subscriber, backlog = feed.subscribe(since, current)
+            try:
+                self.close_connection = True  # The stream ends when either side closes it
+                self.send_response(200)
+                self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('X-Tree-Version', str(current))
+                self.end_headers()
+                if backlog is None:
+                    backlog = [{'version': current, 'type': 'replace'}]
+                for event in backlog:
+                    self.send_event(event)
+                if self.worker is not None:
+                    # Waiting for events is not handling a request: keep only the connection's thread
+                    self.worker.release()
+                    self.worker = None
+                idle = 0
+                while not shutting_down.is_set():
+                    try:
+                        event = subscriber.get(timeout=1)
+                    except queue.Empty:
+                        idle += 1
+                        if idle >= EVENT_KEEPALIVE:
+                            self.wfile.write(b': keep-alive\n\n')
+                            idle = 0
+                        continue
+                    self.send_event(event)
+                    idle = 0
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                feed.unsubscribe(subscriber)
+        finally:
+            event_slots.release()
+
+    def send_event(self, event):
+        data = {k: v for k, v in event.items() if k != 'type'}
+        self.wfile.write(f"id: {event['version']}\nevent: {event['type']}\ndata: "
+                         f"{json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+    def write_precondition(self):
+        """(ok, expected version) for a write from its If-Match header; ok is False once an error was sent"""
+        header = self.headers.get('If-Match')
+        if header is None:
+            self.close_connection = True  # The body is left unread
+            self.send_json(428, {'status': 'error', 'version': self.store.version,
+                                 'message': "If-Match with the tree version you edited is required (* to overwrite)"})
+            return False, None
+        try:
+            expected = parse_if_match(header)
+        except ValueError:
+            self.close_connection = True
+            self.send_json_error(400, "If-Match must be a tree version, its ETag or *")
+            return False, None
+        if isinstance(expected, list):
+            # An ETag from GET /family1.json stands for the version it was served at
+            etag, version = self.store.etag()
+            if etag not in expected:
+                self.close_connection = True
+                self.send_conflict(VersionConflict(', '.join(expected), version))
+                return False, None
+            expected = version
+        return True, expected
+
+    def send_conflict(self, error, **extra):
+        self.send_json(409, dict({'status': 'error', 'message': str(error), 'version': error.current}, **extra))
+        print(f"⚠️  Rejected write based on version {error.expected}: {self.store.path} is at {error.current}")
+
+    def handle_neighbors(self, person_id):
+        neighborhood = self.store.neighborhood(person_id)
+        if neighborhood is None:
+            self.send_json_error(404, f"Person not found: {person_id}")
+            return
+        self.send_json(200, dict({'id': person_id}, **neighborhood))
+
     def do_POST(self):
         if self.path == '/save':
+            ok, expected = self.write_precondition()
+            if not ok:
+                return
+            self.timings = timings = {}
             try:
                 content_length = int(self.headers['Content-Length'])
+                started = time.perf_counter()
                 post_data = self.rfile.read(content_length)
+                timings['read'] = time.perf_counter() - started
+                started = time.perf_counter()
                 data = json.loads(post_data)
+                timings['parse'] = time.perf_counter() - started
                 
-                # Basic validation
-                if 'people' not in data or 'relationships' not in data:
-                    raise ValueError("Invalid family tree data format")
-
-                # Backup existing file just in case
-                if os.path.exists(DATA_FILE):
-                    os.replace(DATA_FILE, DATA_FILE + '.bak')
-
-                # Write new data
-                with open(DATA_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, indent=2, ensure_ascii=False)
+                # Validate, back up the old file and atomically write the new one
+                warnings = self.store.save(data, timings, expected)
                 
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'status': 'success', 'message': 'Data saved successfully'}).encode())
-                print(f"✅ Data saved to {DATA_FILE}")
+                self.send_json(200, {'status': 'success', 'message': 'Data saved successfully',
+                                     'warnings': warnings, 'version': data['meta']['version']})
+                print(f"✅ Data saved to {self.store.path}" + (f" ({len(warnings)} warnings)" if warnings else ""))
                 
+            except ValidationError as e:
+                self.send_json(422, {'status': 'error', 'message': str(e), 'issues': e.issues})
+                print(f"❌ Rejected invalid tree: {e}")
+            except VersionConflict as e:
+                self.send_conflict(e)
             except Exception as e:
-                self.send_response(500)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'status': 'error', 'message': str(e)}).encode())
+                self.send_json(500, {'status': 'error', 'message': str(e)})
                 print(f"❌ Error saving data: {e}")
+            finally:
+                metrics.observe_phases('save', timings)
+        elif self.path.split('?')[0] == '/api/import/gedcom':
+            self.handle_gedcom_import()
+        elif RESTORE_PATH.match(self.path):
+            self.handle_restore(int(RESTORE_PATH.match(self.path).group(1)))
         else:
             self.send_error(404, "File not found")
 
+    def handle_restore(self, version):
+        """Save a version from the history again, as the newest version"""
+        ok, expected = self.write_precondition()
+        if not ok:
+            return
+        self.timings = timings = {}
+        self.store.ensure_loaded()
+        started = time.perf_counter()
+        try:
+            tree = self.store.history.load(version)
+        except KeyError:
+            self.send_json_error(404, f"Version not in the history: {version}")
+            return
+        timings['load'] = time.perf_counter() - started
+        tree['meta'].pop('version', None)  # save() gives it the next one
+        try:
+            warnings = self.store.save(tree, timings, expected)
+        except VersionConflict as e:
+            self.send_conflict(e)
+            return
+        except ValidationError as e:
+            self.send_json(422, {'status': 'error', 'message': str(e), 'issues': e.issues})
+            return
+        except Exception as e:
+            self.send_json(500, {'status': 'error', 'message': str(e)})
+            print(f"❌ Error restoring version {version}: {e}")
+            return
+        finally:
+            metrics.observe_phases('restore', timings)
+        self.send_json(200, {'status': 'success', 'message': f'Restored version {version}', 'restored': version,
+                             'warnings': warnings, 'version': tree['meta']['version']})
+        print(f"⏪ Restored version {version} of {self.store.path} as version {tree['meta']['version']}")
+
+    def body_lines(self):
+        """Lines of the request body, read as they arrive rather than all at once"""
+        remaining = int(self.headers['Content-Length'])
+        while remaining > 0:
+            line = self.rfile.readline(min(remaining, 65536))
+            if not line:
+                break
+            remaining -= len(line)
+            yield line
+
+    def handle_gedcom_import(self):
+        """Replace the tree with an uploaded GEDCOM file
+
+        The upload is parsed as it arrives, but the server holds every tree
+        in memory, so the imported tree is built whole; uploads are capped at
+        MAX_IMPORT_BYTES. `python3 gedcom.py tree.ged family.db` streams a
+        file of any size into SQLite instead.
+        """
+        if self.headers['Content-Length'] is None:
+            self.send_json_error(411, "Content-Length is required")
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+        except ValueError:
+            self.close_connection = True
+            self.send_json_error(400, "Content-Length must be a number")
+            return
+        if length > MAX_IMPORT_BYTES:
+            self.close_connection = True  # The upload is left unread
+            self.send_json_error(413, f"GEDCOM uploads are limited to {MAX_IMPORT_BYTES // (1024 * 1024):,} MB; "
+                                      f"import larger files with gedcom.py")
+            return
+        ok, expected = self.write_precondition()
+        if not ok:
+            return
+        title = parse_qs(urlparse(self.path).query).get('title', ['Family Tree'])[0]
+
+        def log_progress(stats):
+            print(f"📥 GEDCOM import: {stats['records']:,} records, {stats['recordsPerSecond']:,} records/s")
+
+        lines = self.body_lines()
+        self.timings = timings = {}
+        try:
+            started = time.perf_counter()
+            tree, stats = read_gedcom(lines, title, total_bytes=length,
+                                      progress=log_progress, every=100000)
+            timings['parse'] = time.perf_counter() - started
+            warnings = self.store.save(tree, timings, expected)
+        except VersionConflict as e:
+            for _ in lines:
+                pass
+            self.send_conflict(e)
+            return
+        except ValidationError as e:
+            for _ in lines:  # Drain what is left so the connection can be reused
+                pass
+            self.send_json(422, {'status': 'error', 'message': str(e), 'issues': e.issues})
+            print(f"❌ Rejected GEDCOM import: {e}")
+            return
+        except ValueError as e:
+            for _ in lines:
+                pass
+            self.send_json_error(400, str(e))
+            print(f"❌ Rejected GEDCOM import: {e}")
+            return
+        except Exception as e:
+            self.send_json(500, {'status': 'error', 'message': str(e)})
+            print(f"❌ Error importing GEDCOM: {e}")
+            return
+        finally:
+            metrics.observe_phases('import', timings)
+
+        self.send_json(200, {
+            'status': 'success',
+            'message': f"Imported {stats['people']} people and {stats['relationships']} relationships",
+            'stats': stats,
+            'warnings': warnings,
+            'version': tree['meta']['version']
+        })
+        print(f"✅ Imported GEDCOM into {self.store.path} ({stats['people']:,} people in {stats['seconds']:.1f}s)")
+
+    def do_PATCH(self):
+        if self.path != '/api/changes':
+            self.send_error(404, "File not found")
+            return
+        ok, expected = self.write_precondition()
+        if not ok:
+            return
+        try:
+            content_length = int(self.headers['Content-Length'])
+            data = json.loads(self.rfile.read(content_length))
+        except (TypeError, ValueError) as e:
+            self.send_json_error(400, f"Invalid request body: {e}")
+            return
+
+        changes = data.get('changes', [data]) if isinstance(data, dict) else data
+        if not isinstance(changes, list):
+            self.send_json_error(400, "Expected a change or a list of changes")
+            return
+
+        try:
+            applied = self.store.apply_changes(changes, expected_version=expected)
+        except VersionConflict as e:
+            self.send_conflict(e, applied=0)
+            return
+        except ValueError as e:
+            index = getattr(e, 'index', None)
+            body = {'status': 'error', 'message': str(e), 'applied': 0, 'rejected': index,
+                    'version': self.store.version}
+            if isinstance(e, ValidationError):
+                body['issues'] = e.issues
+            self.send_json(400, body)
+            print(f"❌ Rejected a batch of {len(changes)} changes: {e}")
+            return
+        except Exception as e:
+            self.send_json(500, {'status': 'error', 'message': str(e), 'applied': 0})
+            print(f"❌ Error applying changes: {e}")
+            return
+
+        self.send_json(200, {'status': 'success', 'message': f'Applied {applied} changes', 'applied': applied,
+                             'version': self.store.version})
+        print(f"✅ Stored {applied} changes in {self.store.path}")
+
     def end_headers(self):
         # Add CORS headers for local development if needed
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'X-Requested-With, Content-Type')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PATCH, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'X-Requested-With, Content-Type, X-Profile, If-Match, Last-Event-ID')
+        self.send_header('Access-Control-Expose-Headers', 'ETag, X-Tree-Version')
         super().end_headers()
         
     def do_OPTIONS(self):
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
-print(f"🌳 Family Tree Server running at http://localhost:{PORT}")
-print(f"📂 serving files from {os.getcwd()}")
-print(f"💾 /save endpoint ready to write to {DATA_FILE}")
-
 class ReusableTCPServer(socketserver.TCPServer):
     allow_reuse_address = True
 
-with ReusableTCPServer(("", PORT), FamilyTreeHandler) as httpd:
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\n🛑 Server stopped.")
+class PooledHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Give each connection a thread, but handle at most max_workers requests at once
+
+    A keep-alive connection waiting for its next request holds only its own
+    thread, not one of the workers, so idle connections never keep another
+    client's request waiting. Connections beyond MAX_CONNECTIONS are closed
+    as soon as they are accepted.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS):
+        super().__init__(server_address, handler_class)
+        self.workers = threading.BoundedSemaphore(max_workers)  # taken by FamilyTreeHandler per request
+        self.connections = threading.BoundedSemaphore(MAX_CONNECTIONS)
+
+    def process_request(self, request, client_address):
+        if not self.connections.acquire(blocking=False):
+            self.shutdown_request(request)
+            return
+        super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.connections.release()
+
+def main():
+    global store, trees, event_slots, SLOW_REQUEST_SECONDS, PROFILE_DIR, MAX_IMPORT_BYTES
+    parser = argparse.ArgumentParser(description="Serve the family tree and its editing API")
+    parser.add_argument('--port', type=int, default=PORT, help=f"port to listen on (default: {PORT})")
+    parser.add_argument('--data', default=DATA_FILE,
+                        help=f"tree file: .json, or .db/.sqlite for the SQLite backend (default: {DATA_FILE})")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help=f"maximum requests handled at once; 0 serves one request at a time (default: {MAX_WORKERS})")
+    parser.add_argument('--trees', default=None,
+                        help="directory of trees (<name>.json or <name>.db) to host under /trees/<name>/")
+    parser.add_argument('--cache-mb', type=int, default=MAX_BYTES // (1024 * 1024),
+                        help=f"memory for loaded --trees before the least recently used are unloaded "
+                             f"(default: {MAX_BYTES // (1024 * 1024)})")
+    parser.add_argument('--idle-minutes', type=float, default=MAX_IDLE / 60,
+                        help=f"unload a --trees tree after this long without requests (default: {MAX_IDLE // 60:g})")
+    parser.add_argument('--max-import-mb', type=int, default=MAX_IMPORT_BYTES // (1024 * 1024),
+                        help=f"largest GEDCOM upload accepted by /api/import/gedcom "
+                             f"(default: {MAX_IMPORT_BYTES // (1024 * 1024)})")
+    parser.add_argument('--slow-ms', type=float, default=None,
+                        help="log every request that takes at least this many milliseconds")
+    parser.add_argument('--profile-dir', default=None,
+                        help="allow per-request profiling: requests with an 'X-Profile: 1' header are run under "
+                             "cProfile and their stats written to this directory")
+    args = parser.parse_args()
+
+    if args.trees:
+        if not os.path.isdir(args.trees):
+            parser.error(f"--trees: {args.trees} is not a directory")
+        trees = TreePool(args.trees, max_bytes=args.cache_mb * 1024 * 1024, max_idle=args.idle_minutes * 60)
+        if not os.path.exists(args.data):
+            store = None
+    if store is not None and args.data != store.path:
+        store = TreeStore(args.data)
+    if args.slow_ms is not None:
+        SLOW_REQUEST_SECONDS = args.slow_ms / 1000
+    MAX_IMPORT_BYTES = args.max_import_mb * 1024 * 1024
+    if args.profile_dir:
+        os.makedirs(args.profile_dir, exist_ok=True)
+        PROFILE_DIR = args.profile_dir
+
+    print(f"🌳 Family Tree Server running at http://localhost:{args.port}")
+    print(f"📂 serving files from {os.getcwd()}")
+    if store is not None:
+        print(f"💾 /save and PATCH /api/changes ready to write to {store.storage.describe()}")
+    if trees is not None:
+        print(f"🗂️  Hosting {len(trees.names())} trees from {args.trees} under /trees/<name>/ "
+              f"(up to {args.cache_mb:,} MB loaded, unloaded after {args.idle_minutes:g} idle minutes)")
+    print("🔎 /api/subtree, /api/node/<id>/neighbors, /api/search, /api/kinship and /api/layout ready")
+    print("🗺️  /api/tiles/<z>/<x>/<y>.svg and /api/export.svg ready")
+    print("📊 /api/stats ready" + ("" if HAVE_NUMPY else " (install numpy to enable it)"))
+    print("🕰️  /api/history, /api/history/<version>, /api/diff and /api/history/<version>/restore ready")
+    print("📈 /metrics ready" + (f", logging requests over {args.slow_ms:g} ms" if args.slow_ms is not None else "")
+          + (f", profiles go to {PROFILE_DIR}" if PROFILE_DIR else ""))
+
+    if store is not None:
+        store.get()  # Replays any journal left by an unclean shutdown
+        store.start_compactor()
+    if trees is not None:
+        trees.start_janitor()
+
+    if args.workers > 0:
+        # Streams give their worker back while they wait, so this bounds threads, not workers
+        event_slots = threading.Semaphore(max(1, args.workers // 2))
+        print(f"🧵 Handling up to {args.workers} requests at once")
+        httpd = PooledHTTPServer(("", args.port), FamilyTreeHandler, args.workers)
+    else:
+        FamilyTreeHandler.protocol_version = 'HTTP/1.0'  # Keep-alive would block everyone else
+        event_slots = None  # So would an event stream
+        httpd = ReusableTCPServer(("", args.port), FamilyTreeHandler)
+
+    with httpd:
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            shutting_down.set()
+            if store is not None:
+                store.compact()
+            if trees is not None:
+                trees.close()
+            print("\n🛑 Server stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""
+Tree Storage
+Persistence backends for family trees: a JSON document with an append-only
+journal, or a SQLite database with indexed tables and one transaction per edit
+
+Every backend exposes the same methods:
+  read()                -> (tree, changes still to replay on top of it)
+  write_snapshot(tree)  -> replace everything with a whole document
+  append(change)        -> durably record one edit; a "version" key on it becomes meta.version
+  append_batch(changes) -> durably record several edits at once
+  compact(tree)         -> fold recorded edits into the snapshot
+  token()               -> value that changes when another process edits the data
+  pending               -> edits recorded since the last snapshot
+  close()               -> release open files or connections
+"""
+
+import heapq
+import itertools
+import json
+import os
+import shutil
+import sqlite3
+import stat
+import sys
+import tempfile
+import threading
+
+PERSON_KEYS = frozenset(("id", "name", "gender", "aliases", "birthYear", "deathYear", "notes"))
+SPOUSE_KEYS = frozenset(("type", "people", "startYear", "endYear", "notes"))
+PARENT_CHILD_KEYS = frozenset(("type", "parentId", "childId", "biological", "notes"))
+_UMASK = os.umask(0)  # Read once at import; umask can only be read by setting it
+os.umask(_UMASK)
+
+
+def _fsync_directory(directory):
+    """Make a rename in directory durable; not possible (or needed) on Windows"""
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file in the same directory, fsync it and rename it over path
+
+    The new file keeps the old one's permissions (mkstemp's are owner-only),
+    and the directory is fsync'd so the rename itself survives a crash.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_directory(directory)
+
+
+def backup_file(path):
+    """Keep the current file as path.bak without ever leaving path missing"""
+    if not os.path.exists(path):
+        return
+    backup = path + '.bak'
+    if os.path.exists(backup):
+        os.remove(backup)
+    try:
+        os.link(path, backup)
+    except OSError:
+        shutil.copy2(path, backup)
+
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+
+def open_storage(path):
+    """Pick a backend from the file extension"""
+    if path.endswith(SQLITE_EXTENSIONS):
+        return SqliteStorage(path)
+    return JsonStorage(path)
+
+
+class JsonStorage:
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.pending = 0
+        self._journal = None
+
+    def describe(self):
+        return f"{self.path} (journal: {self.journal_path})"
+
+    def token(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def read(self):
+        """Load the snapshot and any journal entries written after it"""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            tree = json.load(f)
+        changes = []
+        if os.path.exists(self.journal_path):
+            complete = 0  # bytes of whole, newline-terminated entries
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        changes.append(json.loads(line))
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        break
+                    complete += len(line)
+            if os.path.getsize(self.journal_path) > complete:
+                self._drop_torn_tail(complete)
+        self.pending = len(changes)
+        return tree, changes
+
+    def _drop_torn_tail(self, size):
+        """Cut a write torn by a crash off the journal, so the next append starts on a fresh line
+
+        The torn entry was never acknowledged: appends are only reported once
+        the whole entry and its newline are fsync'd.
+        """
+        with open(self.journal_path, 'r+b') as f:
+            f.truncate(size)
+            f.flush()
+            os.fsync(f.fileno())
+        print(f"⚠️  Dropped an incomplete entry from the end of {self.journal_path}")
+
+    def write_snapshot(self, tree):
+        """Back up the old file and atomically write a new one, dropping the journal"""
+        backup_file(self.path)
+        write_json_atomic(self.path, tree)
+        self._truncate_journal()
+
+    def append(self, change):
+        """Durably append one change to the journal"""
+        self.append_batch([change])
+
+    def append_batch(self, changes):
+        """Append several changes with a single fsync"""
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._journal.write(''.join(json.dumps(c, ensure_ascii=False) + '\n' for c in changes))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self.pending += len(changes)
+
+    def compact(self, tree):
+        """Fold the journal into a fresh snapshot"""
+        write_json_atomic(self.path, tree)
+        self._truncate_journal()
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _truncate_journal(self):
+        """Forget journal entries that are now part of the snapshot"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.pending = 0
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS people (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    name TEXT,
+    gender TEXT,
+    birth_year,
+    death_year,
+    notes TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS people_position ON people(position);
+CREATE TABLE IF NOT EXISTS aliases (
+    person_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    alias TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS aliases_person ON aliases(person_id, position);
+CREATE TABLE IF NOT EXISTS parent_child (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    parent_id TEXT NOT NULL,
+    child_id TEXT NOT NULL,
+    biological INTEGER,
+    notes TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS parent_child_parent ON parent_child(parent_id);
+CREATE INDEX IF NOT EXISTS parent_child_child ON parent_child(child_id);
+CREATE INDEX IF NOT EXISTS parent_child_position ON parent_child(position);
+CREATE TABLE IF NOT EXISTS spouses (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    person1 TEXT NOT NULL,
+    person2 TEXT NOT NULL,
+    start_year,
+    end_year,
+    notes TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS spouses_person1 ON spouses(person1);
+CREATE INDEX IF NOT EXISTS spouses_person2 ON spouses(person2);
+CREATE INDEX IF NOT EXISTS spouses_position ON spouses(position);
+"""
+
+PEOPLE_SELECT = "id, name, gender, birth_year, death_year, notes, extra"
+PARENT_CHILD_SELECT = "parent_id, child_id, biological, notes, extra"
+SPOUSES_SELECT = "person1, person2, start_year, end_year, notes, extra"
+
+
+def _person(row, aliases):
+    """A person dict from a PEOPLE_SELECT row"""
+    person_id, name, gender, birth, death, notes, extra = row
+    person = {
+        "id": person_id,
+        "name": name,
+        "gender": gender,
+        "aliases": aliases,
+        "birthYear": birth,
+        "deathYear": death,
+        "notes": notes
+    }
+    if extra:
+        person.update(json.loads(extra))
+    return person
+
+
+def _parent_child(row):
+    """A parentChild relationship from a PARENT_CHILD_SELECT row"""
+    parent_id, child_id, biological, notes, extra = row
+    rel = {
+        "type": "parentChild",
+        "parentId": parent_id,
+        "childId": child_id,
+        "biological": None if biological is None else bool(biological),
+        "notes": notes
+    }
+    if extra:
+        rel.update(json.loads(extra))
+    return rel
+
+
+def _spouse(row):
+    """A spouse relationship from a SPOUSES_SELECT row"""
+    p1, p2, start, end, notes, extra = row
+    rel = {
+        "type": "spouse",
+        "people": [p1, p2],
+        "startYear": start,
+        "endYear": end,
+        "notes": notes
+    }
+    if extra:
+        rel.update(json.loads(extra))
+    return rel
+
+
+PERSON_COLUMNS = {
+    "name": "name",
+    "gender": "gender",
+    "birthYear": "birth_year",
+    "deathYear": "death_year",
+    "notes": "notes"
+}
+
+
+def _extra(record, known):
+    """JSON for any keys outside the standard schema, so they survive a round trip"""
+    if record.keys() <= known:
+        return None
+    extra = {k: v for k, v in record.items() if k not in known}
+    return json.dumps(extra, ensure_ascii=False) if extra else None
+
+
+class SqliteStorage:
+    def __init__(self, path):
+        self.path = path
+        self.pending = 0  # edits are committed straight into the tables
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def describe(self):
+        return f"{self.path} (SQLite)"
+
+    def token(self):
+        """Changes whenever another connection commits to the database"""
+        with self._lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def read(self):
+        """Export the database as a tree document in the JSON schema"""
+        with self._lock:
+            return self._export(), []
+
+    def _export(self):
+        meta, people, relationships = self.records()
+        return {"meta": meta, "people": list(people), "relationships": list(relationships)}
+
+    def records(self):
+        """(meta, people, relationships), the last two as iterators that build each record as it is read
+
+        For loading a large database without holding it as dicts (see
+        compact_tree); single-threaded use only, since it takes no lock.
+        """
+        conn = self.conn
+        meta = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta ORDER BY rowid")}
+
+        aliases = {}
+        for person_id, alias in conn.execute("SELECT person_id, alias FROM aliases ORDER BY person_id, position"):
+            aliases.setdefault(person_id, []).append(alias)
+
+        def people():
+            for row in conn.execute(f"SELECT {PEOPLE_SELECT} FROM people ORDER BY position"):
+                yield _person(row, aliases.get(row[0], []))
+
+        def parent_child_rows():
+            for row in conn.execute(f"SELECT position, {PARENT_CHILD_SELECT} FROM parent_child ORDER BY position"):
+                yield row[0], _parent_child(row[1:])
+
+        def spouse_rows():
+            for row in conn.execute(f"SELECT position, {SPOUSES_SELECT} FROM spouses ORDER BY position"):
+                yield row[0], _spouse(row[1:])
+
+        merged = heapq.merge(parent_child_rows(), spouse_rows(), key=lambda row: row[0])
+        return meta, people(), (rel for _, rel in merged)
+
+    def write_snapshot(self, tree):
+        """Replace every table with the contents of a tree document in one transaction"""
+        with self._lock, self.conn:
+            for table in ("meta", "people", "aliases", "parent_child", "spouses"):
+                self.conn.execute(f"DELETE FROM {table}")
+            self.conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?)",
+                ((k, json.dumps(v, ensure_ascii=False)) for k, v in tree.get("meta", {}).items()))
+            self._insert_people(tree.get("people", []), 1)
+            self._insert_relationships(tree.get("relationships", []), 1)
+
+    def append(self, change):
+        """Apply one edit in its own transaction"""
+        self.append_batch([change])
+
+    def append_batch(self, changes):
+        """Apply several edits in one transaction"""
+        with self._lock, self.conn:
+            positions = {}  # Last used position per table group, looked up once per batch
+            # Runs of additions (the common case for imports) go in with one executemany each
+            for op, run in itertools.groupby(changes, key=lambda change: change["op"]):
+                if op == "addPerson":
+                    people = [change["person"] for change in run]
+                    self._insert_people(people, self._next_position(positions, "people", count=len(people)))
+                elif op == "addRelationship":
+                    rels = [change["relationship"] for change in run]
+                    self._insert_relationships(
+                        rels, self._next_position(positions, "parent_child", "spouses", count=len(rels)))
+                else:
+                    for change in run:
+                        self._apply(change, positions)
+            versions = [change["version"] for change in changes if "version" in change]
+            if versions:
+                self.conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('version', ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (json.dumps(max(versions)),))
+
+    def compact(self, tree):
+        """Nothing to fold: edits are already in the tables"""
+
+    def _insert_people(self, people, first_position):
+        """Insert people at consecutive positions"""
+        self.conn.executemany(
+            "INSERT INTO people (id, position, name, gender, birth_year, death_year, notes, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((person["id"], position, person.get("name"), person.get("gender"), person.get("birthYear"),
+              person.get("deathYear"), person.get("notes"), _extra(person, PERSON_KEYS))
+             for position, person in enumerate(people, first_position)))
+        self.conn.executemany(
+            "INSERT INTO aliases (person_id, position, alias) VALUES (?, ?, ?)",
+            ((person["id"], i, alias) for person in people if person.get("aliases")
+             for i, alias in enumerate(person["aliases"])))
+
+    def _insert_relationships(self, rels, first_position):
+        """Insert relationships at consecutive positions, shared between the two edge tables"""
+        parent_child, spouses = [], []
+        for position, rel in enumerate(rels, first_position):
+            if rel.get("type") == "parentChild":
+                biological = rel.get("biological")
+                parent_child.append((position, rel["parentId"], rel["childId"],
+                                     None if biological is None else int(biological),
+                                     rel.get("notes"), _extra(rel, PARENT_CHILD_KEYS)))
+            elif rel.get("type") == "spouse":
+                spouses.append((position, rel["people"][0], rel["people"][1], rel.get("startYear"),
+                                rel.get("endYear"), rel.get("notes"), _extra(rel, SPOUSE_KEYS)))
+            else:
+                raise ValueError(f"Unknown relationship type: {rel.get('type')}")
+        self.conn.executemany(
+            "INSERT INTO parent_child (position, parent_id, child_id, biological, notes, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?)", parent_child)
+        self.conn.executemany(
+            "INSERT INTO spouses (position, person1, person2, start_year, end_year, notes, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", spouses)
+
+    def _next_position(self, positions, *tables, count=1):
+        """First of `count` unused positions shared by `tables`"""
+        if tables not in positions:
+            positions[tables] = max(
+                self.conn.execute(f"SELECT COALESCE(MAX(position), 0) FROM {table}").fetchone()[0]
+                for table in tables)
+        first = positions[tables] + 1
+        positions[tables] += count
+        return first
+
+    def _apply(self, change, positions):
+        conn = self.conn
+        op = change["op"]
+        if op == "addPerson":
+            self._insert_people([change["person"]], self._next_position(positions, "people"))
+        elif op == "updatePerson":
+            person_id = change["id"]
+            fields = dict(change["fields"])
+            if "aliases" in fields:
+                conn.execute("DELETE FROM aliases WHERE person_id = ?", (person_id,))
+                conn.executemany(
+                    "INSERT INTO aliases (person_id, position, alias) VALUES (?, ?, ?)",
+                    ((person_id, i, alias) for i, alias in enumerate(fields.pop("aliases") or [])))
+            for key, value in fields.items():
+                conn.execute(f"UPDATE people SET {PERSON_COLUMNS[key]} = ? WHERE id = ?", (value, person_id))
+        elif op == "deletePerson":
+            person_id = change["id"]
+            conn.execute("DELETE FROM people WHERE id = ?", (person_id,))
+            conn.execute("DELETE FROM aliases WHERE person_id = ?", (person_id,))
+            conn.execute("DELETE FROM parent_child WHERE parent_id = ? OR child_id = ?", (person_id, person_id))
+            conn.execute("DELETE FROM spouses WHERE person1 = ? OR person2 = ?", (person_id, person_id))
+            conn.execute(
+                "UPDATE meta SET value = 'null' WHERE key = 'rootPersonId' AND value = ?",
+                (json.dumps(person_id, ensure_ascii=False),))
+        elif op == "addRelationship":
+            self._insert_relationships([change["relationship"]], self._next_position(positions, "parent_child", "spouses"))
+        elif op == "deleteRelationship":
+            rel = change["relationship"]
+            if rel.get("type") == "parentChild":
+                conn.execute("DELETE FROM parent_child WHERE parent_id = ? AND child_id = ?",
+                             (rel["parentId"], rel["childId"]))
+            else:
+                p1, p2 = rel["people"][0], rel["people"][1]
+                conn.execute("DELETE FROM spouses WHERE (person1 = ? AND person2 = ?) OR (person1 = ? AND person2 = ?)",
+                             (p1, p2, p2, p1))
+        elif op == "updateMeta":
+            conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                ((k, json.dumps(v, ensure_ascii=False)) for k, v in change["fields"].items()))
+        else:
+            raise ValueError(f"Unknown change op: {op}")
+
+    def get_person(self, person_id):
+        """Look up one person by id without exporting the tree"""
+        with self._lock:
+            row = self.conn.execute(f"SELECT {PEOPLE_SELECT} FROM people WHERE id = ?", (person_id,)).fetchone()
+            if row is None:
+                return None
+            aliases = [a for (a,) in self.conn.execute(
+                "SELECT alias FROM aliases WHERE person_id = ? ORDER BY position", (person_id,))]
+        return _person(row, aliases)
+
+    def neighbors(self, person_id):
+        """Parent, child and spouse ids of one person and the relationships to them, via the endpoint indexes
+
+        Like FamilyGraph, a repeated edge counts once, with its last record.
+        """
+        with self._lock:
+            conn = self.conn
+            parents = {rel["parentId"]: rel for rel in map(_parent_child, conn.execute(
+                f"SELECT {PARENT_CHILD_SELECT} FROM parent_child WHERE child_id = ? ORDER BY position", (person_id,)))}
+            children = {rel["childId"]: rel for rel in map(_parent_child, conn.execute(
+                f"SELECT {PARENT_CHILD_SELECT} FROM parent_child WHERE parent_id = ? ORDER BY position", (person_id,)))}
+            spouses = {rel["people"][1] if rel["people"][0] == person_id else rel["people"][0]: rel
+                       for rel in map(_spouse, conn.execute(
+                           f"SELECT {SPOUSES_SELECT} FROM spouses WHERE person1 = ? OR person2 = ? ORDER BY position",
+                           (person_id, person_id)))}
+        return {
+            "parents": list(parents),
+            "children": list(children),
+            "spouses": list(spouses),
+            "relationships": [*parents.values(), *children.values(), *spouses.values()]
+        }
+
+def main():
+    """Convert a tree between storage backends, e.g. family1.json -> family.db"""
+    if len(sys.argv) != 3:
+        print("Usage: python3 storage.py SOURCE DEST  (.json or .db/.sqlite)")
+        sys.exit(1)
+    source, dest = open_storage(sys.argv[1]), open_storage(sys.argv[2])
+    tree, changes = source.read()
+    if changes:
+        print(f"❌ {sys.argv[1]} has {len(changes)} journaled changes; start and stop server.py to compact them first")
+        sys.exit(1)
+    dest.write_snapshot(tree)
+    print(f"✅ Copied {len(tree['people'])} people and {len(tree['relationships'])} relationships to {sys.argv[2]}")
+
+
+if __name__ == "__main__":
+    main()
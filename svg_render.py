@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+SVG Render
+Draws a computed layout (see layout.py) as standalone SVG: square tiles
+addressed by zoom/x/y for viewing very large trees a piece at a time, or
+the whole tree written out piece by piece
+
+Drawing follows renderTree in tree-visualization.js, with the stylesheet's
+effect inlined so the SVG looks the same outside the page. Zoomed-out tiles
+drop detail nobody could see: first the labels, then links and single nodes,
+which become a density map of where people are.
+"""
+
+import math
+from bisect import bisect_left, bisect_right
+from html import escape
+
+NODE_RADIUS = 25
+TILE_SIZE = 256  # pixels per tile side
+PADDING = 200  # world units around the outermost nodes
+FULL_DETAIL = 0.3  # pixels per world unit from which names and avatars are drawn
+LINK_DETAIL = 0.04  # pixels per world unit from which links and single nodes are drawn
+DENSITY_CELL = 2  # pixels per density map cell
+
+THEMES = {
+    "light": {"background": "#f0f7ff", "parentChild": "#795548", "spouse": "#a1887f",
+              "text": "#2c3e50", "textStroke": None},
+    "dark": {"background": "#1b262c", "parentChild": "#d7ccc8", "spouse": "#efebe9",
+             "text": "#ffffff", "textStroke": "#0f2027"},
+}
+GRADIENTS = {"M": ("male", "#4FC3F7", "#039BE5"), "F": ("female", "#F48FB1", "#E91E63")}
+OTHER_GRADIENT = ("other", "#d4e157", "#c0ca33")
+
+ROOT, COLLAPSED, HAS_CHILDREN = 1, 2, 4
+
+
+def _n(value):
+    """Compact number for SVG attributes"""
+    return str(int(value)) if float(value).is_integer() else f"{value:.1f}"
+
+
+class BoxIndex:
+    """Which of many boxes overlap a query box, without looking at most of them
+
+    Boxes are grouped by width in powers of two and sorted by left edge, so
+    a query only scans, per group, the boxes starting within one group
+    width of it.
+    """
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+        groups = {}
+        for item, box in enumerate(boxes):
+            groups.setdefault(int(box[2] - box[0]).bit_length(), []).append((box[0], item))
+        self.groups = []
+        for bits, entries in groups.items():
+            entries.sort()
+            self.groups.append((1 << bits, [left for left, _ in entries], [item for _, item in entries]))
+
+    def query(self, x0, y0, x1, y1):
+        """Items whose boxes overlap (x0, y0)-(x1, y1), in ascending order"""
+        boxes = self.boxes
+        found = []
+        for width, lefts, items in self.groups:
+            for item in items[bisect_left(lefts, x0 - width):bisect_right(lefts, x1)]:
+                box = boxes[item]
+                if box[2] >= x0 and box[1] <= y1 and box[3] >= y0:
+                    found.append(item)
+        found.sort()
+        return found
+
+
+class Scene:
+    """Everything needed to draw one view of one tree version
+
+    Built from a LayoutEngine result and the tree at the same version, and
+    never changed afterwards, so it can be drawn without holding any lock.
+    Items are the links (in relationship order, drawn first) followed by the
+    nodes (in layout order), like the page draws them.
+    """
+
+    def __init__(self, layout, tree, graph):
+        self.version = layout["version"]
+        self.root = layout["root"]
+        positions = layout["positions"]
+        collapsed = frozenset(layout.get("collapsed", ()))
+        people = graph.people
+
+        self.links = []  # (kind, start x, start y, end x, end y)
+        boxes = []
+        for rel in tree["relationships"]:
+            kind = rel.get("type")
+            if kind == "parentChild":
+                source, target = positions.get(rel.get("parentId")), positions.get(rel.get("childId"))
+                if source is None or target is None or rel["parentId"] in collapsed:
+                    continue
+            elif kind == "spouse" and len(rel.get("people") or ()) == 2:
+                source, target = positions.get(rel["people"][0]), positions.get(rel["people"][1])
+                if source is None or target is None:
+                    continue
+            else:
+                continue
+            # From below the source's avatar to the top of the target, as createElbowConnector draws it
+            sx, sy = source["x"], source["y"] + NODE_RADIUS + 30
+            tx, ty = target["x"], target["y"] - NODE_RADIUS
+            self.links.append((kind, sx, sy, tx, ty))
+            boxes.append((min(sx, tx), min(sy, ty), max(sx, tx), max(sy, ty)))
+
+        self.nodes = []  # (x, y, name, gender, flags)
+        for person_id, position in positions.items():
+            person = people.get(person_id)
+            if person is None:
+                continue
+            flags = ((ROOT if person_id == self.root else 0) | (COLLAPSED if person_id in collapsed else 0)
+                     | (HAS_CHILDREN if position.get("hasChildren") else 0))
+            x, y = position["x"], position["y"]
+            self.nodes.append((x, y, person.get("name") or "", person.get("gender"), flags))
+            # Names are centred under the node and rarely wider than the node spacing
+            boxes.append((x - 100, y - NODE_RADIUS - 15, x + 100, y + NODE_RADIUS + 65))
+        self.index = BoxIndex(boxes)
+
+        if boxes:
+            left = min(box[0] for box in boxes) - PADDING
+            top = min(box[1] for box in boxes) - PADDING
+            size = max(max(box[2] for box in boxes) + PADDING - left, max(box[3] for box in boxes) + PADDING - top)
+        else:
+            left, top, size = 0, 0, TILE_SIZE
+        self.bounds = (left, top, size)
+        # Deepest zoom: the one whose tiles show about one world unit per pixel
+        self.max_zoom = max(0, math.ceil(math.log2(size / TILE_SIZE)))
+
+    def tile_box(self, z, x, y):
+        """World (left, top, size) of a tile; raises ValueError if there is no such tile"""
+        if not 0 <= z <= self.max_zoom or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise ValueError(f"No tile {z}/{x}/{y}")
+        left, top, size = self.bounds
+        side = size / 2 ** z
+        return left + x * side, top + y * side, side
+
+    def describe(self):
+        """What a client needs to request tiles"""
+        left, top, size = self.bounds
+        root = next((node for node in self.nodes if node[4] & ROOT), None)
+        return {
+            "version": self.version,
+            "tileSize": TILE_SIZE,
+            "maxZoom": self.max_zoom,
+            "bounds": {"x": left, "y": top, "size": size},
+            "root": {"x": root[0], "y": root[1]} if root else None,
+            "nodes": len(self.nodes),
+            "links": len(self.links)
+        }
+
+
+def _defs(theme):
+    gradients = [*GRADIENTS.values(), OTHER_GRADIENT]
+    parts = ['<defs>']
+    for name, start, end in gradients:
+        parts.append(f'<linearGradient id="{name}-gradient" x1="0%" y1="0%" x2="100%" y2="100%">'
+                     f'<stop offset="0%" stop-color="{start}"/><stop offset="100%" stop-color="{end}"/></linearGradient>')
+    parts.append('</defs>')
+    colors = THEMES[theme]
+    text_stroke = (f' stroke="{colors["textStroke"]}" stroke-width="4" paint-order="stroke" stroke-linejoin="round"'
+                   if colors["textStroke"] else '')
+    # Shared styles as attributes on groups, which every SVG viewer understands
+    return ''.join(parts), {
+        "parentChild": f'<g fill="none" stroke="{colors["parentChild"]}" stroke-width="2" opacity="0.6">',
+        "spouse": f'<g fill="none" stroke="{colors["spouse"]}" stroke-width="2.5" stroke-dasharray="5,5" opacity="0.6">',
+        "nodes": '<g font-family="Outfit, Segoe UI, sans-serif" text-anchor="middle">',
+        "label": f'<text y="{NODE_RADIUS + 55}" font-size="13" font-weight="600" fill="{colors["text"]}"{text_stroke}>',
+    }
+
+
+def _initials(name):
+    return ''.join(part[:1] for part in name.split(' ')).upper()[:2]
+
+
+def _path(kind, sx, sy, tx, ty):
+    if kind == "parentChild":
+        # Elbow: down to halfway, across, down to the child
+        return f'<path d="M{_n(sx)},{_n(sy)}V{_n((sy + ty) / 2)}H{_n(tx)}V{_n(ty)}"/>'
+    mid_x = (sx + tx) / 2
+    return f'<path d="M{_n(sx)},{_n(sy)}C{_n(mid_x)},{_n(sy)} {_n(mid_x)},{_n(ty)} {_n(tx)},{_n(ty)}"/>'
+
+
+def _node(node, styles):
+    """Full-detail markup of one node, as renderTree draws it"""
+    x, y, name, gender, flags = node
+    gradient = GRADIENTS.get(gender, OTHER_GRADIENT)[0]
+    radius = NODE_RADIUS + 10 if flags & ROOT else NODE_RADIUS
+    stroke = '#ff6b6b' if flags & COLLAPSED else '#ffd700' if flags & ROOT else '#fff'
+    circle = (f'<circle r="{radius}" fill="url(#{gradient}-gradient)" stroke="{stroke}" '
+              f'stroke-width="{5 if flags & ROOT else 3}"' + (' stroke-dasharray="5,5"/>' if flags & COLLAPSED else '/>'))
+    button = ''
+    if flags & HAS_CHILDREN:
+        collapsed = flags & COLLAPSED
+        button = (f'<g transform="translate({NODE_RADIUS - 5},{-(NODE_RADIUS - 5)})">'
+                  f'<rect x="-6" y="-6" width="12" height="12" rx="3" fill="{"#4CAF50" if collapsed else "#FF5722"}" '
+                  f'stroke="#fff" stroke-width="1"/><text dy="3.5" font-size="10" fill="white">'
+                  f'{"+" if collapsed else "−"}</text></g>')
+    return (f'<g transform="translate({_n(x)},{_n(y)})">{circle}{button}'
+            f'<g transform="translate(0,{NODE_RADIUS + 25})"><circle r="15" fill="#f0f0f0" stroke="#ccc" stroke-width="1"/>'
+            f'<text dy="4.5" font-size="12" fill="#666">{escape(_initials(name))}</text></g>'
+            f'{styles["label"]}{escape(name)}</text></g>')
+
+
+def _items(scene, items, styles, scale):
+    """Markup for the given scene items, at the detail that `scale` pixels per world unit allows"""
+    link_count = len(scene.links)
+    parts = []
+    for kind in ("parentChild", "spouse"):
+        paths = [_path(*scene.links[item]) for item in items
+                 if item < link_count and scene.links[item][0] == kind]
+        if paths:
+            parts.append(styles[kind] + ''.join(paths) + '</g>')
+    nodes = [scene.nodes[item - link_count] for item in items if item >= link_count]
+    if not nodes:
+        return parts
+    parts.append(styles["nodes"])
+    if scale >= FULL_DETAIL:
+        parts.extend(_node(node, styles) for node in nodes)
+    else:
+        for x, y, _, gender, flags in nodes:
+            gradient = GRADIENTS.get(gender, OTHER_GRADIENT)[0]
+            parts.append(f'<circle cx="{_n(x)}" cy="{_n(y)}" r="{NODE_RADIUS + 10 if flags & ROOT else NODE_RADIUS}" '
+                         f'fill="url(#{gradient}-gradient)"/>')
+    parts.append('</g>')
+    return parts
+
+
+def _density(scene, items, left, top, side, theme):
+    """One square per occupied cell of a DENSITY_CELL-pixel grid, darker where more people are"""
+    link_count = len(scene.links)
+    cell = side * DENSITY_CELL / TILE_SIZE
+    counts = {}
+    for item in items:
+        if item >= link_count:
+            x, y = scene.nodes[item - link_count][:2]
+            key = (int((x - left) // cell), int((y - top) // cell))
+            counts[key] = counts.get(key, 0) + 1
+    color = THEMES[theme]["parentChild"]
+    parts = [f'<g fill="{color}">']
+    for (column, row), count in sorted(counts.items()):
+        parts.append(f'<rect x="{_n(left + column * cell)}" y="{_n(top + row * cell)}" width="{_n(cell)}" '
+                     f'height="{_n(cell)}" opacity="{min(1, 0.3 + 0.1 * count):.1f}"/>')
+    parts.append('</g>')
+    return parts
+
+
+def render_tile(scene, z, x, y, theme="light"):
+    """One TILE_SIZE-pixel SVG tile as bytes; raises ValueError if there is no such tile"""
+    left, top, side = scene.tile_box(z, x, y)
+    scale = TILE_SIZE / side
+    items = scene.index.query(left, top, left + side, top + side)
+    defs, styles = _defs(theme)
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{TILE_SIZE}" height="{TILE_SIZE}" '
+             f'viewBox="{_n(left)} {_n(top)} {_n(side)} {_n(side)}">', defs,
+             f'<rect x="{_n(left)}" y="{_n(top)}" width="{_n(side)}" height="{_n(side)}" '
+             f'fill="{THEMES[theme]["background"]}"/>']
+    if scale >= LINK_DETAIL:
+        parts.extend(_items(scene, items, styles, scale))
+    else:
+        parts.extend(_density(scene, items, left, top, side, theme))
+    parts.append('</svg>')
+    return ''.join(parts).encode('utf-8')
+
+
+def write_svg(scene, write, theme="light", batch=2000):
+    """Write the whole view as one SVG through write(bytes), `batch` items at a time"""
+    left, top, size = scene.bounds
+    defs, styles = _defs(theme)
+    write((f'<?xml version="1.0" encoding="UTF-8"?>\n'
+           f'<svg xmlns="http://www.w3.org/2000/svg" width="{_n(size)}" height="{_n(size)}" '
+           f'viewBox="{_n(left)} {_n(top)} {_n(size)} {_n(size)}">{defs}'
+           f'<rect x="{_n(left)}" y="{_n(top)}" width="{_n(size)}" height="{_n(size)}" '
+           f'fill="{THEMES[theme]["background"]}"/>\n').encode('utf-8'))
+    total = len(scene.links) + len(scene.nodes)
+    for start in range(0, total, batch):
+        items = range(start, min(start + batch, total))
+        write((''.join(_items(scene, items, styles, FULL_DETAIL)) + '\n').encode('utf-8'))
+    write(b'</svg>\n')
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Synthetic Trees
+Family trees in the family1.json schema, generated generation by generation
+for benchmarks and load tests
+
+Founding couples have children, the children marry (people from outside the
+tree, or with some probability each other: pedigree collapse), some remarry
+and have children with their new spouse as well, and so on down the
+generations. Records are produced as they are made and only the youngest
+generation is kept, so a tree of millions of people can be written out without
+holding all of it in memory.
+
+Run `python3 synthetic.py --generations 10 --children 3 --out big.json`.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+GIVEN = {
+    "M": ["Ramesh", "Kartik", "Bhushan", "Sanjay", "Vinod", "Ashok", "Sudhir", "Ajay", "Rakesh", "Deepak",
+          "Sunil", "Vikas", "Anil", "Pranav", "Krish", "Kunal", "Amit", "Mahesh", "Jagdish", "Ravindra"],
+    "F": ["Aneeta", "Veena", "Rani", "Anita", "Geeta", "Mohini", "Asha", "Meera", "Sunita", "Rachna",
+          "Renu", "Ritu", "Neha", "Sana", "Jaya", "Meena", "Santosh", "Bhoomi", "Saroj", "Vanshika"]
+}
+SURNAMES = ["Hakim", "Sapru", "Koul", "Dhar", "Raina", "Razdan", "Fotedar", "Bhagat", "Pandita", "Bamzai",
+            "Chrungoo", "Pishen", "Jalali", "Saraf", "Kak", "Zutshi", "Kachru", "Wali", "Tikku", "Bhat"]
+START_YEAR = 1700
+PRESENT = 2025
+
+
+class Generator:
+    """Makes the people and relationships of one synthetic tree
+
+    generations: generations below the founders; children: average children
+    per couple; marriage: chance that someone marries; remarriage: chance
+    that a married person marries again and has more children; collapse:
+    chance that a marriage is between two people already in the tree (making
+    some people their descendants' ancestors twice over); aliases: average
+    aliases per person; founders: founding couples; max_people: stop once
+    the tree has this many people.
+    """
+
+    def __init__(self, generations=6, children=3.0, marriage=0.85, remarriage=0.1, collapse=0.05, aliases=0.5,
+                 founders=1, max_people=None, seed=0):
+        self.generations = generations
+        self.children = children
+        self.marriage = marriage
+        self.remarriage = remarriage
+        self.collapse = collapse
+        self.aliases = aliases
+        self.founders = founders
+        self.max_people = max_people
+        self.rng = random.Random(seed)
+        self.people = 0
+        self.relationships = 0
+
+    def options(self):
+        return {"generations": self.generations, "children": self.children, "marriage": self.marriage,
+                "remarriage": self.remarriage, "collapse": self.collapse, "aliases": self.aliases,
+                "founders": self.founders, "maxPeople": self.max_people}
+
+    def full(self):
+        return self.max_people is not None and self.people >= self.max_people
+
+    def person(self, gender, surname, birth_year):
+        """A new person record"""
+        rng = self.rng
+        aliases = []
+        # A geometric number of aliases, averaging self.aliases
+        while rng.random() < self.aliases / (1 + self.aliases):
+            aliases.append(rng.choice(GIVEN[gender]))
+        lifespan = rng.randint(45, 98)
+        person = {
+            "id": f"p{self.people}",
+            "name": f"{rng.choice(GIVEN[gender])} {surname}",
+            "gender": gender,
+            "aliases": aliases,
+            "birthYear": birth_year,
+            "deathYear": birth_year + lifespan if birth_year + lifespan < PRESENT else None,
+            "notes": None
+        }
+        self.people += 1
+        return person
+
+    def spouse(self, a, b, start_year, end_year=None):
+        self.relationships += 1
+        return {"type": "spouse", "people": [a, b], "startYear": start_year, "endYear": end_year, "notes": None}
+
+    def parent_child(self, parent_id, child_id):
+        self.relationships += 1
+        return {"type": "parentChild", "parentId": parent_id, "childId": child_id, "biological": True, "notes": None}
+
+    def child_count(self):
+        count = int(self.children)
+        count += self.rng.random() < self.children - count
+        return max(0, count + self.rng.choice((-1, 0, 1)))
+
+    def outsider(self, partner, year):
+        """Someone from outside the tree to marry `partner` (a cohort entry)"""
+        gender = "F" if partner["gender"] == "M" else "M"
+        return self.person(gender, self.rng.choice(SURNAMES), partner["birthYear"] + self.rng.randint(-6, 6))
+
+    def records(self):
+        """Yield ("person", record) and ("relationship", record) pairs, every person before their relationships"""
+        rng = self.rng
+        couples = []  # (father, mother) records of the generation having children
+        for _ in range(self.founders):
+            if self.full():
+                return
+            father = self.person("M", rng.choice(SURNAMES), START_YEAR + rng.randint(-5, 5))
+            mother = self.person("F", rng.choice(SURNAMES), father["birthYear"] + rng.randint(-8, 2))
+            yield "person", father
+            yield "person", mother
+            yield "relationship", self.spouse(father["id"], mother["id"], father["birthYear"] + rng.randint(20, 30))
+            couples.append((father, mother))
+
+        for _ in range(self.generations):
+            cohort = []  # children born to this generation's couples, with the couple they came from
+            for number, (father, mother) in enumerate(couples):
+                for _ in range(self.child_count()):
+                    if self.full():
+                        break
+                    gender = rng.choice("MF")
+                    birth_year = max(father["birthYear"], mother["birthYear"]) + rng.randint(20, 40)
+                    child = self.person(gender, father["name"].split(" ", 1)[1], birth_year)
+                    yield "person", child
+                    yield "relationship", self.parent_child(father["id"], child["id"])
+                    yield "relationship", self.parent_child(mother["id"], child["id"])
+                    cohort.append((child, number))
+
+            couples = []
+            married = set()
+            order = list(range(len(cohort)))
+            rng.shuffle(order)
+            for i in order:
+                person, family = cohort[i]
+                if person["id"] in married or rng.random() >= self.marriage:
+                    continue
+                partner = None
+                if rng.random() < self.collapse:
+                    # Marry a cousin (or more distant relative) of the same generation, never a sibling
+                    for _ in range(8):
+                        other, other_family = cohort[rng.randrange(len(cohort))]
+                        if (other_family != family and other["gender"] != person["gender"]
+                                and other["id"] not in married):
+                            partner = other
+                            break
+                if partner is None:
+                    if self.full():
+                        continue
+                    partner = self.outsider(person, person["birthYear"])
+                    yield "person", partner
+                married.update((person["id"], partner["id"]))
+                start = max(person["birthYear"], partner["birthYear"]) + rng.randint(18, 32)
+                end = None
+                if rng.random() < self.remarriage and not self.full():
+                    end = start + rng.randint(3, 20)
+                    second = self.outsider(person, end)
+                    yield "person", second
+                    yield "relationship", self.spouse(person["id"], second["id"], end + rng.randint(1, 5))
+                    couples.append(_couple(person, second))
+                yield "relationship", self.spouse(person["id"], partner["id"], start, end)
+                couples.append(_couple(person, partner))
+            if not couples:
+                return
+
+
+def _couple(a, b):
+    return (a, b) if a["gender"] == "M" else (b, a)
+
+
+def synthetic_tree(seed=0, **options):
+    """A whole generated tree document in memory; see Generator for the options"""
+    generator = Generator(seed=seed, **options)
+    tree = {"meta": _meta(generator), "people": [], "relationships": []}
+    for kind, record in generator.records():
+        tree["people" if kind == "person" else "relationships"].append(record)
+    return tree
+
+
+def _meta(generator):
+    return {"title": "Synthetic Family Tree", "rootPersonId": "p0",
+            "notes": "Generated by synthetic.py: " + json.dumps(generator.options()),
+            "created": "2000-01-01T00:00:00", "modified": "2000-01-01T00:00:00"}
+
+
+def write_tree(path, seed=0, **options):
+    """Generate a tree straight into a JSON file, one record per line; returns (people, relationships)
+
+    People are written as they are made and relationships are spooled to a
+    temporary file, so memory use is bounded by the largest generation.
+    """
+    generator = Generator(seed=seed, **options)
+    directory = os.path.dirname(os.path.abspath(path))
+    with open(path, "w", encoding="utf-8") as out, \
+            tempfile.TemporaryFile("w+", encoding="utf-8", dir=directory) as spool:
+        out.write('{"meta": ' + json.dumps(_meta(generator), ensure_ascii=False) + ',\n"people": [')
+        first_person = first_relationship = True
+        for kind, record in generator.records():
+            line = json.dumps(record, ensure_ascii=False)
+            if kind == "person":
+                out.write(("\n" if first_person else ",\n") + line)
+                first_person = False
+            else:
+                spool.write(("\n" if first_relationship else ",\n") + line)
+                first_relationship = False
+        out.write('\n],\n"relationships": [')
+        spool.seek(0)
+        while True:
+            chunk = spool.read(1 << 20)
+            if not chunk:
+                break
+            out.write(chunk)
+        out.write('\n]}\n')
+    return generator.people, generator.relationships
+
+
+def add_arguments(parser, generations=6):
+    """Generator options, shared with benchmark.py"""
+    parser.add_argument("--generations", type=int, default=generations,
+                        help=f"Generations below the founders (default: {generations})")
+    parser.add_argument("--children", type=float, default=3.0, help="Average children per couple (default: 3)")
+    parser.add_argument("--marriage", type=float, default=0.85, help="Chance that someone marries (default: 0.85)")
+    parser.add_argument("--remarriage", type=float, default=0.1,
+                        help="Chance that a married person remarries and has more children (default: 0.1)")
+    parser.add_argument("--collapse", type=float, default=0.05,
+                        help="Chance that a marriage is between two relatives, for pedigree collapse (default: 0.05)")
+    parser.add_argument("--aliases", type=float, default=0.5, help="Average aliases per person (default: 0.5)")
+    parser.add_argument("--founders", type=int, default=1, help="Founding couples (default: 1)")
+    parser.add_argument("--people", type=int, default=None, help="Stop once the tree has this many people")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed; the same options and seed give the same tree")
+
+
+def generator_options(args):
+    return {"generations": args.generations, "children": args.children, "marriage": args.marriage,
+            "remarriage": args.remarriage, "collapse": args.collapse, "aliases": args.aliases,
+            "founders": args.founders, "max_people": args.people, "seed": args.seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic family tree in the family1.json schema")
+    add_arguments(parser)
+    parser.add_argument("--out", default="synthetic.json", help="Tree file to write (default: synthetic.json)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    people, relationships = write_tree(args.out, **generator_options(args))
+    seconds = time.perf_counter() - started
+    print(f"🌳 Wrote {people:,} people and {relationships:,} relationships to {args.out} "
+          f"in {seconds:.1f}s ({os.path.getsize(args.out) / 1e6:,.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
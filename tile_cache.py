@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Tile Cache
+Rendered SVG tiles kept on disk, one directory per tree version and content
+hash, so a tile is drawn once per version and an edit (or a hand edit of the
+file that kept the version number) invalidates every tile at once
+"""
+
+import os
+import shutil
+import threading
+
+
+class TileCache:
+    """<directory>/v<version>-<digest>/<view>/<z>/<x>/<y>.svg
+
+    digest is a hash of the tree's content. Only the newest tree seen is kept:
+    the first tile written for a new version or digest removes the
+    directories of all others, and late renders of an older version are not
+    stored.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._version = None  # (version, digest) of the tiles on disk
+
+    def path(self, version, digest, view, z, x, y):
+        return os.path.join(self.directory, f"v{version}-{digest}", view, str(z), str(x), f"{y}.svg")
+
+    def get(self, version, digest, view, z, x, y):
+        """A stored tile's bytes, or None"""
+        try:
+            with open(self.path(version, digest, view, z, x, y), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, version, digest, view, z, x, y, body):
+        """Store a tile, atomically so readers never see part of one"""
+        if not self._advance(version, digest):
+            return
+        path = self.path(version, digest, view, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(body)
+        os.replace(temp_path, path)
+
+    def _advance(self, version, digest):
+        """Make `version` the kept one, removing other tiles; False if it is already outdated"""
+        with self._lock:
+            if self._version is not None and version < self._version[0]:
+                return False
+            if self._version == (version, digest):
+                return True
+            self._version = (version, digest)
+        keep = f"v{version}-{digest}"
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name != keep:
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        return True
+
@@ -14,6 +14,13 @@ const nodeRadius = 25;
 const horizontalSpacing = 200;
 const verticalSpacing = 150;
 
+// Trees at least this large are laid out by the server (/api/layout) when it has the same version
+const serverLayoutMinPeople = 2000;
+// From this size on the server draws the tree too, as SVG tiles (/api/tiles) loaded as the view moves
+const tiledViewMinPeople = 20000;
+let layoutRequest = 0; // Bumped on every render so a late server layout never replaces a newer one
+let tiledView = false; // Whether the tree on screen is made of server-drawn tiles
+
 // Initialize visualization
 async function init() {
     try {
@@ -590,7 +597,8 @@ function calculatePositions(root) {
 
         nodes.forEach((node, index) => {
             const x = startX + index * horizontalSpacing;
-            positions[node.id] = { x, y, node, generation: generationMap[node.id] };
+            const hasChildren = !!(node.children && node.children.length > 0);
+            positions[node.id] = { x, y, node, generation: generationMap[node.id], hasChildren };
         });
     });
 
@@ -599,6 +607,170 @@ function calculatePositions(root) {
 
 // Render the tree
 function renderTree() {
+    const request = ++layoutRequest;
+    tiledView = false;
+    if (useServerLayout() && treeData.people.length >= tiledViewMinPeople) {
+        renderTiles(request);
+    } else if (useServerLayout()) {
+        renderServerLayout(request);
+    } else {
+        renderLocalLayout();
+    }
+}
+
+// Whether the server can lay out exactly the tree shown: large, served over HTTP and without unsaved edits
+function useServerLayout() {
+    return location.protocol.startsWith('http') &&
+        treeData.people.length >= serverLayoutMinPeople &&
+        typeof treeVersion !== 'undefined' && treeVersion !== null &&
+        treeData.meta.modified === savedModified;
+}
+
+// Query parameters naming the current view, as /api/layout, /api/tiles and /api/export.svg take them
+function viewParams() {
+    const params = new URLSearchParams({ root: rootPersonId, mode: showExtendedFamily ? 'extended' : 'descendants' });
+    if (!showExtendedFamily && directDescendantsOf) params.set('focus', directDescendantsOf);
+    if (collapsedNodes.size > 0) params.set('collapsed', [...collapsedNodes].join(','));
+    return params;
+}
+
+function currentTheme() {
+    return document.documentElement.getAttribute('data-theme') === 'dark' ? 'dark' : 'light';
+}
+
+// Fetch positions from /api/layout, falling back to the local layout if anything goes wrong
+async function renderServerLayout(request) {
+    const params = viewParams();
+
+    try {
+        console.log('Fetching layout from server...');
+        const response = await fetch(`api/layout?${params}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const layout = await response.json();
+        if (request !== layoutRequest) return; // A newer render has started
+        if (layout.version !== treeVersion) {
+            throw new Error(`server is at version ${layout.version}, the page at ${treeVersion}`);
+        }
+
+        const positions = {};
+        Object.entries(layout.positions).forEach(([id, p]) => {
+            positions[id] = {
+                x: p.x,
+                y: p.y,
+                generation: p.generation,
+                hasChildren: p.hasChildren,
+                node: { ...peopleMap[id], level: p.level, generation: p.generation }
+            };
+        });
+        console.log('Positions received:', Object.keys(positions).length, 'nodes');
+        drawTree(positions);
+    } catch (error) {
+        if (request !== layoutRequest) return;
+        console.warn('Server layout unavailable, laying out locally:', error.message);
+        renderLocalLayout();
+    }
+}
+
+// Show the tree as server-drawn SVG tiles, falling back to drawing it from server positions
+async function renderTiles(request) {
+    const params = viewParams();
+    params.set('theme', currentTheme());
+
+    try {
+        console.log('Fetching tile grid from server...');
+        const response = await fetch(`api/tiles?${params}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const grid = await response.json();
+        if (request !== layoutRequest) return; // A newer render has started
+        if (grid.version !== treeVersion) {
+            throw new Error(`server is at version ${grid.version}, the page at ${treeVersion}`);
+        }
+        tiledView = true;
+        drawTiles(grid);
+    } catch (error) {
+        if (request !== layoutRequest) return;
+        console.warn('Tiles unavailable, drawing nodes instead:', error.message);
+        renderServerLayout(request);
+    }
+}
+
+// Keep the tiles covering the visible area loaded, at the zoom level closest to the current scale
+function drawTiles(grid) {
+    d3.select('#tree-svg').selectAll('*').remove();
+    const svg = d3.select('#tree-svg')
+        .attr('width', '100%')
+        .attr('height', '100%');
+    const g = svg.append('g').attr('class', 'tile-layer');
+    const { x: left, y: top, size } = grid.bounds;
+    const shown = new Map(); // "z/x/y" -> image element
+
+    function updateTiles(transform) {
+        const z = Math.max(0, Math.min(grid.maxZoom, Math.round(Math.log2(size * transform.k / grid.tileSize))));
+        const side = size / 2 ** z;
+        const last = 2 ** z - 1;
+        const container = svg.node().getBoundingClientRect();
+        const [x0, y0] = transform.invert([0, 0]);
+        const [x1, y1] = transform.invert([container.width, container.height]);
+        const wanted = new Set();
+
+        for (let tx = Math.max(0, Math.floor((x0 - left) / side)); tx <= Math.min(last, Math.floor((x1 - left) / side)); tx++) {
+            for (let ty = Math.max(0, Math.floor((y0 - top) / side)); ty <= Math.min(last, Math.floor((y1 - top) / side)); ty++) {
+                const key = `${z}/${tx}/${ty}`;
+                wanted.add(key);
+                if (!shown.has(key)) {
+                    shown.set(key, g.append('image')
+                        .attr('href', grid.url.replace('{z}/{x}/{y}', key))
+                        .attr('x', left + tx * side)
+                        .attr('y', top + ty * side)
+                        .attr('width', side)
+                        .attr('height', side));
+                }
+            }
+        }
+        shown.forEach((image, key) => {
+            if (!wanted.has(key)) {
+                image.remove();
+                shown.delete(key);
+            }
+        });
+    }
+
+    const zoom = d3.zoom()
+        .scaleExtent([Math.min(0.1, grid.tileSize / size), 4]) // Zoom out far enough to see the whole tree
+        .on('zoom', (event) => {
+            g.attr('transform', event.transform);
+            currentZoomTransform = event.transform;
+            updateZoomDisplay(event.transform.k);
+            updateTiles(event.transform);
+        });
+    svg.call(zoom);
+
+    const root = grid.root || { x: left + size / 2, y: top + size / 2 };
+    const initialTransform = d3.zoomIdentity
+        .translate(width / 2, height / 2)
+        .scale(0.45)
+        .translate(-root.x, -root.y);
+    svg.call(zoom.transform, initialTransform);
+    currentZoomTransform = initialTransform;
+
+    svg.on('dblclick.zoom', null)
+      .on('dblclick', () => {
+          svg.transition()
+              .duration(750)
+              .call(zoom.transform, initialTransform);
+          currentZoomTransform = initialTransform;
+      });
+
+    initZoomControls(zoom, svg);
+    console.log(`Showing ${grid.nodes} people as tiles, zoom levels 0-${grid.maxZoom}`);
+}
+
+// Lay the tree out in the browser
+function renderLocalLayout() {
     console.log('Building tree structure...');
     const root = buildTreeStructure();
     if (!root) {
@@ -610,9 +782,13 @@ function renderTree() {
     }
 
     console.log('Tree structure built, calculating positions...');
-    const { positions, generationMap } = calculatePositions(root);
+    const { positions } = calculatePositions(root);
     console.log('Positions calculated:', Object.keys(positions).length, 'nodes');
+    drawTree(positions);
+}
 
+// Draw nodes and links at the given positions ({ personId: { x, y, node, generation, hasChildren } })
+function drawTree(positions) {
     if (Object.keys(positions).length === 0) {
         console.error('No positions calculated - tree might be empty');
         document.getElementById('loading').textContent = 'Error: No nodes to display. Check if family tree data is correct.';
@@ -745,7 +921,7 @@ function renderTree() {
     }
 
     // Draw nodes
-    Object.values(positions).forEach(({ x, y, node }, index) => {
+    Object.values(positions).forEach(({ x, y, node, hasChildren }, index) => {
         // Get person data - could be from node or peopleMap
         let person = peopleMap[node.id];
         if (!person && node.name) {
@@ -881,7 +1057,6 @@ function renderTree() {
             .attr('stroke-dasharray', collapsedNodes.has(person.id) ? '5,5' : 'none'); // Dashed border for collapsed nodes
 
         // Add +/- button for collapsible branches if node has children
-        const hasChildren = node.children && node.children.length > 0;
         if (hasChildren) {
             const buttonSize = 12;
             const buttonGroup = nodeContent.append('g')
@@ -1696,6 +1871,19 @@ console.log('Document ready state:', document.readyState);
 
 // Generate PNG Functionality
 async function generatePNG() {
+    // Rasterizing a large tree in the browser runs out of memory; let the server stream it as SVG
+    if (useServerLayout()) {
+        const params = viewParams();
+        params.set('theme', currentTheme());
+        const a = document.createElement('a');
+        a.download = `family-tree-${new Date().toISOString().slice(0, 10)}.svg`;
+        a.href = `api/export.svg?${params}`;
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+        return;
+    }
+
     const svgElement = document.getElementById('tree-svg');
     const { width, height } = svgElement.getBoundingClientRect();
 
@@ -1783,6 +1971,7 @@ function initTheme() {
         document.documentElement.setAttribute('data-theme', newTheme);
         localStorage.setItem('family-tree-theme', newTheme);
         updateThemeIcon(newTheme, themeIcon);
+        if (tiledView) renderTree(); // Tiles are drawn in the theme's colors
     });
 }
 
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Tree Pool
+Many family trees in one directory, each loaded on first use into its own TreeStore
+and evicted least recently used first when memory or idle limits are reached
+
+Each tree keeps its own read/write lock, so saving one tree never blocks
+requests for another. Requests hold a lease on a tree while they use it, and
+a leased tree is never evicted.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from storage import SQLITE_EXTENSIONS
+from tree_store import TreeStore
+
+TREE_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+EXTENSIONS = ('.json',) + tuple(SQLITE_EXTENSIONS)
+MAX_BYTES = 1024 * 1024 * 1024
+MAX_IDLE = 30 * 60  # seconds
+
+
+class TreePool:
+    def __init__(self, directory, max_bytes=MAX_BYTES, max_idle=MAX_IDLE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_idle = max_idle
+        self.evictions = 0
+        self._stores = OrderedDict()  # name -> TreeStore, least recently used first
+        self._last_used = {}
+        self._leases = {}  # name -> requests currently using the tree
+        self._closing = {}  # name -> Event set once an evicted store has been closed
+        self._lock = threading.Lock()
+
+    def path_for(self, name):
+        """File holding a tree, or None if there is no such tree"""
+        if not TREE_NAME.match(name):
+            return None
+        for extension in EXTENSIONS:
+            path = os.path.join(self.directory, name + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def names(self):
+        """Every tree in the directory, loaded or not"""
+        names = set()
+        for filename in os.listdir(self.directory):
+            name, extension = os.path.splitext(filename)
+            if extension in EXTENSIONS and TREE_NAME.match(name):
+                names.add(name)
+        return sorted(names)
+
+    def acquire(self, name, create=False):
+        """Lease a tree's store, opening it if needed; pair every call with release()
+
+        Raises KeyError for an unknown tree, unless create is set and the name
+        is valid, in which case the store is opened on a new .json file.
+        """
+        while True:
+            with self._lock:
+                closing = self._closing.get(name)
+                if closing is None:
+                    store = self._stores.get(name)
+                    if store is None:
+                        path = self.path_for(name)
+                        if path is None:
+                            if not (create and TREE_NAME.match(name)):
+                                raise KeyError(name)
+                            path = os.path.join(self.directory, name + '.json')
+                        store = TreeStore(path)
+                        store.start_compactor()
+                        self._stores[name] = store
+                    self._stores.move_to_end(name)
+                    self._leases[name] = self._leases.get(name, 0) + 1
+                    self._last_used[name] = time.monotonic()
+                    return store
+            closing.wait()  # An evicted copy is still writing out its journal
+
+    def release(self, name):
+        with self._lock:
+            self._leases[name] -= 1
+            if not self._leases[name]:
+                del self._leases[name]
+            self._last_used[name] = time.monotonic()
+        self.trim()
+
+    def loaded(self):
+        """(name, store) for every tree currently held, least recently used first"""
+        with self._lock:
+            return list(self._stores.items())
+
+    def footprint(self):
+        return sum(store.footprint() for _, store in self.loaded())
+
+    def trim(self):
+        """Evict trees nobody is using that have been idle too long, then more while over the memory limit"""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            sizes = {name: store.footprint() for name, store in self._stores.items()}
+            total = sum(sizes.values())
+            for name in list(self._stores):
+                if name in self._leases:
+                    continue
+                if total > self.max_bytes or now - self._last_used[name] > self.max_idle:
+                    evicted.append((name, self._stores.pop(name)))
+                    self._closing[name] = threading.Event()
+                    del self._last_used[name]
+                    total -= sizes[name]
+                    self.evictions += 1
+        for name, store in evicted:
+            try:
+                store.close()
+                print(f"📤 Unloaded tree {name} ({sizes[name] / 1e6:,.1f} MB)")
+            except Exception as e:
+                print(f"❌ Error unloading tree {name}: {e}")
+            finally:
+                with self._lock:
+                    self._closing.pop(name).set()
+        return len(evicted)
+
+    def close(self):
+        """Write out and release every loaded tree"""
+        with self._lock:
+            stores = list(self._stores.values())
+            self._stores.clear()
+        for store in stores:
+            store.close()
+
+    def start_janitor(self, interval=60):
+        """Evict idle trees from a background thread"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.trim()
+                except Exception as e:
+                    print(f"❌ Error unloading idle trees: {e}")
+
+        thread = threading.Thread(target=run, name="tree-janitor", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,833 @@
+#!/usr/bin/env python3
+"""
+Tree Store
+In-memory copy of the family tree document kept alongside its adjacency index,
+with edits persisted through a pluggable storage backend
+"""
+
+import gc
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from analytics import tree_stats
+from cache import LRUCache
+from change_feed import ChangeFeed
+from family_graph import FamilyGraph
+from history import History
+from kinship import KinshipIndex
+from layout import LayoutEngine
+from search_index import SearchIndex
+from storage import open_storage
+from svg_render import Scene
+from tile_cache import TileCache
+from validation import ValidationError, check_new_edge, errors_only, validate_tree
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Optional: only gzip variants are served without it
+
+PERSON_FIELDS = ("name", "gender", "aliases", "birthYear", "deathYear", "notes")
+# What each person field may hold, as checked before an edit is journaled
+FIELD_TYPES = {
+    "name": "a non-empty string",
+    "gender": "a string or null",
+    "aliases": "a list of strings",
+    "birthYear": "an integer or null",
+    "deathYear": "an integer or null",
+    "notes": "a string or null",
+}
+# Measured memory for one record in the tree document plus its FamilyGraph entries
+PERSON_BYTES = 850
+RELATIONSHIP_BYTES = 570
+SEARCH_BYTES = 2500  # per person, once the search index is built
+# Recompressed on every version: the default (11) costs seconds on a large tree for a few percent
+BROTLI_QUALITY = 5
+
+
+def _etag(body):
+    """Quoted content hash of a serialized tree"""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def _field_fits(key, value):
+    """Whether a person field holds a value of the type in FIELD_TYPES"""
+    if key == "name":
+        return isinstance(value, str) and bool(value.strip())
+    if key == "aliases":
+        return isinstance(value, list) and all(isinstance(alias, str) for alias in value)
+    if key in ("birthYear", "deathYear"):
+        return value is None or (isinstance(value, int) and not isinstance(value, bool))
+    return value is None or isinstance(value, str)
+
+
+def _check_fields(fields):
+    """Raise ValueError for the first person field with the wrong type"""
+    for key, value in fields.items():
+        if key in FIELD_TYPES and not _field_fits(key, value):
+            raise ValueError(f"{key} must be {FIELD_TYPES[key]}")
+
+
+def _edges_by_pair(relationships):
+    """(type, one end, other end) -> relationship, or a list of them for an edge that is repeated"""
+    edges = {}
+    for rel in relationships:
+        if rel.get("type") == "parentChild":
+            key = ("parentChild", rel.get("parentId"), rel.get("childId"))
+        else:
+            people = rel.get("people")
+            a, b = people if isinstance(people, list) and len(people) == 2 else (None, None)
+            key = (rel.get("type"), a, b) if str(a) <= str(b) else (rel.get("type"), b, a)
+        found = edges.get(key)
+        if found is None:
+            edges[key] = rel
+        else:
+            edges[key] = found + [rel] if isinstance(found, list) else [found, rel]
+    return edges
+
+
+def changes_between(old, new):
+    """The /api/changes edits that turn tree `old` into tree `new`, or None
+
+    Relationships are compared per pair of people: if anything about a pair
+    changed, its edge is deleted and its new records added again. Returns
+    None when the edits would outnumber half the new tree's records, since
+    fetching the tree is then cheaper than replaying them.
+    """
+    changes = []
+    old_people = {person["id"]: person for person in old["people"]}
+    new_people = {person["id"]: person for person in new["people"]}
+    old_edges, new_edges = _edges_by_pair(old["relationships"]), _edges_by_pair(new["relationships"])
+    limit = (len(new["people"]) + len(new["relationships"])) // 2
+
+    for key, rel in old_edges.items():
+        if new_edges.get(key) != rel:
+            changes.append({"op": "deleteRelationship", "relationship": rel[0] if isinstance(rel, list) else rel})
+    changes += [{"op": "deletePerson", "id": person_id} for person_id in old_people if person_id not in new_people]
+    for person_id, person in new_people.items():
+        before = old_people.get(person_id)
+        if before is None:
+            changes.append({"op": "addPerson", "person": person})
+        elif before != person:
+            changes.append({"op": "updatePerson", "id": person_id, "fields": {
+                key: person.get(key) for key in before.keys() | person.keys()
+                if key != "id" and before.get(key) != person.get(key)}})
+        if len(changes) > limit:
+            return None
+    for key, rel in new_edges.items():
+        if old_edges.get(key) != rel:
+            changes += [{"op": "addRelationship", "relationship": r} for r in (rel if isinstance(rel, list) else [rel])]
+    fields = {key: new["meta"].get(key) for key in old["meta"].keys() | new["meta"].keys()
+              if key != "version" and old["meta"].get(key) != new["meta"].get(key)}
+    if fields:
+        changes.append({"op": "updateMeta", "fields": fields})
+    return changes if len(changes) <= limit else None
+
+
+class VersionConflict(Exception):
+    """Raised when a write was based on a version of the tree that is no longer current"""
+
+    def __init__(self, expected, current):
+        self.expected = expected
+        self.current = current
+        super().__init__(f"The tree was changed by someone else (now at version {current}, "
+                         f"not {expected}); reload it and try again")
+
+
+class ReadWriteLock:
+    """Many concurrent readers or one writer; waiting writers hold off new readers
+
+    Both sides are re-entrant per thread, and the writing thread may also read.
+    A thread holding only a read lock must not ask for the write lock.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = None
+        self._write_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        held = getattr(self._local, 'reads', 0)
+        with self._cond:
+            if self._writer != me and not held:
+                while self._writer is not None or self._writers_waiting:
+                    self._cond.wait()
+                self._readers += 1
+        self._local.reads = held + 1
+
+    def release_read(self):
+        self._local.reads -= 1
+        if self._local.reads:
+            return
+        with self._cond:
+            if self._writer != threading.get_ident():
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            self._writers_waiting += 1
+            while self._writer is not None or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._write_depth -= 1
+            if not self._write_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def reading(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def writing(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class TreeStore:
+    def __init__(self, path, compact_every=500, compact_interval=30, storage=None):
+        self.path = path
+        self.storage = storage or open_storage(path)
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+        self.tree = None
+        self.graph = None
+        self.token = None  # storage token at the last load or write
+        self.revision = 0  # bumped on every in-memory change
+        self.feed = ChangeFeed()  # one event per version, for /api/events
+        self._payload = None  # serialized variants of the current revision
+        self._etag = None  # (revision, ETag, version) when asked for before the payload was built
+        self._search = None  # name/alias index, built on the first search
+        self._kinship = None  # ancestry index, built on the first kinship query
+        self._layout = None  # cached node positions per view, built on the first layout request
+        self._stats = None  # (revision, aggregate statistics), built on the first stats request
+        self._scenes = LRUCache(maxsize=4)  # drawable views for tiles and SVG export
+        self.tiles = TileCache(path + ".tiles")
+        self.history = History(path + ".history")  # every saved version, as shared chunks
+        self.lock = ReadWriteLock()
+        self._compact_lock = threading.Lock()
+        self._search_lock = threading.Lock()
+        self._kinship_lock = threading.Lock()
+        self._layout_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+
+    def _stale(self):
+        """Whether the tree is unloaded or another process changed the stored data"""
+        token = self.storage.token()
+        return self.tree is None or (token is not None and token != self.token)
+
+    def ensure_loaded(self):
+        """Load the tree, re-reading it if the stored data changed"""
+        if self._stale():
+            with self.lock.writing():
+                if self._stale():
+                    self.load()
+
+    def get(self):
+        """Return the loaded tree without holding any lock"""
+        self.ensure_loaded()
+        return self.tree
+
+    @contextmanager
+    def read(self):
+        """Hold a shared lock on the loaded tree, yielding (tree, graph)"""
+        self.ensure_loaded()
+        with self.lock.reading():
+            yield self.tree, self.graph
+
+    @property
+    def version(self):
+        """Persisted change counter: bumped by every edit, save and import"""
+        if self.tree is None:
+            return 0
+        version = self.tree["meta"].get("version")
+        return version if isinstance(version, int) else 0
+
+    def check_version(self, expected):
+        """Raise VersionConflict unless expected is None or the current version"""
+        if expected is not None and expected != self.version:
+            raise VersionConflict(expected, self.version)
+
+    def load(self):
+        """Read the stored tree and replay any edits recorded after its snapshot
+
+        A version the history does not have yet is added to it, so the tree
+        as first loaded can always be restored. A file edited by hand without
+        changing its version number is added as a new version.
+        """
+        with self.lock.writing():
+            previous = self.version if self.tree is not None else None
+            tree, changes = self.storage.read()
+            self.replace(tree)
+            self.token = self.storage.token()
+            # A compaction that crashed after writing the snapshot but before dropping
+            # the journal leaves entries the snapshot already contains
+            snapshot_version = self.version
+            changes = [change for change in changes
+                       if not isinstance(change.get("version"), int) or change["version"] > snapshot_version]
+            for change in changes:
+                self._apply(change)
+                self._invalidate()
+            if changes:
+                print(f"♻️  Replayed {len(changes)} journaled changes onto {self.path}")
+            snapshot = self.history.chunk(self.tree)
+            same = self.history.same(self.version, snapshot)
+            if same is False:
+                # Edited by hand without changing the version: the history already has
+                # other content under this number, so this is the newest version or a new one
+                latest = self.history.latest()
+                if self.history.same(latest, snapshot):
+                    self.tree["meta"]["version"] = latest
+                else:
+                    self.tree["meta"]["version"] = max(self.version, latest) + 1
+                    print(f"✏️  {self.path} was edited by hand; recording it as version {self.version}")
+            if previous is not None:
+                # Changed by another process: move past every version clients may hold
+                self.tree["meta"]["version"] = max(self.version, previous + 1)
+                self.feed.publish({"version": self.version, "type": "replace"})
+            if not self.history.same(self.version, snapshot):
+                self._record(snapshot, self.tree["meta"])
+
+    def replace(self, tree, graph=None):
+        """Swap in a new tree document and its index"""
+        graph = graph or FamilyGraph.from_tree(tree)
+        with self.lock.writing():
+            self.tree = tree
+            self.graph = graph
+            self._search = None
+            self._kinship = None
+            self._layout = None
+            self._scenes.clear()
+            self._invalidate()
+
+    def save(self, tree, timings=None, expected_version=None):
+        """Atomically replace the snapshot with a whole new document
+
+        Raises ValidationError if the document has errors, and VersionConflict
+        if expected_version is given and is not the current version; returns
+        the warnings otherwise. The saved document gets the next version and is
+        added to the history. The change feed gets the edits that lead from
+        the previous tree to this one as a single "changes" event, so clients
+        can patch their copy instead of fetching the whole tree. Seconds spent
+        validating, indexing, chunking for the history, diffing, waiting for
+        the lock, writing and recording the chunks are stored in the timings
+        dict when one is given.
+        """
+        timings = {} if timings is None else timings
+        started = time.perf_counter()
+        issues = validate_tree(tree)  # Checked and indexed before taking the lock
+        timings["validate"] = time.perf_counter() - started
+        if errors_only(issues):
+            raise ValidationError(issues)
+        if not isinstance(tree.setdefault("meta", {}), dict):
+            raise ValueError("Tree meta must be an object")
+        started = time.perf_counter()
+        graph = FamilyGraph.from_tree(tree)
+        timings["index"] = time.perf_counter() - started
+        started = time.perf_counter()
+        snapshot = self.history.chunk(tree)
+        timings["chunk"] = time.perf_counter() - started
+        if self.tree is None and os.path.exists(self.path):
+            self.ensure_loaded()  # The new version has to follow the stored one
+        started = time.perf_counter()
+        with self.lock.reading():  # Readers carry on while the edits are worked out
+            revision = self.revision
+            changes = changes_between(self.tree, tree) if self.tree is not None else None
+        timings["diff"] = time.perf_counter() - started
+        started = time.perf_counter()
+        with self._compact_lock, self.lock.writing():
+            timings["lock"] = time.perf_counter() - started
+            self.check_version(expected_version)
+            if self.revision != revision:
+                changes = None  # Edited in the meantime: the edits were worked out against an older tree
+            tree["meta"]["version"] = self.version + 1
+            started = time.perf_counter()
+            self.storage.write_snapshot(tree)
+            timings["write"] = time.perf_counter() - started
+            started = time.perf_counter()
+            self._record(snapshot, tree["meta"])
+            timings["history"] = time.perf_counter() - started
+            self.replace(tree, graph)
+            self.token = self.storage.token()
+            if changes is None:
+                self.feed.publish({"version": self.version, "type": "replace"})
+            else:
+                self.feed.publish({"version": self.version, "type": "changes", "changes": changes})
+        return issues
+
+    def apply_changes(self, changes, expected_version=None):
+        """Apply a batch of edits all together or not at all
+
+        Each edit gets the next version and is published to the change feed.
+        The whole batch is checked and applied in memory under the write lock,
+        each change against the tree as the earlier ones left it, and only then
+        journaled with a single append_batch. A bad change or a failed write
+        undoes every change in the batch, so readers and the storage see all
+        of it or none. Returns the number applied; raises ValueError for a bad
+        change (its position in the batch is the error's `index`), and
+        VersionConflict if expected_version is given and is not the current
+        version.
+        """
+        self.ensure_loaded()
+        with self.lock.writing():
+            self.check_version(expected_version)
+            applied = []
+            undos = []
+            try:
+                for index, change in enumerate(changes):
+                    try:
+                        self._check(change)
+                    except ValueError as e:
+                        e.index = index
+                        raise
+                    change = dict(change, version=self.version + 1)
+                    undos.append(self._apply(change))
+                    applied.append(change)
+                if applied:
+                    self.storage.append_batch(applied)
+            except BaseException:
+                for undo in reversed(undos):
+                    undo()
+                raise
+            for change in applied:
+                self._invalidate()
+                self.feed.publish({"version": change["version"], "type": "change",
+                                   "change": {k: v for k, v in change.items() if k != "version"}})
+            self.token = self.storage.token()
+            if self.storage.pending >= self.compact_every:
+                self._wake.set()
+            return len(applied)
+
+    def _check(self, change):
+        """Reject a change that cannot be applied to the current tree"""
+        if not isinstance(change, dict):
+            raise ValueError("Each change must be an object")
+        op = change.get("op")
+        people = self.graph.people
+        if op == "addPerson":
+            person = change.get("person")
+            if not isinstance(person, dict) or not person.get("id") or not person.get("name"):
+                raise ValueError("addPerson needs a person with an id and a name")
+            if not isinstance(person["id"], str):
+                raise ValueError("id must be a non-empty string")
+            _check_fields(person)
+            if person["id"] in people:
+                raise ValueError(f"Person already exists: {person['id']}")
+        elif op == "updatePerson":
+            if not isinstance(change.get("id"), str) or change["id"] not in people:
+                raise ValueError(f"Person not found: {change.get('id')}")
+            fields = change.get("fields")
+            if not isinstance(fields, dict) or any(k not in PERSON_FIELDS for k in fields):
+                raise ValueError(f"updatePerson fields must be among {', '.join(PERSON_FIELDS)}")
+            _check_fields(fields)
+        elif op == "deletePerson":
+            if not isinstance(change.get("id"), str) or change["id"] not in people:
+                raise ValueError(f"Person not found: {change.get('id')}")
+        elif op == "addRelationship":
+            issues = check_new_edge(self.graph, change.get("relationship"))
+            if issues:
+                raise ValidationError(issues)
+        elif op == "deleteRelationship":
+            rel = change.get("relationship")
+            if not isinstance(rel, dict):
+                raise ValueError(f"{op} needs a relationship")
+            if rel.get("type") == "parentChild":
+                ids = [rel.get("parentId"), rel.get("childId")]
+            elif rel.get("type") == "spouse" and isinstance(rel.get("people"), list) and len(rel["people"]) == 2:
+                ids = rel["people"]
+            else:
+                raise ValueError("Relationship must be parentChild or a spouse pair")
+            for person_id in ids:
+                if not isinstance(person_id, str) or person_id not in people:
+                    raise ValueError(f"Person not found: {person_id}")
+        elif op == "updateMeta":
+            if not isinstance(change.get("fields"), dict):
+                raise ValueError("updateMeta needs fields")
+            if "version" in change["fields"]:
+                raise ValueError("The version is set by the server")
+        else:
+            raise ValueError(f"Unknown change op: {op}")
+
+    def _apply(self, change):
+        """Apply one already-checked change to the tree and its index
+
+        Returns a function that puts the tree, the index and the metadata
+        back as they were; the search index is dropped instead of unwound.
+        """
+        op = change["op"]
+        tree, graph = self.tree, self.graph
+        meta = dict(tree["meta"])
+        people, relationships = tree["people"], tree["relationships"]
+        restore = None
+        if op in ("addPerson", "deletePerson", "addRelationship", "deleteRelationship"):
+            self._kinship = None
+        if op == "addPerson":
+            person = dict(change["person"])
+            people.append(person)
+            graph.add_person(person)
+            if self._search is not None:
+                self._search.add(person)
+
+            def restore():
+                people.pop()
+                graph.remove_person(person["id"])
+        elif op == "updatePerson":
+            person = graph.people[change["id"]]
+            previous = {k: person[k] for k in change["fields"] if k in person}
+            person.update(change["fields"])
+            if self._search is not None and ("name" in change["fields"] or "aliases" in change["fields"]):
+                self._search.add(person)
+
+            def restore():
+                for k in change["fields"]:
+                    if k in previous:
+                        person[k] = previous[k]
+                    else:
+                        person.pop(k, None)
+        elif op == "deletePerson":
+            person_id = change["id"]
+            person = graph.people.get(person_id)
+            removed = graph.remove_person(person_id)
+            if self._search is not None:
+                self._search.remove(person_id)
+            tree["people"] = [p for p in people if p["id"] != person_id]
+            tree["relationships"] = [
+                rel for rel in relationships
+                if person_id not in (rel.get("parentId"), rel.get("childId"))
+                and person_id not in rel.get("people", ())
+            ]
+            if tree["meta"].get("rootPersonId") == person_id:
+                tree["meta"]["rootPersonId"] = None
+
+            def restore():
+                tree["people"], tree["relationships"] = people, relationships
+                if person is not None:
+                    graph.add_person(person)
+                for rel in removed:
+                    graph.add_relationship(rel)
+        elif op == "addRelationship":
+            rel = dict(change["relationship"])
+            relationships.append(rel)
+            graph.add_relationship(rel)
+
+            def restore():
+                relationships.pop()
+                graph.remove_relationship(rel)
+        elif op == "deleteRelationship":
+            target = change["relationship"]
+            if target.get("type") == "parentChild":
+                indexed = graph.children.get(target.get("parentId"), {}).get(target.get("childId"))
+            else:
+                indexed = graph.spouses.get(target["people"][0], {}).get(target["people"][1])
+            tree["relationships"] = [rel for rel in relationships if not self._same_edge(rel, target)]
+            graph.remove_relationship(target)
+
+            def restore():
+                tree["relationships"] = relationships
+                if indexed is not None:
+                    graph.add_relationship(indexed)
+        elif op == "updateMeta":
+            tree["meta"].update(change["fields"])
+        if "version" in change:
+            tree["meta"]["version"] = change["version"]
+
+        def undo():
+            if restore is not None:
+                restore()
+            tree["meta"].clear()
+            tree["meta"].update(meta)
+            if op != "updateMeta":
+                self._search = None
+            self._kinship = None
+
+        return undo
+
+    @staticmethod
+    def _same_edge(a, b):
+        """Whether two relationships connect the same people in the same way"""
+        if a.get("type") != b.get("type"):
+            return False
+        if a.get("type") == "parentChild":
+            return a.get("parentId") == b.get("parentId") and a.get("childId") == b.get("childId")
+        return set(a.get("people", ())) == set(b.get("people", ()))
+
+    def compact(self):
+        """Fold the journal into a fresh snapshot
+
+        Only a read lock is held, so GETs keep flowing while the snapshot is
+        written; edits wait so nothing lands in the journal being discarded.
+        """
+        with self._compact_lock, self.lock.reading():
+            count = self.storage.pending
+            if not count:
+                return False
+            self.storage.compact(self.tree)
+            self.token = self.storage.token()
+            self._record(self.history.chunk(self.tree), self.tree["meta"])
+            print(f"🗜️  Compacted {count} journaled changes into {self.path}")
+            return True
+
+    def _record(self, snapshot, meta):
+        """Add a chunked tree to the history; failing to is reported, since the tree itself is already stored"""
+        try:
+            self.history.store(snapshot, meta)
+        except sqlite3.Error as e:
+            print(f"❌ Error recording version {meta.get('version', 0)} in {self.history.path}: {e}")
+
+    def start_compactor(self):
+        """Compact in a background thread when the journal grows or goes quiet"""
+        def run():
+            while not self._closed:
+                self._wake.wait(self.compact_interval)
+                self._wake.clear()
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"❌ Error compacting journal: {e}")
+
+        thread = threading.Thread(target=run, name="journal-compactor", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        """Fold the journal into the snapshot, stop the compactor and release the storage
+
+        The store must not be used afterwards.
+        """
+        self._closed = True
+        self._wake.set()
+        self.compact()
+        self.storage.close()
+        self.history.close()
+
+    def footprint(self):
+        """Rough bytes held by the loaded tree, its indexes and cached responses"""
+        tree, graph, payload = self.tree, self.graph, self._payload
+        if tree is None:
+            return 0
+        size = len(graph.people) * PERSON_BYTES + len(tree["relationships"]) * RELATIONSHIP_BYTES
+        if self._search is not None:
+            size += len(graph.people) * SEARCH_BYTES
+        if payload is not None:
+            size += sum(len(body) for body in payload.values() if isinstance(body, bytes))
+        return size
+
+    def neighborhood(self, person_id):
+        """A person's parent, child and spouse ids with those people and the relationships to them
+
+        Returns None if the person is unknown. A SQLite backend answers from
+        its endpoint indexes, which always hold every applied edit, so the
+        tree does not have to be loaded for it.
+        """
+        if hasattr(self.storage, "neighbors"):
+            with self.lock.reading():
+                if self.storage.get_person(person_id) is None:
+                    return None
+                result = self.storage.neighbors(person_id)
+                ids = dict.fromkeys(result["parents"] + result["children"] + result["spouses"])
+                people = [self.storage.get_person(pid) for pid in ids]
+            relationships = result.pop("relationships")
+            return dict(result, people=[person for person in people if person is not None],
+                        relationships=relationships)
+        with self.read() as (tree, graph):
+            if person_id not in graph.people:
+                return None
+            result = graph.neighbors(person_id)
+            # Copies, since edits update people in place once the lock is released
+            result["people"] = [dict(graph.people[pid]) for ids in result.values() for pid in ids
+                                if pid in graph.people]
+            result["relationships"] = [rel for index in (graph.parents, graph.children, graph.spouses)
+                                       for rel in index[person_id].values()]
+            return result
+
+    def search(self, query, limit=10):
+        """Ranked people matching a name or alias query (see SearchIndex.search)"""
+        self.ensure_loaded()
+        while True:
+            with self.lock.reading():
+                if self._search is not None:
+                    return self._search.search(query, limit)
+            # Build the index with no lock held, so reads and writes carry on
+            # meanwhile, and only swap it in if no write came in between (an
+            # edit may have changed a record mid-build); one search builds
+            # while the others wait for it.
+            with self._search_lock:
+                with self.lock.reading():
+                    if self._search is not None:
+                        continue
+                    revision = self.revision
+                    people = list(self.tree["people"])
+                index = SearchIndex.from_people(people)
+                with self.lock.writing():
+                    if self._search is None and self.revision == revision:
+                        self._search = index
+
+    def kinship(self, a, b):
+        """How person a is related to person b (see KinshipIndex.relate)
+
+        Raises KeyError for an unknown person id.
+        """
+        self.ensure_loaded()
+        while True:
+            with self.lock.reading():
+                for person_id in (a, b):
+                    if person_id not in self.graph.people:
+                        raise KeyError(person_id)
+                if self._kinship is not None:
+                    # The index memoizes results, so queries take its own lock
+                    with self._kinship_lock:
+                        return self._kinship.relate(a, b)
+            with self.lock.writing():
+                if self._kinship is None:
+                    self._kinship = KinshipIndex(self.graph)
+
+    def stats(self):
+        """Aggregate statistics of the tree (see analytics.tree_stats), computed once per version
+
+        Raises RuntimeError when NumPy is not installed.
+        """
+        with self.read() as (tree, _):
+            cached = self._stats
+            if cached is not None and cached[0] == self.revision:
+                return cached[1]
+            revision = self.revision
+            stats = dict(tree_stats(tree), version=self.version)
+        self._stats = (revision, stats)
+        return stats
+
+    def layout(self, root_id=None, mode="extended", focus=None, collapsed=()):
+        """Node positions for one view of the tree (see LayoutEngine.layout)
+
+        root_id defaults to the tree's root person. Raises KeyError when there
+        is no such person.
+        """
+        with self.read():
+            return self._view_layout(root_id, mode, focus, collapsed)
+
+    def _view_layout(self, root_id, mode, focus, collapsed):
+        """layout() for a caller already holding the read lock"""
+        people = self.tree["people"]
+        root_id = root_id or self.tree["meta"].get("rootPersonId") or (people[0]["id"] if people else None)
+        # The engine caches what it computes, so layouts take its own lock
+        with self._layout_lock:
+            if self._layout is None:
+                self._layout = LayoutEngine(self.graph, self.feed)
+            result = self._layout.layout(self.version, root_id, mode, focus, collapsed)
+        if result is None:
+            raise KeyError(focus if mode == "descendants" and focus else root_id)
+        return dict(result, root=root_id, mode=mode, focus=focus, collapsed=sorted(set(collapsed)))
+
+    def scene(self, root_id=None, mode="extended", focus=None, collapsed=()):
+        """A view laid out and ready to draw (see svg_render.Scene), built once per version
+
+        Raises KeyError like layout().
+        """
+        with self.read() as (tree, graph):
+            layout = self._view_layout(root_id, mode, focus, collapsed)
+            key = (layout["version"], layout["root"], mode, focus, frozenset(collapsed))
+            with self._layout_lock:
+                scene = self._scenes.get(key)
+            if scene is None:
+                # Hundreds of thousands of small tuples would otherwise trigger the cycle collector over and over
+                collecting = gc.isenabled()
+                gc.disable()
+                try:
+                    scene = Scene(layout, tree, graph)
+                finally:
+                    if collecting:
+                        gc.enable()
+                with self._layout_lock:
+                    self._scenes.put(key, scene)
+        return scene
+
+    def _invalidate(self):
+        """Drop cached responses after the tree changed (caller holds the write lock)"""
+        self.revision += 1
+        self._payload = None
+        self._etag = None
+
+    def etag(self):
+        """(ETag, version) of the current tree as GET serves it, without compressing anything
+
+        Taken from the payload when that is built; otherwise the tree is
+        serialized and hashed once per revision.
+        """
+        payload = self._payload
+        if payload is not None and not self._stale():
+            return payload["etag"], payload["version"]
+        with self.read() as (tree, _):
+            revision = self.revision
+            cached = self._etag
+            if cached is not None and cached[0] == revision:
+                return cached[1], cached[2]
+            version = self.version
+            body = json.dumps(tree, indent=2, ensure_ascii=False).encode('utf-8')
+        etag = _etag(body)
+        with self.lock.writing():
+            if self.revision == revision:
+                self._etag = (revision, etag, version)
+        return etag, version
+
+    def payload(self):
+        """Serialized tree plus its ETag and compressed variants, built once per revision
+
+        Returns a dict with "etag", "version", "identity", "gzip" and, when
+        the brotli package is installed, "br".
+        """
+        payload = self._payload
+        if payload is not None and not self._stale():
+            return payload
+        with self.read() as (tree, _):
+            revision = self.revision
+            version = self.version
+            payload = self._payload
+            if payload is None:
+                body = json.dumps(tree, indent=2, ensure_ascii=False).encode('utf-8')
+        if payload is not None:
+            return payload
+
+        payload = {
+            "etag": _etag(body),
+            "version": version,
+            "identity": body,
+            "gzip": gzip.compress(body, compresslevel=6, mtime=0)
+        }
+        if brotli is not None:
+            payload["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+        with self.lock.writing():
+            if self.revision == revision:
+                self._payload = payload
+        return payload
+
+    def to_json_bytes(self):
+        """Serialize the current tree the way it is written to disk"""
+        return self.payload()["identity"]
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Undo History
+Undo and redo for the interactive builder, keeping every checkpoint of the
+tree as persistent vectors that share structure instead of deep copies
+
+A PersistentVector is a 32-way trie of tuples plus a tail: appending copies
+only the tail and the path down to it, and older vectors stay valid. Each
+checkpoint holds one vector of people and one of relationships, brought up
+to date with whatever was appended since the last one, so a checkpoint costs
+O(edits) rather than O(tree) and all checkpoints together store each record once.
+"""
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+
+def _path(shift, node):
+    """A branch of single-child nodes from `shift` down to a leaf"""
+    while shift:
+        node = (node,)
+        shift -= BITS
+    return node
+
+
+class PersistentVector:
+    """An immutable list: append() and extend() return a new vector sharing all but a few nodes"""
+
+    __slots__ = ("_count", "_shift", "_root", "_tail")
+
+    def __init__(self, count=0, shift=BITS, root=(), tail=()):
+        self._count = count
+        self._shift = shift
+        self._root = root
+        self._tail = tail
+
+    def __len__(self):
+        return self._count
+
+    def _tail_offset(self):
+        return 0 if self._count < WIDTH else ((self._count - 1) >> BITS) << BITS
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("vector index out of range")
+        if index >= self._tail_offset():
+            return self._tail[index & MASK]
+        node, shift = self._root, self._shift
+        while shift:
+            node = node[(index >> shift) & MASK]
+            shift -= BITS
+        return node[index & MASK]
+
+    def __iter__(self):
+        def leaves(node, shift):
+            if not shift:
+                yield node
+                return
+            for child in node:
+                yield from leaves(child, shift - BITS)
+
+        if self._count > len(self._tail):
+            for leaf in leaves(self._root, self._shift):
+                yield from leaf
+        yield from self._tail
+
+    def append(self, item):
+        count, shift, root = self._count, self._shift, self._root
+        if count - self._tail_offset() < WIDTH:
+            return PersistentVector(count + 1, shift, root, self._tail + (item,))
+        # The tail is full: push it into the trie, growing a level if the root is full too
+        if (count >> BITS) > (1 << shift):
+            root = (root, _path(shift, self._tail))
+            shift += BITS
+        else:
+            root = self._push_tail(shift, root, self._tail)
+        return PersistentVector(count + 1, shift, root, (item,))
+
+    def _push_tail(self, shift, node, tail):
+        index = ((self._count - 1) >> shift) & MASK
+        if shift == BITS:
+            child = tail
+        elif index < len(node):
+            child = self._push_tail(shift - BITS, node[index], tail)
+        else:
+            child = _path(shift - BITS, tail)
+        return node[:index] + (child,)
+
+    def extend(self, items):
+        """A vector with every item appended, filling the tail a slice at a time"""
+        vector = self
+        items = list(items)
+        start = 0
+        while start < len(items):
+            room = WIDTH - (vector._count - vector._tail_offset())
+            if room == 0:
+                vector = vector.append(items[start])
+                start += 1
+                continue
+            taken = tuple(items[start:start + room])
+            vector = PersistentVector(vector._count + len(taken), vector._shift, vector._root, vector._tail + taken)
+            start += len(taken)
+        return vector
+
+
+EMPTY = PersistentVector()
+
+
+class Checkpoint:
+    __slots__ = ("label", "meta", "people", "relationships")
+
+    def __init__(self, label, meta, people, relationships):
+        self.label = label
+        self.meta = meta
+        self.people = people
+        self.relationships = relationships
+
+
+class UndoHistory:
+    """Checkpoints of a tree to undo back to and redo forward to
+
+    Records are treated as immutable once added to the tree, which holds for
+    the builder: its edits append people and relationships and change meta.
+    Anything else (a list replaced or shrunk) is still handled, at the cost
+    of re-reading that list.
+    """
+
+    def __init__(self, limit=100):
+        self.limit = limit
+        self.undo_stack = []
+        self.redo_stack = []
+        self._mirrors = {}  # "people"/"relationships" -> (list, vector of its current contents)
+
+    def _vector(self, tree, kind):
+        """The tree's list as a vector, extending the last one with what was appended since"""
+        items = tree[kind]
+        mirror = self._mirrors.get(kind)
+        if mirror is not None and mirror[0] is items:
+            vector = mirror[1]
+            size = len(vector)
+            if size <= len(items) and (not size or vector[size - 1] is items[size - 1]):
+                vector = vector.extend(items[size:])
+                self._mirrors[kind] = (items, vector)
+                return vector
+        vector = EMPTY.extend(items)
+        self._mirrors[kind] = (items, vector)
+        return vector
+
+    def _checkpoint(self, tree, label):
+        return Checkpoint(label, dict(tree["meta"]), self._vector(tree, "people"),
+                          self._vector(tree, "relationships"))
+
+    def record(self, tree, label):
+        """Remember the tree as it is before an edit described by label"""
+        self.undo_stack.append(self._checkpoint(tree, label))
+        del self.undo_stack[:-self.limit]
+        self.redo_stack.clear()
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self, tree):
+        """Put the tree back as it was before the last edit
+
+        Returns (label of the undone edit, changes made to the tree), or None if there is nothing to undo.
+        """
+        if not self.undo_stack:
+            return None
+        target = self.undo_stack.pop()
+        self.redo_stack.append(self._checkpoint(tree, target.label))
+        return target.label, self._restore(tree, target)
+
+    def redo(self, tree):
+        """Make the last undone edit again; returns (label, changes) or None if there is nothing to redo"""
+        if not self.redo_stack:
+            return None
+        target = self.redo_stack.pop()
+        self.undo_stack.append(self._checkpoint(tree, target.label))
+        return target.label, self._restore(tree, target)
+
+    def _restore(self, tree, target):
+        """Make the tree match a checkpoint, in place; returns the changes, as storage change ops
+
+        Only the part of each list past what the two share is touched.
+        """
+        removed, added = {}, {}
+        for kind in ("people", "relationships"):
+            items, vector = tree[kind], getattr(target, kind)
+            shared = min(len(items), len(vector))
+            if shared and vector[shared - 1] is not items[shared - 1]:
+                shared = next((i for i in range(shared) if vector[i] is not items[i]), shared)
+            removed[kind] = items[shared:]
+            added[kind] = [vector[i] for i in range(shared, len(vector))]
+            del items[shared:]
+            items.extend(added[kind])
+            self._mirrors[kind] = (items, vector)
+        tree["meta"].clear()
+        tree["meta"].update(target.meta)
+
+        # Edges go before the people they join, and people come back before their edges
+        changes = [{"op": "deleteRelationship", "relationship": rel} for rel in reversed(removed["relationships"])]
+        changes += [{"op": "deletePerson", "id": person["id"]} for person in reversed(removed["people"])]
+        changes += [{"op": "addPerson", "person": person} for person in added["people"]]
+        changes += [{"op": "addRelationship", "relationship": rel} for rel in added["relationships"]]
+        changes.append({"op": "updateMeta", "fields": dict(target.meta)})
+        return changes
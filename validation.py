@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Validation
+Linear-time consistency checks for family tree documents and single edits
+
+Every check returns a list of issues shaped like
+  {"severity": "error" | "warning", "code": ..., "message": ..., "ids": [...], "index": n}
+where "index" is the position in tree["relationships"] (or tree["people"])
+of the offending record when there is one.
+"""
+
+from collections import deque
+from collections.abc import Sequence
+
+
+class ValidationError(ValueError):
+    """Raised when a document or edit has errors; carries the full issue list"""
+
+    def __init__(self, issues):
+        self.issues = issues
+        super().__init__(summarize(errors_only(issues)) or "Invalid family tree")
+
+
+def _issue(severity, code, message, ids=(), index=None):
+    issue = {"severity": severity, "code": code, "message": message, "ids": list(ids)}
+    if index is not None:
+        issue["index"] = index
+    return issue
+
+
+def errors_only(issues):
+    return [issue for issue in issues if issue["severity"] == "error"]
+
+
+def summarize(issues, limit=3):
+    """One-line description of the first few issues"""
+    text = "; ".join(issue["message"] for issue in issues[:limit])
+    if len(issues) > limit:
+        text += f" (and {len(issues) - limit} more)"
+    return text
+
+
+def _edge_key(rel):
+    """Identity of an edge for duplicate detection, or None if malformed
+
+    Endpoints have to be strings, so the key can go in sets and be looked up.
+    """
+    if rel.get("type") == "parentChild":
+        endpoints = (rel.get("parentId"), rel.get("childId"))
+    elif rel.get("type") == "spouse" and isinstance(rel.get("people"), list) and len(rel["people"]) == 2:
+        endpoints = tuple(sorted(rel["people"], key=str))
+    else:
+        return None
+    if not all(isinstance(person_id, str) for person_id in endpoints):
+        return None
+    return (rel["type"],) + endpoints
+
+
+def _is_list(value):
+    """A JSON array, or a read-only sequence of records such as a compact tree's"""
+    return isinstance(value, Sequence) and not isinstance(value, str)
+
+
+def validate_tree(tree):
+    """Check a whole document in one O(V+E) pass
+
+    Errors: malformed records, duplicate person ids, relationships pointing
+    at unknown people, self edges and parent/child cycles. Warnings:
+    repeated relationships and a rootPersonId that is not in the tree.
+    """
+    issues = []
+    if not isinstance(tree, dict):
+        return [_issue("error", "malformed", "Tree must be a JSON object")]
+    people = tree.get("people")
+    relationships = tree.get("relationships")
+    if not _is_list(people) or not _is_list(relationships):
+        return [_issue("error", "malformed", "Tree needs 'people' and 'relationships' lists")]
+
+    ids = set()
+    for index, person in enumerate(people):
+        person_id = person.get("id") if isinstance(person, dict) else None
+        if not person_id:
+            issues.append(_issue("error", "malformed", f"Person #{index} has no id", index=index))
+        elif not isinstance(person_id, str):
+            issues.append(_issue("error", "malformed", f"Person #{index} has an id that is not a string", index=index))
+        elif person_id in ids:
+            issues.append(_issue("error", "duplicate_person",
+                                 f"Person id {person_id} is used more than once", [person_id], index))
+        else:
+            ids.add(person_id)
+
+    seen_edges = {}
+    parents = {}  # childId -> [parentId]
+    for index, rel in enumerate(relationships):
+        key = _edge_key(rel) if isinstance(rel, dict) else None
+        if key is None:
+            issues.append(_issue("error", "malformed",
+                                 f"Relationship #{index} is not a parentChild or spouse pair of person ids",
+                                 index=index))
+            continue
+        endpoints = key[1:]
+        for person_id in (endpoints if endpoints[0] != endpoints[1] else endpoints[:1]):
+            if person_id not in ids:
+                issues.append(_issue("error", "dangling_reference",
+                                     f"Relationship #{index} refers to unknown person {person_id}", [person_id], index))
+        if endpoints[0] == endpoints[1]:
+            issues.append(_issue("error", "self_edge",
+                                 f"Relationship #{index} links {endpoints[0]} to themselves", endpoints[:1], index))
+            continue
+        if key in seen_edges:
+            issues.append(_issue("warning", "duplicate_edge",
+                                 f"Relationship #{index} repeats relationship #{seen_edges[key]}", endpoints, index))
+            continue
+        seen_edges[key] = index
+        if key[0] == "parentChild":
+            parents.setdefault(key[2], []).append(key[1])
+
+    issues += cycle_issues(parents)
+
+    root = tree.get("meta", {}).get("rootPersonId") if isinstance(tree.get("meta"), dict) else None
+    if root and (not isinstance(root, str) or root not in ids):
+        issues.append(_issue("warning", "dangling_reference", f"rootPersonId {root} is not in the tree", [root]))
+
+    return issues
+
+
+def cycle_issues(parents):
+    """One error per parent/child cycle, given childId -> parentIds"""
+    return [_issue("error", "cycle", "Parent/child cycle: " + " → ".join(cycle + cycle[:1]), cycle)
+            for cycle in find_cycles(parents)]
+
+
+def find_cycles(parents):
+    """Strongly connected components of the child -> parent graph that contain a cycle
+
+    Kahn's algorithm first peels off everyone who cannot be on a cycle, then an
+    iterative Tarjan pass over what is left splits the rest into cycles. Each
+    cycle is returned as a list of ids in ancestor order.
+    """
+    nodes = set(parents)
+    for ps in parents.values():
+        nodes.update(ps)
+    children = {}
+    indegree = dict.fromkeys(nodes, 0)
+    for child_id, ps in parents.items():
+        for parent_id in ps:
+            children.setdefault(parent_id, []).append(child_id)
+            indegree[child_id] += 1
+
+    queue = deque(n for n, d in indegree.items() if d == 0)
+    while queue:
+        node = queue.popleft()
+        for child_id in children.get(node, ()):
+            indegree[child_id] -= 1
+            if indegree[child_id] == 0:
+                queue.append(child_id)
+    remaining = {n for n, d in indegree.items() if d > 0}
+    if not remaining:
+        return []
+
+    index_of, low, on_stack = {}, {}, set()
+    stack, cycles = [], []
+    counter = 0
+    for start in remaining:
+        if start in index_of:
+            continue
+        work = [(start, iter(children.get(start, ())))]
+        index_of[start] = low[start] = counter
+        counter += 1
+        stack.append(start)
+        on_stack.add(start)
+        while work:
+            node, edges = work[-1]
+            advanced = False
+            for next_id in edges:
+                if next_id not in remaining:
+                    continue
+                if next_id not in index_of:
+                    index_of[next_id] = low[next_id] = counter
+                    counter += 1
+                    stack.append(next_id)
+                    on_stack.add(next_id)
+                    work.append((next_id, iter(children.get(next_id, ()))))
+                    advanced = True
+                    break
+                if next_id in on_stack:
+                    low[node] = min(low[node], index_of[next_id])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index_of[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                if len(component) > 1:
+                    component.reverse()
+                    cycles.append(component)
+    return cycles
+
+
+def check_new_edge(graph, rel, check_cycles=True):
+    """Issues with adding one relationship to an indexed tree
+
+    Cost is bounded by the new parent's ancestors, not the tree size; bulk
+    loaders can pass check_cycles=False and run cycle_issues once at the end.
+    A new edge that repeats an existing one is an error here, since nothing
+    old has to be kept loadable.
+    """
+    key = _edge_key(rel) if isinstance(rel, dict) else None
+    if key is None:
+        return [_issue("error", "malformed", "Relationship must be parentChild or a spouse pair of person ids")]
+    endpoints = key[1:]
+    people = graph.people
+    if endpoints[0] in people and endpoints[1] in people and endpoints[0] != endpoints[1]:
+        issues = []
+    else:
+        issues = [_issue("error", "dangling_reference", f"Unknown person {pid}", [pid])
+                  for pid in (endpoints if endpoints[0] != endpoints[1] else endpoints[:1]) if pid not in people]
+    if endpoints[0] == endpoints[1]:
+        issues.append(_issue("error", "self_edge", f"{endpoints[0]} cannot be related to themselves", endpoints[:1]))
+    if issues:
+        return issues
+
+    if key[0] == "spouse":
+        if endpoints[1] in graph.spouses.get(endpoints[0], ()):
+            issues.append(_issue("error", "duplicate_edge",
+                                 f"{endpoints[0]} and {endpoints[1]} are already spouses", endpoints))
+        return issues
+
+    parent_id, child_id = endpoints
+    if child_id in graph.children.get(parent_id, ()):
+        issues.append(_issue("error", "duplicate_edge",
+                             f"{parent_id} is already a parent of {child_id}", endpoints))
+        return issues
+    if not check_cycles:
+        return issues
+    # A cycle appears exactly when the child is already an ancestor of the parent
+    for ancestor_id, _ in graph.ancestors(parent_id):
+        if ancestor_id == child_id:
+            issues.append(_issue("error", "cycle",
+                                 f"{child_id} is already an ancestor of {parent_id}", [child_id, parent_id]))
+            break
+    return issues